@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""Benchmark losser on a corpus made by repeating the example input.json file.
+
+Usage:
+
+    python bin/benchmark.py [--copies N] [--repeat N]
+
+Each benchmark is run on the same corpus and the best time out of --repeat
+runs is reported.
+
+"""
+from __future__ import absolute_import
+
+import argparse
+import cStringIO
+import json
+import os
+import os.path
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import losser.backends as backends
+import losser.losser as losser
+import losser.readers as readers
+import losser.rowcache as rowcache
+import losser.writers as writers
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+INPUT_FILE = os.path.join(HERE, '..', 'input.json')
+COLUMNS_FILE = os.path.join(HERE, '..', 'columns.json')
+
+
+def _make_corpus(copies):
+    """Write the corpus to a temporary file and return the file's path."""
+    objects = json.loads(open(INPUT_FILE).read()) * copies
+    fd, path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(objects, f)
+    return path
+
+
+def _decode_benchmarks(path):
+    """Return benchmark functions for decoding the corpus with each backend.
+
+    Each backend is timed both streaming the corpus file and decoding it from
+    one string (as when the input comes from stdin).
+
+    """
+    benchmarks = []
+    text = open(path).read()
+    for name in backends.available():
+        backend = backends.get(name)
+
+        def stream(backend=backend):
+            for _ in readers.load(path, backend=backend):
+                pass
+
+        def loads(backend=backend):
+            backend.loads(text)
+
+        benchmarks.append(("decode stream ({0})".format(name), stream))
+        benchmarks.append(("decode string ({0})".format(name), loads))
+
+    keys = losser.compile_columns(COLUMNS_FILE).wants_key
+
+    def stream_keys():
+        for _ in readers.load(path, keys=keys):
+            pass
+
+    benchmarks.append(("decode stream (columns.json keys only)", stream_keys))
+    return benchmarks
+
+
+def _table_benchmarks(path):
+    """Return benchmark functions for evaluating columns.json on the corpus.
+
+    """
+    dicts = list(readers.load(path))
+    columns = losser._normalise_columns(COLUMNS_FILE)
+
+    def query_per_cell():
+        for d in dicts:
+            for spec in columns.values():
+                losser.query(dict_=d, **spec)
+
+    def table_batch():
+        plan = losser.compile_columns(columns)
+        for _ in losser.iter_table(dicts, plan):
+            pass
+
+    def recursive_descent():
+        plan = losser.compile_columns(
+            {"Formats": dict(pattern_path=["**", "^format$"])})
+        for _ in losser.iter_table(dicts, plan):
+            pass
+
+    return [
+        ("rows (query() per cell)", query_per_cell),
+        ("rows (compiled plan, batched)", table_batch),
+        ("rows (** recursive descent)", recursive_descent),
+    ]
+
+
+def _cache_benchmarks(path):
+    """Return benchmark functions for evaluating columns with a warm
+    --row-cache, and without one to compare.
+
+    The columns are timed both as they are in columns.json, which are cheap
+    to evaluate, and with a column that searches the whole of each object
+    added, which is what the cache is for.
+
+    """
+    # Make each object distinct, as in a real export, so that each one has
+    # its own cells in the cache.
+    dicts = [dict(d, losser_benchmark_id=i)
+             for i, d in enumerate(readers.load(path))]
+    columns = losser._normalise_columns(COLUMNS_FILE)
+    expensive_columns = dict(columns, URLs=dict(
+        pattern_path=["**", "url$"], deduplicate=True,
+        transforms=["strip", "lower"]))
+    fd, cache_path = tempfile.mkstemp(suffix='.cache')
+    os.close(fd)
+
+    def row_cache(columns):
+        cache = rowcache.RowCache(cache_path)
+        try:
+            for _ in cache.iter_table(dicts, columns):
+                pass
+        finally:
+            cache.close()
+
+    def no_cache(columns):
+        for _ in losser.iter_table(dicts, columns):
+            pass
+
+    # Warm the cache up.
+    row_cache(columns)
+    row_cache(expensive_columns)
+    return [
+        ("rows (no cache)", lambda: no_cache(columns)),
+        ("rows (warm row cache)", lambda: row_cache(columns)),
+        ("rows (no cache, + ** column)",
+         lambda: no_cache(expensive_columns)),
+        ("rows (warm row cache, + ** column)",
+         lambda: row_cache(expensive_columns)),
+    ], cache_path
+
+
+def _csv_benchmarks(path):
+    """Return benchmark functions for writing the corpus's table as CSV."""
+    dicts = list(readers.load(path))
+    rows = losser.table(dicts, COLUMNS_FILE)
+    tuples = losser.table(dicts, COLUMNS_FILE, layout="tuples")
+
+    def csv_writer():
+        writers.CSVWriter(cStringIO.StringIO()).writerows(rows)
+
+    def fast_csv_writer():
+        writer = writers.FastCSVWriter(cStringIO.StringIO())
+        writer.writerows(rows)
+        writer.close()
+
+    def fast_csv_writer_tuples():
+        writer = writers.FastCSVWriter(cStringIO.StringIO(), tuples.header)
+        writer.writetuples(tuples.rows)
+        writer.close()
+
+    return [
+        ("csv (CSVWriter)", csv_writer),
+        ("csv (FastCSVWriter, dict rows)", fast_csv_writer),
+        ("csv (FastCSVWriter, tuple rows)", fast_csv_writer_tuples),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--copies", type=int, default=200,
+                        help="how many copies of input.json to put in the "
+                             "corpus")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    path = _make_corpus(args.copies)
+    cache_path = None
+    try:
+        print("Corpus: {0} bytes".format(os.path.getsize(path)))
+        cache_benchmarks, cache_path = _cache_benchmarks(path)
+        benchmarks = (_decode_benchmarks(path) + _table_benchmarks(path) +
+                      cache_benchmarks + _csv_benchmarks(path))
+        for title, benchmark in benchmarks:
+            seconds = min(timeit.repeat(benchmark, number=1,
+                                        repeat=args.repeat))
+            print("{0:<40} {1:8.3f}s".format(title, seconds))
+    finally:
+        os.remove(path)
+        if cache_path:
+            os.remove(cache_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Pluggable JSON decoder backends.
+
+losser decodes JSON with the standard library's json module by default, but
+if a faster JSON library is installed it can use that instead.
+
+ujson and orjson can only decode whole strings, so when streaming an input
+file losser has to find where each value ends itself before handing it to
+them, which is usually slower than letting json or simplejson decode straight
+out of the read-ahead window. The "auto" backend therefore picks simplejson
+(with its C speedups) if it's installed and falls back to json, while ujson
+and orjson have to be asked for by name.
+
+"""
+from __future__ import absolute_import
+
+import collections
+import json
+
+
+#: The names of all the supported backends.
+BACKENDS = ('simplejson', 'orjson', 'ujson', 'json')
+
+AUTO = 'auto'
+
+# The backends that "auto" chooses from, in order of preference.
+_AUTO_BACKENDS = ('simplejson', 'json')
+
+
+class UnavailableBackendError(Exception):
+
+    """Raised when asking for a JSON backend that isn't installed."""
+
+    pass
+
+
+class Backend(object):
+
+    """A JSON decoder backend.
+
+    :ivar name: the name of the backend, e.g. "json" or "ujson"
+
+    :ivar loads: a function that decodes a string of JSON text
+
+    :ivar raw_decode: a function like json.JSONDecoder.raw_decode() that
+        decodes the JSON value that starts at index idx of a string and
+        returns the value and the index where it ended, or None if the backend
+        can't decode part of a string. Without raw_decode() the streaming
+        readers find where each value ends themselves and then call loads().
+
+    :ivar ordered_loads: like loads() but decodes JSON objects into
+        OrderedDicts (used for columns.json files, where the order of the
+        columns matters)
+
+    """
+
+    def __init__(self, name, loads, raw_decode=None, ordered_loads=None):
+        self.name = name
+        self.loads = loads
+        self.raw_decode = raw_decode
+        self.ordered_loads = ordered_loads or _ordered_loads
+
+    def __repr__(self):
+        return "<losser JSON backend {0!r}>".format(self.name)
+
+
+def _ordered_loads(s):
+    return json.loads(s, object_pairs_hook=collections.OrderedDict)
+
+
+def _make_backend(name):
+    """Return a Backend for the named library or raise ImportError."""
+    if name == 'json':
+        return Backend(name, json.loads, json.JSONDecoder().raw_decode)
+    elif name == 'simplejson':
+        import simplejson
+        return Backend(
+            name, simplejson.loads, simplejson.JSONDecoder().raw_decode,
+            lambda s: simplejson.loads(
+                s, object_pairs_hook=collections.OrderedDict))
+    elif name == 'ujson':
+        import ujson
+        return Backend(name, ujson.loads)
+    elif name == 'orjson':
+        import orjson
+        return Backend(name, orjson.loads)
+    else:
+        raise UnavailableBackendError(
+            "Unknown JSON backend {0!r}, the available backends are: "
+            "{1}".format(name, ", ".join((AUTO,) + BACKENDS)))
+
+
+_cache = {}
+
+
+def get(name=None):
+    """Return the named JSON backend.
+
+    :param name: one of the names in BACKENDS, or "auto" (the default) for
+        the fastest streaming backend that's installed
+    :type name: string
+
+    :raises UnavailableBackendError: if the named backend isn't installed
+
+    """
+    name = name or AUTO
+    if name not in _cache:
+        if name == AUTO:
+            for backend_name in _AUTO_BACKENDS:
+                try:
+                    _cache[name] = get(backend_name)
+                    break
+                except UnavailableBackendError:
+                    pass
+        else:
+            try:
+                _cache[name] = _make_backend(name)
+            except ImportError:
+                raise UnavailableBackendError(
+                    "The {0} JSON backend isn't installed".format(name))
+    return _cache[name]
+
+
+def available():
+    """Return the names of the backends that are installed."""
+    names = []
+    for name in BACKENDS:
+        try:
+            get(name)
+        except UnavailableBackendError:
+            continue
+        names.append(name)
+    return names
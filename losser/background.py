@@ -0,0 +1,180 @@
+"""Compute table rows in a background thread, for use in web apps.
+
+Calling table() from a request handler blocks the handler until the whole
+table is done. iter_table_in_background() instead computes the rows in
+batches in a worker thread and hands them over as they're ready, and
+writers.iter_csv() turns them into chunks of CSV text that can be streamed
+straight into an HTTP response. For example in a WSGI app::
+
+    def export(environ, start_response):
+        rows = losser.background.iter_table_in_background(datasets, columns)
+        start_response('200 OK', [('Content-Type', 'text/csv')])
+        return losser.writers.iter_csv(rows)
+
+Iterating over iter_table_in_background() still blocks while the caller
+waits for each batch, so it only suits servers with a thread per request.
+An event loop should use a BackgroundTable instead and poll() it for
+finished batches from a callback that the loop schedules, so that the loop
+never waits for a batch.
+
+Either way the rows are computed by Python code in a thread, so on CPython
+the worker and the caller's thread take turns holding the GIL: the caller
+stays responsive but both run slower than they would alone.
+
+"""
+from __future__ import absolute_import
+
+import Queue
+import sys
+import threading
+
+import losser.losser as losser
+
+
+_DONE = object()
+
+
+def iter_table_in_background(dicts, columns, batch_size=500, max_batches=2):
+    """Like iter_table() but computes the rows in a background thread.
+
+    The rows are computed ``batch_size`` at a time and the worker thread
+    stays at most ``max_batches`` batches ahead of the caller, so memory use
+    is bounded even if the caller consumes the rows slowly. If the caller
+    stops iterating early the worker thread stops too.
+
+    The returned iterator blocks while it waits for each batch, see
+    BackgroundTable for a way to take the rows without blocking.
+
+    ``dicts`` is iterated over in the worker thread, not the caller's thread.
+
+    :param batch_size: the number of rows to hand over to the caller at once
+    :type batch_size: int
+
+    :param max_batches: the maximum number of finished batches waiting for the
+        caller
+    :type max_batches: int
+
+    :raises: any exception raised while computing the rows, when the caller
+        reaches the row where it happened
+
+    See table() for the other params.
+
+    """
+    return iter(BackgroundTable(dicts, columns, batch_size=batch_size,
+                                max_batches=max_batches))
+
+
+class BackgroundTable(object):
+
+    """A table whose rows are computed in batches in a background thread.
+
+    The worker thread starts straight away and stays at most
+    ``max_batches`` batches ahead of the caller. Take the finished batches
+    either by iterating over the BackgroundTable, which blocks until each
+    batch is ready, or by calling poll(), which never blocks. For example
+    with an event loop::
+
+        table_ = losser.background.BackgroundTable(datasets, columns)
+
+        def check():
+            batch = table_.poll()
+            if batch:
+                send_rows(batch)
+            if not table_.done:
+                loop.call_later(0.05, check)
+
+    Call close() to stop the worker thread if you stop taking batches before
+    the table is done.
+
+    ``dicts`` is iterated over in the worker thread, not the caller's thread.
+
+    See iter_table_in_background() for the params.
+
+    """
+
+    def __init__(self, dicts, columns, batch_size=500, max_batches=2):
+        # Compile the columns in the caller's thread so that any errors in
+        # them are raised straight away.
+        columns = losser.compile_columns(columns)
+
+        #: True once all of the rows have been handed over (or the worker
+        #: has raised).
+        self.done = False
+
+        self._batches = Queue.Queue(max_batches)
+        self._stopped = threading.Event()
+        worker = threading.Thread(target=self._work,
+                                  args=(dicts, columns, batch_size))
+        worker.daemon = True
+        worker.start()
+
+    def _put(self, item):
+        """Put item on the queue, or give up if the caller has stopped."""
+        while not self._stopped.is_set():
+            try:
+                self._batches.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _work(self, dicts, columns, batch_size):
+        try:
+            batch = []
+            for row in losser.iter_table(dicts, columns,
+                                         batch_size=batch_size):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    if not self._put(batch):
+                        return
+                    batch = []
+            if batch and not self._put(batch):
+                return
+            self._put(_DONE)
+        except BaseException:
+            self._put(sys.exc_info())
+
+    def _take(self, item):
+        """Return the batch of rows from an item taken off the queue, or None
+        if it's the end of the table.
+
+        """
+        if item is _DONE:
+            self.done = True
+            return None
+        elif isinstance(item, tuple):
+            self.done = True
+            exc_type, exc_value, exc_traceback = item
+            raise exc_type, exc_value, exc_traceback
+        return item
+
+    def poll(self):
+        """Return the next batch of rows if it's ready, without waiting.
+
+        Returns None if the next batch isn't ready yet, or if the table is
+        done (see ``done``).
+
+        :raises: any exception raised while computing the rows, in place of
+            the batch where it happened
+
+        """
+        if self.done:
+            return None
+        try:
+            item = self._batches.get_nowait()
+        except Queue.Empty:
+            return None
+        return self._take(item)
+
+    def close(self):
+        """Stop the worker thread."""
+        self._stopped.set()
+
+    def __iter__(self):
+        try:
+            while not self.done:
+                batch = self._take(self._batches.get())
+                for row in batch or []:
+                    yield row
+        finally:
+            self.close()
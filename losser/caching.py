@@ -0,0 +1,65 @@
+"""Helpers shared by the caches in losser.rowcache and losser.incremental."""
+from __future__ import absolute_import
+
+import datetime
+import hashlib
+import json
+
+import losser.transforms as transforms
+
+
+#: The maximum number of keys to look up in one sqlite query (sqlite's limit
+#: on the number of parameters in a query is 999).
+LOOKUP_SIZE = 500
+
+# The key of the JSON objects that stand for datetimes in dump_json()'s
+# output.
+_DATETIME = "__datetime__"
+
+# isoformat() leaves the microseconds out when they're 0.
+_ISOFORMATS = ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S")
+
+
+def _json_default(value):
+    # Not strftime(), which doesn't do years before 1900 in Python 2.
+    if isinstance(value, datetime.datetime):
+        return {_DATETIME: value.isoformat()}
+    raise TypeError("{0!r} is not JSON serializable".format(value))
+
+
+def _json_object_hook(dict_):
+    if _DATETIME in dict_:
+        return transforms.parse_date(dict_[_DATETIME], _ISOFORMATS)
+    return dict_
+
+
+def dump_json(value):
+    """Return cell values as JSON, for caching. See load_json().
+
+    Unlike plain json, the datetimes from "datetime" columns survive the
+    round trip.
+
+    """
+    return json.dumps(value, default=_json_default)
+
+
+# json.loads() makes a new decoder each time it's given an object_hook.
+_decode = json.JSONDecoder(object_hook=_json_object_hook).decode
+
+
+def load_json(text):
+    """Return the cell values from dump_json()'s JSON text."""
+    return _decode(text)
+
+
+def digest(value):
+    """Return a hash of the given column spec (or other JSON-like value).
+
+    Anything that can't be serialised (such as string_transformations
+    functions) is represented by its repr(), which includes its address, so
+    it won't match from one process to the next. That just means a cache
+    keyed by the digest isn't reused, rather than that stale rows are.
+
+    """
+    return hashlib.sha1(
+        json.dumps(value, sort_keys=True, default=repr)).hexdigest()
@@ -3,11 +3,21 @@ from __future__ import absolute_import
 
 import argparse
 import collections
+import copy
+import cStringIO
+import glob
+import itertools
 import json
 import sys
 import StringIO
 
+import losser.backends as backends
+import losser.incremental as incremental
 import losser.losser as losser
+import losser.parallel as parallel
+import losser.readers as readers
+import losser.rowcache as rowcache
+import losser.writers as writers
 
 
 class CommandLineError(Exception):
@@ -67,6 +77,38 @@ class ColumnsAndColumnsFileError(CommandLineError):
     pass
 
 
+class JSONBackendError(CommandLineError):
+    pass
+
+
+class InvalidShardingError(CommandLineError):
+    pass
+
+
+class InvalidPartitionError(CommandLineError):
+    pass
+
+
+class InvalidFormatError(CommandLineError):
+    pass
+
+
+class InvalidPrettyWidthError(CommandLineError):
+    pass
+
+
+class InvalidLimitError(CommandLineError):
+    pass
+
+
+class InvalidWhereError(CommandLineError):
+    pass
+
+
+class InvalidCacheError(CommandLineError):
+    pass
+
+
 def _boolify(key, value, option_string):
 
     key = key.replace('-', '_')
@@ -147,6 +189,9 @@ class ColumnsAction(argparse.Action):
             if key == 'max-length':
                 key, value = _int(key, value, option_string)
 
+            if key == 'replace':
+                value = dict(pattern=value[0], replacement=value[1])
+
             column[key] = value
 
 
@@ -188,8 +233,17 @@ def make_parser(add_help=True, exclude_args=None):
     if ("-i" not in exclude_args) and ("--input" not in exclude_args):
         parser.add_argument(
             "-i", "--input",
-            help="read input from the given file instead of from stdin",
+            help="read input from the given file(s) instead of from stdin. "
+                 "Can be given more than once and can be a glob pattern, "
+                 "multiple files are processed in parallel",
             dest='input_data',  # Because input is a Python builtin.
+            nargs='+', action='append',
+        )
+    if ("-j" not in exclude_args) and ("--jobs" not in exclude_args):
+        parser.add_argument(
+            "-j", "--jobs", type=int,
+            help="the number of processes to use when reading multiple "
+                 "input files (default: the number of CPUs)",
         )
     if ("-c" not in exclude_args) and ("--column" not in exclude_args):
         parser.add_argument("-c", "--column", action=ColumnsAction)
@@ -206,11 +260,186 @@ def make_parser(add_help=True, exclude_args=None):
             "--case-sensitive", nargs='?', action=ColumnsAction)
     if "--unique" not in exclude_args:
         parser.add_argument("--unique", nargs="?", action=ColumnsAction)
+    if "--replace" not in exclude_args:
+        parser.add_argument(
+            "--replace", nargs=2, action=ColumnsAction,
+            metavar=("REGEX", "REPLACEMENT"),
+            help="replace each match of REGEX in the column's strings with "
+                 "REPLACEMENT",
+        )
+    if "--type" not in exclude_args:
+        parser.add_argument(
+            "--type", action=ColumnsAction, choices=losser.TYPES,
+            help="convert the column's values to the given type",
+        )
+    if "--errors" not in exclude_args:
+        parser.add_argument(
+            "--errors", action=ColumnsAction, choices=losser.ERRORS,
+            help="what to do with values that can't be converted to the "
+                 "column's --type: output nothing (the default), output "
+                 "them as they are, or stop with an error",
+        )
+    if "--separator" not in exclude_args:
+        parser.add_argument(
+            "--separator", action=ColumnsAction,
+            help="the string to join the column's lists of values with in "
+                 "CSV output (default: ', ')",
+        )
+    if "--join" not in exclude_args:
+        parser.add_argument(
+            "--join", action=ColumnsAction, choices=losser.JOINS,
+            help="how to join the column's lists of values in CSV output: "
+                 "with the --separator (the default) or as a JSON list",
+        )
+    if "--where" not in exclude_args:
+        parser.add_argument(
+            "--where", nargs="+", action="append", metavar="ARG",
+            help="only output rows for the input objects that match the "
+                 "given condition, for example: --where '^state$' = active. "
+                 "The condition is a pattern path followed by = VALUE, "
+                 "!= VALUE, ~ REGEX, < NUMBER, <= NUMBER, > NUMBER, "
+                 ">= NUMBER, exists or missing. Can be given more than once",
+        )
     if ("-p" not in exclude_args) and ("--pretty" not in exclude_args):
         parser.add_argument("-p", "--pretty", action="store_true")
+    if "--pretty-width" not in exclude_args:
+        parser.add_argument(
+            "--pretty-width", type=int, metavar="N",
+            help="with --pretty, truncate cells to at most N characters "
+                 "(default: as wide as the widest cell in the first 100 "
+                 "rows)",
+        )
+    if ("-o" not in exclude_args) and ("--output" not in exclude_args):
+        parser.add_argument(
+            "-o", "--output",
+            help="write the output to the given file instead of to stdout",
+        )
+    if "--shard-rows" not in exclude_args:
+        parser.add_argument(
+            "--shard-rows", type=int, metavar="N",
+            help="split the --output CSV into numbered files of at most N "
+                 "rows each",
+        )
+    if "--shard-bytes" not in exclude_args:
+        parser.add_argument(
+            "--shard-bytes", type=int, metavar="N",
+            help="split the --output CSV into numbered files of at most N "
+                 "bytes each",
+        )
+    if "--format" not in exclude_args:
+        parser.add_argument(
+            "--format", dest="output_format", default="csv",
+            choices=("csv", "json", "jsonl", "parquet"),
+            help="the output format (default: csv). jsonl is JSON Lines (one "
+                 "JSON object per line). parquet needs an --output file and "
+                 "pyarrow to be installed",
+        )
+    if "--partition-by" not in exclude_args:
+        parser.add_argument(
+            "--partition-by", metavar="COLUMN",
+            help="write the rows to a separate --output file for each "
+                 "value of the given column",
+        )
+    if "--limit" not in exclude_args:
+        parser.add_argument(
+            "--limit", type=int, metavar="N",
+            help="only output the first N rows (of the objects that pass "
+                 "any filters), and stop reading the input after them",
+        )
+    if "--sample" not in exclude_args:
+        parser.add_argument(
+            "--sample", type=int, metavar="N",
+            help="only output the rows for a random sample of N of the "
+                 "input objects that pass any filters",
+        )
+    if "--incremental" not in exclude_args:
+        parser.add_argument(
+            "--incremental", metavar="CACHE_FILE",
+            help="remember each input object's row in the given cache file, "
+                 "and on later runs only re-evaluate the columns for objects "
+                 "that are new or have changed",
+        )
+    if "--incremental-id" not in exclude_args:
+        parser.add_argument(
+            "--incremental-id", nargs="+", metavar="PATTERN",
+            default=["^id$"],
+            help="with --incremental, the pattern path of each object's "
+                 "unique id (default: ^id$)",
+        )
+    if "--incremental-marker" not in exclude_args:
+        parser.add_argument(
+            "--incremental-marker", nargs="+", metavar="PATTERN",
+            default=["^metadata_modified$"],
+            help="with --incremental, the pattern path of a value that "
+                 "changes whenever an object changes (default: "
+                 "^metadata_modified$). Pass --incremental-marker hash to use "
+                 "a hash of each object's contents instead",
+        )
+    if "--row-cache" not in exclude_args:
+        parser.add_argument(
+            "--row-cache", metavar="CACHE_FILE",
+            help="remember every evaluated cell in the given cache file, and "
+                 "reuse them for the same objects and columns in later runs, "
+                 "even with a different columns file",
+        )
+    if "--json-backend" not in exclude_args:
+        parser.add_argument(
+            "--json-backend", default=backends.AUTO,
+            choices=(backends.AUTO,) + backends.BACKENDS,
+            help="the JSON library to decode the input with (default: "
+                 "simplejson if it's installed, otherwise json)",
+        )
     return parser
 
 
+_WHERE_OPERATORS = {
+    "=": "equals",
+    "!=": "not_equals",
+    "~": "regex",
+    "<": "lt",
+    "<=": "le",
+    ">": "gt",
+    ">=": "ge",
+}
+
+
+def _where_filter(args):
+    """Return the filter dict for the arguments of one --where option."""
+    if args[-1] in ("exists", "missing"):
+        pattern_path = args[:-1]
+        test, value = "exists", args[-1] == "exists"
+    elif len(args) >= 3 and args[-2] in _WHERE_OPERATORS:
+        pattern_path = args[:-2]
+        test, value = _WHERE_OPERATORS[args[-2]], args[-1]
+        if test in ("equals", "not_equals"):
+            # Allow matching JSON values like false, null or 10, as well as
+            # strings.
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        elif test in ("lt", "le", "gt", "ge"):
+            try:
+                value = float(value)
+            except ValueError:
+                raise InvalidWhereError(
+                    "--where {0} needs a number, not {1}".format(
+                        args[-2], value))
+    else:
+        raise InvalidWhereError(
+            "--where needs a pattern path followed by a condition, for "
+            "example: --where '^state$' = active")
+    if not pattern_path:
+        raise InvalidWhereError("--where needs a pattern path")
+
+    filter_ = {"pattern_path": list(pattern_path), test: value}
+    try:
+        losser.compile_filter(filter_)
+    except losser.InvalidFilterError as err:
+        raise InvalidWhereError(str(err))
+    return filter_
+
+
 def parse(parser=None, args=None):
     """Parse the command line arguments, return an argparse namespace object.
 
@@ -279,16 +508,286 @@ def parse(parser=None, args=None):
     else:
         assert columns
 
+    where = getattr(parsed_args, "where", None)
+    if where:
+        filters = [_where_filter(args) for args in where]
+        columns = parsed_args.columns
+        if isinstance(columns, basestring):
+            columns = losser._read_columns_file(columns)
+        columns[losser.FILTERS] = (
+            list(columns.get(losser.FILTERS, [])) + filters)
+        parsed_args.columns = columns
+
+    shard_rows = getattr(parsed_args, "shard_rows", None)
+    shard_bytes = getattr(parsed_args, "shard_bytes", None)
+    if shard_rows is not None or shard_bytes is not None:
+        if (shard_rows is not None and shard_rows < 1) or (
+                shard_bytes is not None and shard_bytes < 1):
+            raise InvalidShardingError(
+                "--shard-rows and --shard-bytes must be positive integers")
+        if not getattr(parsed_args, "output", None):
+            raise InvalidShardingError(
+                "You need an --output file to use --shard-rows or "
+                "--shard-bytes")
+        if parsed_args.pretty:
+            raise InvalidShardingError(
+                "You can't use --shard-rows or --shard-bytes with --pretty")
+        if _has_multiple_columns(parsed_args.columns):
+            # Each shard's header has to be written before the later rows
+            # (which may add columns) have been seen.
+            raise InvalidShardingError(
+                "You can't use --shard-rows or --shard-bytes with "
+                "return_multiple_columns columns")
+
+    pretty_width = getattr(parsed_args, "pretty_width", None)
+    if pretty_width is not None and pretty_width < 1:
+        raise InvalidPrettyWidthError(
+            "--pretty-width must be a positive integer")
+
+    limit = getattr(parsed_args, "limit", None)
+    sample = getattr(parsed_args, "sample", None)
+    if (limit is not None and limit < 1) or (
+            sample is not None and sample < 1):
+        raise InvalidLimitError(
+            "--limit and --sample must be positive integers")
+    if limit is not None and sample is not None:
+        raise InvalidLimitError("You can't use --limit and --sample together")
+    if (limit is not None or sample is not None) and getattr(
+            parsed_args, "incremental", None):
+        # Otherwise everything else would be removed from the cache.
+        raise InvalidLimitError(
+            "You can't use --limit or --sample with --incremental")
+    if getattr(parsed_args, "incremental", None) and getattr(
+            parsed_args, "row_cache", None):
+        raise InvalidCacheError(
+            "You can't use --incremental and --row-cache together")
+
+    output_format = getattr(parsed_args, "output_format", "csv")
+    if output_format != "csv":
+        if output_format == "parquet" and not getattr(
+                parsed_args, "output", None):
+            raise InvalidFormatError(
+                "You need an --output file to use --format parquet")
+        if (parsed_args.pretty or shard_rows is not None or
+                shard_bytes is not None or
+                getattr(parsed_args, "partition_by", None)):
+            raise InvalidFormatError(
+                "You can't use --format {0} with --pretty, --shard-rows, "
+                "--shard-bytes or --partition-by".format(output_format))
+
+    if getattr(parsed_args, "partition_by", None):
+        if not getattr(parsed_args, "output", None):
+            raise InvalidPartitionError(
+                "You need an --output file to use --partition-by")
+        if parsed_args.pretty:
+            raise InvalidPartitionError(
+                "You can't use --partition-by with --pretty")
+        if shard_rows is not None or shard_bytes is not None:
+            raise InvalidPartitionError(
+                "You can't use --partition-by with --shard-rows or "
+                "--shard-bytes")
+        if _has_multiple_columns(parsed_args.columns):
+            raise InvalidPartitionError(
+                "You can't use --partition-by with return_multiple_columns "
+                "columns")
+
     return parsed_args
 
 
-def do(parser=None, args=None, in_=None, table_function=None):
+def _input_files(input_args):
+    """Return the list of input file paths from the --input arguments.
+
+    Glob patterns are expanded (in sorted order), anything that doesn't match
+    any files is passed through as is so that trying to open it will fail
+    with a helpful error.
+
+    """
+    paths = []
+    for arg in itertools.chain.from_iterable(input_args or []):
+        paths.extend(sorted(glob.glob(arg)) or [arg])
+    return paths
+
+
+def _wanted_keys(columns):
+    """Return a function that says whether the columns use a top-level key.
+
+    Returns None if the columns can't be compiled, leaving table() to report
+    the error.
+
+    """
+    try:
+        # Compiling normalises the column dicts in place, so compile a copy.
+        return losser.compile_columns(copy.deepcopy(columns)).wants_key
+    except losser.InvalidColumnsFileError:
+        return None
+
+
+def _has_multiple_columns(columns):
+    """Return True if any of the columns has return_multiple_columns.
+
+    The titles of such columns' cells depend on the input, so rows can have
+    columns that earlier rows didn't. Returns False if the columns can't be
+    compiled.
+
+    """
+    try:
+        plan = losser.compile_columns(copy.deepcopy(columns))
+    except losser.InvalidColumnsFileError:
+        return False
+    return any(column.return_multiple_columns for column in plan.columns)
+
+
+def _titles(columns):
+    """Return the columns' titles, or None if they depend on the input (see
+    _has_multiple_columns()) or the columns can't be compiled.
+
+    """
+    try:
+        plan = losser.compile_columns(copy.deepcopy(columns))
+    except losser.InvalidColumnsFileError:
+        return None
+    if any(column.return_multiple_columns for column in plan.columns):
+        return None
+    return plan.titles
+
+
+def _joiners(columns):
+    """Return the columns' joiners (see losser.Plan.joiners).
+
+    Returns None if the columns can't be compiled.
+
+    """
+    try:
+        return losser.compile_columns(copy.deepcopy(columns)).joiners
+    except losser.InvalidColumnsFileError:
+        return None
+
+
+def _read_input(input_files, backend, in_, limit=None, sample=None,
+                keys=None, columns=None):
+    """Return the input objects from the input file(s), or from stdin.
+
+    If ``limit`` is given only the first ``limit`` objects that pass the
+    filters of ``columns`` are returned, and if ``sample`` is given only a
+    random sample of ``sample`` of them. If ``keys`` is given any top-level
+    keys that it rejects are dropped from the objects as they're decoded.
+
+    """
+    # Input files are memory-mapped and decoded lazily rather than read into
+    # memory all at once, so with a limit the rest of the input never gets
+    # decoded at all.
+    if len(input_files) == 1:
+        dicts = readers.load(input_files[0], backend=backend, keys=keys)
+    elif input_files:
+        dicts = itertools.chain.from_iterable(
+            readers.load(path, backend=backend, keys=keys)
+            for path in input_files)
+    else:
+        dicts = readers.loads(in_.read(), backend=backend, keys=keys)
+
+    if limit is None and sample is None:
+        return dicts
+    # The filters are applied first so that there are N rows, rather than N
+    # objects some of which are then filtered out.
+    dicts = losser.compile_columns(copy.deepcopy(columns)).select(dicts)
+    if limit is not None:
+        return itertools.islice(dicts, limit)
+    return readers.sample(dicts, sample)
+
+
+def _write_rows(rows, parsed_args, out=None):
+    """Write the rows to the --output file, or to shards or partitions of it.
+
+    If ``out`` is given the rows are written to it instead of to the --output
+    file (this doesn't work with sharding or partitioning).
+
+    """
+    shard_rows = getattr(parsed_args, "shard_rows", None)
+    shard_bytes = getattr(parsed_args, "shard_bytes", None)
+    partition_by = getattr(parsed_args, "partition_by", None)
+    output_format = getattr(parsed_args, "output_format", "csv")
+
+    joiners = _joiners(parsed_args.columns)
+
+    f = None
+    if output_format == "parquet":
+        try:
+            writer = writers.ParquetWriter(
+                parsed_args.output, fieldnames=_titles(parsed_args.columns))
+        except ImportError:
+            raise InvalidFormatError(
+                "--format parquet needs pyarrow to be installed")
+    elif partition_by:
+        writer = writers.PartitionedCSVWriter(
+            parsed_args.output, partition_by, joiners=joiners)
+    elif shard_rows or shard_bytes:
+        writer = writers.ShardedCSVWriter(
+            parsed_args.output, shard_rows=shard_rows, shard_bytes=shard_bytes,
+            joiners=joiners)
+    else:
+        if out is None:
+            out = f = open(parsed_args.output, 'wb')
+        fieldnames = None
+        if ((parsed_args.pretty or output_format == "csv") and
+                _has_multiple_columns(parsed_args.columns)):
+            # The header is normally taken from the first rows, but later
+            # rows can add columns, so collect all the rows and their titles
+            # first (like table() does).
+            rows = list(rows)
+            if rows:
+                fieldnames = losser._csv_fieldnames(rows)
+        if parsed_args.pretty:
+            writer = writers.PrettyWriter(
+                out, max_width=getattr(parsed_args, "pretty_width", None),
+                joiners=joiners, fieldnames=fieldnames)
+        elif output_format == "csv":
+            writer = writers.FastCSVWriter(out, fieldnames, joiners=joiners)
+        else:
+            writer = {
+                "json": writers.JSONWriter,
+                "jsonl": writers.JSONLinesWriter,
+            }[output_format](out)
+
+    try:
+        writer.writerows(rows)
+    finally:
+        writer.close()
+        if f is not None:
+            f.close()
+
+
+def _output_rows(rows, parsed_args, out):
+    """Write the rows to the --output file or to out, or return them.
+
+    Returns an empty string if the rows were written to a file, or the
+    formatted rows as a string if there's neither an --output file nor out.
+
+    """
+    if getattr(parsed_args, "output", None):
+        _write_rows(rows, parsed_args)
+        return ""
+    if out is not None:
+        _write_rows(rows, parsed_args, out=out)
+        return ""
+    buffer_ = cStringIO.StringIO()
+    _write_rows(rows, parsed_args, out=buffer_)
+    return buffer_.getvalue()
+
+
+def do(parser=None, args=None, in_=None, table_function=None, out=None):
     """Read command-line args and stdin, return the result.
 
     Read the command line arguments and the input data from stdin, pass them to
     the table() function to do the filter and transform, and return the string
     of CSV- or JSON-formatted text that should be written to stdout.
 
+    If an --output file was given the output is written to the file (or to
+    shards of it) instead, and an empty string is returned.
+
+    If ``out`` is given then any output that's written as the rows are
+    computed (for example --pretty or --format json output) is written
+    straight to ``out`` instead, and an empty string is returned.
+
     Note that although the output data is returned rather than written to
     stdout, this function may write error messages or help text to stdout
     (for example if there's an error with the command-line parsing).
@@ -301,17 +800,94 @@ def do(parser=None, args=None, in_=None, table_function=None):
 
     parsed_args = parse(parser=parser, args=args)
 
-    # Read the input data from stdin or a file.
-    if parsed_args.input_data:
-        input_data = open(parsed_args.input_data, 'r').read()
+    try:
+        backend = backends.get(getattr(parsed_args, "json_backend", None))
+    except backends.UnavailableBackendError as err:
+        raise JSONBackendError(str(err))
+
+    input_files = _input_files(getattr(parsed_args, "input_data", None))
+    output = getattr(parsed_args, "output", None)
+    output_format = getattr(parsed_args, "output_format", "csv")
+    limit = getattr(parsed_args, "limit", None)
+    sample = getattr(parsed_args, "sample", None)
+    cache_file = getattr(parsed_args, "incremental", None)
+
+    if cache_file:
+        # The rows have to go through the cache, so the input files are read
+        # one after another in this process rather than by worker processes.
+        marker = parsed_args.incremental_marker
+        cache = incremental.IncrementalCache(
+            cache_file, parsed_args.columns,
+            id_pattern=parsed_args.incremental_id,
+            marker_pattern=None if marker == ["hash"] else marker)
+        try:
+            rows = cache.iter_table(
+                _read_input(input_files, backend, in_, keys=cache.wants_key))
+            return _output_rows(rows, parsed_args, out)
+        finally:
+            cache.close()
+
+    row_cache_file = getattr(parsed_args, "row_cache", None)
+    if row_cache_file:
+        # The objects aren't pruned by _wanted_keys() because the cells are
+        # cached by a digest of the whole object, so that they can be shared
+        # with other columns files.
+        cache = rowcache.RowCache(row_cache_file)
+        try:
+            rows = cache.iter_table(
+                _read_input(input_files, backend, in_, limit=limit,
+                            sample=sample, columns=parsed_args.columns),
+                parsed_args.columns)
+            return _output_rows(rows, parsed_args, out)
+        finally:
+            cache.close()
+
+    # With --limit or --sample only a few objects are turned into rows, so
+    # read the input files one after another in this process rather than
+    # spreading them across worker processes.
+    use_workers = len(input_files) > 1 and limit is None and sample is None
+    # A custom table_function gets the whole objects, in a list, like the
+    # "list of dicts" that table() takes.
+    custom_table_function = table_function is not losser.table
+    if use_workers or custom_table_function:
+        keys = None
     else:
-        input_data = in_.read()
-    dicts = json.loads(input_data)
-
-    csv_string = table_function(dicts, parsed_args.columns, csv=True,
-                                pretty=parsed_args.pretty)
-
-    return csv_string
+        keys = _wanted_keys(parsed_args.columns)
+
+    if (output or output_format != "csv" or
+            (parsed_args.pretty and not custom_table_function)):
+        # Stream the rows straight into the output file(s) without building
+        # the whole table in memory. --pretty output is streamed too, with the
+        # column widths worked out from the first rows, so it starts appearing
+        # straight away even for very large inputs.
+        if use_workers:
+            rows = parallel.iter_table_files(
+                input_files, parsed_args.columns,
+                processes=getattr(parsed_args, "jobs", None),
+                json_backend=backend.name)
+        else:
+            rows = losser.iter_table(
+                _read_input(input_files, backend, in_, limit=limit,
+                            sample=sample, keys=keys,
+                            columns=parsed_args.columns),
+                parsed_args.columns)
+        return _output_rows(rows, parsed_args, out)
+
+    if use_workers:
+        output_string = parallel.table_files(
+            input_files, parsed_args.columns, csv=True,
+            pretty=parsed_args.pretty,
+            processes=getattr(parsed_args, "jobs", None),
+            json_backend=backend.name, table_function=table_function)
+    else:
+        dicts = _read_input(input_files, backend, in_, limit=limit,
+                            sample=sample, keys=keys,
+                            columns=parsed_args.columns)
+        if custom_table_function:
+            dicts = readers.materialise(dicts)
+        output_string = table_function(dicts, parsed_args.columns, csv=True,
+                                       pretty=parsed_args.pretty)
+    return output_string
 
 
 def main():
@@ -327,7 +903,7 @@ def main():
     """
     parser = make_parser()
     try:
-        output = do(parser=parser)
+        output = do(parser=parser, out=sys.stdout)
     except CommandLineExit as err:
         sys.exit(err.code)
     except CommandLineError as err:
@@ -0,0 +1,204 @@
+"""Incremental exports that only re-evaluate new or changed objects.
+
+An IncrementalCache remembers the row that each input object produced, in a
+local sqlite file, keyed by the object's id. On the next run an object whose
+change marker (for example its ``metadata_modified`` timestamp) hasn't
+changed gets its row from the cache instead of having its columns evaluated
+again, but the output is still the complete table. For example::
+
+    cache = losser.incremental.IncrementalCache("export.cache", columns)
+    try:
+        for row in cache.iter_table(dicts):
+            ...
+    finally:
+        cache.close()
+
+If the columns change the whole cache is thrown away, and objects that
+weren't in the input of a completed run are removed from it.
+
+"""
+from __future__ import absolute_import
+
+import collections
+import copy
+import itertools
+import json
+import sqlite3
+
+import losser.caching as caching
+import losser.losser as losser
+
+
+class IncrementalCache(object):
+
+    """A cache of the rows produced by each object in previous runs.
+
+    :param path: the path to the sqlite file to keep the cache in (it's
+        created if it doesn't exist)
+    :type path: string
+
+    :param columns: the dict of column query dicts, or the path to a JSON file
+        containing them
+    :type columns: dict of dicts, or string
+
+    :param id_pattern: the pattern path of each object's unique id
+    :type id_pattern: string or list of strings
+
+    :param marker_pattern: the pattern path of a value that changes whenever
+        the object changes. If None (or for objects that don't have a
+        marker), a hash of the object's contents is used instead.
+    :type marker_pattern: string or list of strings
+
+    """
+
+    def __init__(self, path, columns, id_pattern="^id$",
+                 marker_pattern="^metadata_modified$"):
+        columns = losser._normalise_columns(copy.deepcopy(columns))
+        self._plan = losser.compile_columns(columns)
+        # The filters are applied separately, so that objects that don't pass
+        # them can be cached too.
+        self._columns_plan = losser.Plan(self._plan.columns)
+        self._id = losser._CompiledColumn("id", id_pattern)
+        if marker_pattern:
+            self._marker = losser._CompiledColumn("marker", marker_pattern)
+        else:
+            self._marker = None
+        # A plan for working out which keys the columns, filters, id and
+        # marker want.
+        key_columns = self._plan.columns + [self._id]
+        if self._marker:
+            key_columns.append(self._marker)
+        self._keys_plan = losser.Plan(key_columns, self._plan.filters)
+
+        self._connection = sqlite3.connect(path)
+        self._connection.text_factory = str
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS rows (id TEXT PRIMARY KEY, "
+            "marker TEXT, row TEXT, run INTEGER)")
+
+        digest = caching.digest([columns, id_pattern, marker_pattern])
+        if self._get_meta("digest") != digest:
+            self._connection.execute("DELETE FROM rows")
+            self._set_meta("digest", digest)
+        self._run = (self._get_meta("run") or 0) + 1
+        self._set_meta("run", self._run)
+        self._connection.commit()
+
+        #: The number of objects whose rows came from the cache, and the
+        #: number that had to be evaluated, so far.
+        self.hits = 0
+        self.misses = 0
+
+    def _get_meta(self, key):
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, value))
+
+    def wants_key(self, key):
+        """Return True if a top-level key is needed by the columns or cache.
+
+        See losser.Plan.wants_key() and losser.readers.load().
+
+        """
+        # Any content hashes are of the objects as the columns see them, so
+        # changes to keys that no column uses don't count as changes.
+        return self._keys_plan.wants_key(key)
+
+    def _key(self, dict_):
+        """Return the (id, marker) of the given dict, or None if it has no id.
+
+        """
+        id_ = self._id.query(dict_)
+        if id_ is None:
+            return None
+        marker = self._marker and self._marker.query(dict_)
+        if marker is None:
+            marker = caching.digest(dict_)
+        else:
+            marker = json.dumps(marker)
+        return json.dumps(id_), marker
+
+    def _lookup(self, ids):
+        """Return a dict mapping the given ids to their cached (marker, row).
+
+        Ids that aren't in the cache are left out.
+
+        """
+        cached = {}
+        for i in range(0, len(ids), caching.LOOKUP_SIZE):
+            chunk = ids[i:i + caching.LOOKUP_SIZE]
+            cached.update(
+                (id_, (marker, row)) for id_, marker, row in
+                self._connection.execute(
+                    "SELECT id, marker, row FROM rows WHERE id IN ({0})"
+                    .format(", ".join("?" * len(chunk))), chunk))
+        return cached
+
+    def table_batch(self, dicts):
+        """Return the rows for a batch of dicts, from the cache if possible.
+
+        Like losser.table_batch(), any dicts that don't pass the filters are
+        dropped.
+
+        """
+        keys = [self._key(dict_) for dict_ in dicts]
+        cached = self._lookup([key[0] for key in keys if key])
+
+        results = [None] * len(dicts)
+        hits = []
+        misses = []
+        for i, key in enumerate(keys):
+            if key and key[0] in cached and cached[key[0]][0] == key[1]:
+                row = caching.load_json(cached[key[0]][1])
+                if row is not None:
+                    results[i] = collections.OrderedDict(row)
+                hits.append((self._run, key[0]))
+            else:
+                misses.append(i)
+
+        accepted = [i for i in misses if self._plan.accepts(dicts[i])]
+        rows = losser.table_batch([dicts[i] for i in accepted],
+                                  self._columns_plan)
+        for i, row in itertools.izip(accepted, rows):
+            results[i] = row
+
+        self._connection.executemany(
+            "UPDATE rows SET run = ? WHERE id = ?", hits)
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO rows (id, marker, row, run) "
+            "VALUES (?, ?, ?, ?)",
+            [(keys[i][0], keys[i][1],
+              caching.dump_json(results[i] and results[i].items()),
+              self._run)
+             for i in misses if keys[i]])
+        self.hits += len(hits)
+        self.misses += len(misses)
+
+        return [row for row in results if row is not None]
+
+    def iter_table(self, dicts, batch_size=256):
+        """Like losser.iter_table() but using and updating the cache.
+
+        When all the dicts have been consumed, any objects in the cache that
+        weren't among them are removed from it.
+
+        """
+        try:
+            for batch in losser._batches(dicts, batch_size):
+                for row in self.table_batch(batch):
+                    yield row
+            self._connection.execute(
+                "DELETE FROM rows WHERE run < ?", (self._run,))
+        finally:
+            self._connection.commit()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
@@ -1,5 +1,9 @@
+from __future__ import absolute_import
+
+import array
 import cStringIO
 import collections
+import datetime
 import itertools
 import json
 import pprint
@@ -8,6 +12,10 @@ import re
 import tabulate
 import unicodecsv
 
+import losser.backends as backends
+# Imported under another name because "transforms" is also a column option.
+import losser.transforms as _transforms
+
 
 class UniqueError(Exception):
     pass
@@ -20,6 +28,29 @@ class InvalidColumnsFileError(Exception):
     pass
 
 
+class CoercionError(Exception):
+
+    """Raised when a value can't be converted to its column's type.
+
+    Only raised by columns whose ``errors`` option is "raise".
+
+    """
+
+    pass
+
+
+class InvalidFilterError(Exception):
+
+    """Exception raised when a filter in the "__filters" list is invalid."""
+
+    pass
+
+
+#: The key in the columns dict (and in columns.json files) for the list of
+#: filters that the input dicts have to pass to get a row in the table.
+FILTERS = '__filters'
+
+
 def _read_columns_file(f):
     """Return the list of column queries read from the given JSON file.
 
@@ -30,25 +61,60 @@ def _read_columns_file(f):
 
     """
     try:
-        columns = json.loads(open(f, 'r').read(),
-                             object_pairs_hook=collections.OrderedDict)
+        columns = backends.get().ordered_loads(open(f, 'r').read())
     except Exception as err:
         raise InvalidColumnsFileError(
             "There was an error while reading {0}: {1}".format(f, err))
 
-    # Options are not supported yet:
+    # Options are not supported yet (but "__filters" is, see compile_filter()):
     if '__options' in columns:
         del columns['__options']
 
     return columns
 
 
-def _write_csv(f, table_):
-    """Write the given table (list of dicts) to the given file as CSV.
+#: The string that list values are joined with in CSV cells by default.
+SEPARATOR = u', '
 
-    Writes UTF8-encoded, CSV-formatted text.
+#: The ways that a column's list values can be joined into one CSV cell: with
+#: the column's separator, or as a JSON list.
+JOINS = ("separator", "json")
 
-    ``f`` could be an opened file, sys.stdout, or a StringIO.
+
+def _joiner(separator=None, join=None):
+    """Return a function that joins a list value into one CSV cell.
+
+    :param separator: the string to put between the items (default: SEPARATOR)
+    :type separator: string
+
+    :param join: one of JOINS (default: "separator")
+    :type join: string
+
+    :raises ValueError: if join isn't one of JOINS
+
+    """
+    if join is None:
+        join = "separator"
+    if join not in JOINS:
+        raise ValueError("join must be one of {0}, not {1!r}".format(
+            ", ".join(JOINS), join))
+    if join == "json":
+        return lambda values: json.dumps(values, ensure_ascii=False,
+                                         default=unicode)
+    if separator is None:
+        separator = SEPARATOR
+    return lambda values: separator.join([unicode(v) for v in values])
+
+
+#: The joiner for columns that don't have a separator or join of their own.
+join_list = _joiner()
+
+
+def _csv_fieldnames(table_):
+    """Return the CSV header for the given (non-empty) list of dicts.
+
+    That's the first dict's keys followed by any keys that only later dicts
+    have, sorted.
 
     """
     fieldnames = table_[0].keys()
@@ -59,56 +125,286 @@ def _write_csv(f, table_):
 
     # append the additonal fields sorted onto the end
     additional_fields = sorted(set_fieldname - set(table_[0].keys()))
-    fieldnames += additional_fields
+    return fieldnames + additional_fields
 
-    writer = unicodecsv.DictWriter(f, fieldnames, encoding='utf-8')
-    writer.writeheader()
 
-    # Change lists into comma-separated strings.
-    for dict_ in table_:
-        for key, value in dict_.items():
-            if type(value) in (list, tuple):
-                dict_[key] = ', '.join([unicode(v) for v in value])
+def _write_csv(f, table_, joiners=None):
+    """Write the given table (list of dicts) to the given file as CSV.
+
+    Writes UTF8-encoded, CSV-formatted text.
+
+    ``f`` could be an opened file, sys.stdout, or a StringIO.
+
+    List values are joined into strings as each row is written (see
+    Plan.joiners), so the table itself isn't changed.
 
-    writer.writerows(table_)
+    Nothing is written for an empty table, since it has no column titles.
 
+    :param joiners: a dict mapping column titles to the functions that join
+        their list values, columns that aren't in it use join_list()
+    :type joiners: dict
+
+    """
+    if not table_:
+        return
+    fieldnames = _csv_fieldnames(table_)
 
-def _table_to_csv(table_):
+    joiners = joiners or {}
+    joins = [joiners.get(name, join_list) for name in fieldnames]
+    columns = zip(fieldnames, joins)
+
+    writer = unicodecsv.writer(f, encoding='utf-8')
+    writer.writerow(fieldnames)
+    for row in table_:
+        cells = []
+        for name, join in columns:
+            value = row.get(name)
+            type_ = type(value)
+            if type_ is list or type_ is tuple:
+                value = join(value)
+            cells.append(value)
+        writer.writerow(cells)
+
+
+def _table_to_csv(table_, joiners=None):
     """Return the given table converted to a CSV string.
 
     :param table: the table to convert
     :type table: list of OrderedDicts each with the same keys in the same
         order
 
+    :param joiners: see _write_csv()
+    :type joiners: dict
+
     :rtype: UTF8-encoded, CSV-formatted string
 
     """
     f = cStringIO.StringIO()
     try:
-        _write_csv(f, table_)
+        _write_csv(f, table_, joiners)
         return f.getvalue()
     finally:
         f.close()
 
 
-def table(dicts, columns, csv=False, pretty=False):
+def table(dicts, columns, csv=False, pretty=False, layout="rows",
+          intern_strings=False):
     """Query a list of dicts with a list of queries and return a table.
 
     A "table" is a list of OrderedDicts each having the same keys in the same
     order.
 
+    With ``layout="tuples"`` a Table is returned instead, which stores each
+    row as a tuple and the column titles only once, but can still be used as
+    a list of OrderedDicts.
+
+    With ``layout="columns"`` the table is returned column by column instead:
+    an OrderedDict mapping each column title to the list of that column's
+    values, one per input dict. Columns whose values are all ints or all
+    floats are stored compactly as array.arrays. See also
+    columns_to_dataframe().
+
     :param dicts: the list of input dicts
     :type dicts: list of dicts
 
     :param columns: the list of column query dicts, or the path to a JSON file
-        containing the list of column query dicts
+        containing the list of column query dicts. Only the dicts that pass
+        all the filters in its optional "__filters" list get a row in the
+        table, see compile_filter().
     :type columns: list of dicts, or string
 
     :param csv: return a UTF8-encoded, CSV-formatted string instead of a list
         of dicts
     :type csv: bool
 
-    :rtype: list of dicts, or CSV string
+    :param layout: "rows" (the default), "tuples" or "columns"
+    :type layout: string
+
+    :param intern_strings: make equal string values in the table share one
+        string object (see Interner), which can save a lot of memory when
+        the same few strings are repeated down a long column
+    :type intern_strings: bool
+
+    :rtype: list of dicts, CSV string, Table, or OrderedDict of lists and
+        arrays
+
+    """
+    plan = compile_columns(columns)
+    if intern_strings:
+        plan = Plan(plan.columns, plan.filters, interner=Interner())
+
+    if layout in ("tuples", "columns"):
+        assert not (csv or pretty), (
+            "csv and pretty can't be used with layout={0!r}".format(layout))
+        if layout == "tuples":
+            return _table_tuples(dicts, plan)
+        return _table_columns(dicts, plan)
+    assert layout == "rows", "Unknown layout {0!r}".format(layout)
+
+    table_ = list(iter_table(dicts, plan))
+    return _format_table(table_, csv=csv, pretty=pretty, joiners=plan.joiners)
+
+
+class Table(object):
+
+    """A table stored as one tuple per row, with the column titles held once.
+
+    Storing a table of a million rows as OrderedDicts stores a million copies
+    of the column titles, so this is much smaller. For backwards
+    compatibility it still behaves like a list of OrderedDicts: indexing or
+    iterating over it makes an OrderedDict for each row on the fly, and it
+    compares equal to the equivalent list of dicts.
+
+    :ivar header: the column titles
+    :ivar rows: the list of row tuples, in the same order as the header
+
+    """
+
+    def __init__(self, header, rows):
+        self.header = tuple(header)
+        self.rows = rows
+
+    def _dict(self, row):
+        return collections.OrderedDict(itertools.izip(self.header, row))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._dict(row) for row in self.rows[index]]
+        return self._dict(self.rows[index])
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self._dict(row)
+
+    def __eq__(self, other):
+        if isinstance(other, Table):
+            return self.header == other.header and self.rows == other.rows
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return "<losser.Table {0} columns x {1} rows>".format(
+            len(self.header), len(self.rows))
+
+
+def _table_tuples(dicts, plan, batch_size=256):
+    """Return the table as a Table of row tuples.
+
+    Each batch's columns are computed with query_batch() and then zipped
+    together into row tuples, without building a dict for each row.
+
+    """
+    if any(column.return_multiple_columns for column in plan.columns):
+        raise ValueError(
+            "layout='tuples' can't be used with return_multiple_columns "
+            "columns, because they don't have a fixed set of titles")
+    rows = []
+    for batch in _batches(plan.select(dicts), batch_size):
+        if plan.columns:
+            rows.extend(itertools.izip(
+                *[column.query_batch(batch, plan.interner)
+                  for column in plan.columns]))
+        else:
+            rows.extend([()] * len(batch))
+    return Table(plan.titles, rows)
+
+
+def _compact(values):
+    """Return the given list as an array.array if it's all ints or floats.
+
+    Otherwise the list is returned as is.
+
+    """
+    if not values:
+        return values
+    types = set(type(value) for value in values)
+    if types == set([int]):
+        typecode = 'l'
+    elif types == set([float]):
+        typecode = 'd'
+    else:
+        return values
+    return array.array(typecode, values)
+
+
+def _table_columns(dicts, plan, batch_size=256):
+    """Return the table as an OrderedDict mapping titles to column values.
+
+    The values are computed a batch at a time straight into per-column lists,
+    without building a dict for each row.
+
+    """
+    values_by_title = {}
+    # The titles of each column's output columns, in order. Most columns have
+    # just the one, but the titles of return_multiple_columns columns depend
+    # on the dicts and turn up as the dicts are evaluated.
+    titles = [[] for _ in plan.columns]
+    for column, column_titles in zip(plan.columns, titles):
+        if not column.return_multiple_columns:
+            column_titles.append(column.title)
+            values_by_title[column.title] = []
+
+    number_of_rows = 0
+    for batch in _batches(plan.select(dicts), batch_size):
+        for column, column_titles in zip(plan.columns, titles):
+            if not column.return_multiple_columns:
+                values_by_title[column.title].extend(
+                    column.query_batch(batch, plan.interner))
+                continue
+            for i, dict_ in enumerate(batch, number_of_rows):
+                for title, value in column.query(dict_).items():
+                    if title not in values_by_title:
+                        column_titles.append(title)
+                        values_by_title[title] = []
+                    # Pad with Nones for any earlier rows without this title.
+                    values = values_by_title[title]
+                    values.extend([None] * (i - len(values)))
+                    values.append(value)
+        number_of_rows += len(batch)
+
+    table_ = collections.OrderedDict()
+    for title in itertools.chain.from_iterable(titles):
+        values = values_by_title[title]
+        values.extend([None] * (number_of_rows - len(values)))
+        table_[title] = _compact(values)
+    return table_
+
+
+def columns_to_dataframe(table_):
+    """Return a table from table(..., layout="columns") as a pandas DataFrame.
+
+    The array.array columns are handed to pandas without being copied into
+    lists first.
+
+    :raises ImportError: if pandas isn't installed
+
+    """
+    import numpy
+    import pandas
+    data = collections.OrderedDict()
+    for title, values in table_.items():
+        if isinstance(values, array.array):
+            values = numpy.frombuffer(values, dtype=values.typecode)
+        data[title] = values
+    return pandas.DataFrame(data, columns=list(data.keys()))
+
+
+def _normalise_columns(columns):
+    """Return the given columns, reading them from file if necessary.
+
+    :param columns: the dict of column query dicts, or the path to a JSON file
+        containing them
+    :type columns: dict of dicts, or string
 
     """
     # Optionally read columns from file.
@@ -117,7 +413,9 @@ def table(dicts, columns, csv=False, pretty=False):
 
     # Either "pattern" or "pattern_path" (but not both) is allowed in the
     # columns.json file, but "pattern" gets normalised to "pattern_path" here.
-    for column in columns.values():
+    for title, column in columns.items():
+        if title == FILTERS:
+            continue
         if "pattern" in column:
             assert "pattern_path" not in column, (
                 'A column must have either a "pattern" or a "pattern_path"'
@@ -125,27 +423,925 @@ def table(dicts, columns, csv=False, pretty=False):
             column["pattern_path"] = column["pattern"]
             del column["pattern"]
 
+    return columns
 
-    table_ = []
-    for d in dicts:
-        row = collections.OrderedDict()  # The row we'll return in the table.
-        for column_title, column_spec in columns.items():
-            if not column_spec.get('return_multiple_columns', False):
-                row[column_title] = query(dict_=d, **column_spec)
-            else:
-                multiple_columns = query(dict_=d, **column_spec)
-                for k, v in multiple_columns.items():
+
+def iter_table(dicts, columns, batch_size=256):
+    """Query an iterable of dicts with a list of queries and yield the rows.
+
+    This is the streaming version of table(): the dicts are consumed lazily
+    and evaluated ``batch_size`` at a time with table_batch(), and each
+    batch's rows are yielded as soon as the batch is done, so neither the
+    input nor the output needs to fit in memory.
+
+    :param columns: the dict of column query dicts, the path to a JSON file
+        containing them, or a Plan from compile_columns()
+
+    :param batch_size: the number of dicts to evaluate at once
+    :type batch_size: int
+
+    See table() for the other params.
+
+    :rtype: iterator of OrderedDicts
+
+    """
+    # Compile the columns now, rather than when the caller starts iterating,
+    # so that errors in the columns are raised straight away.
+    return _iter_rows(dicts, compile_columns(columns), batch_size)
+
+
+def _batches(dicts, batch_size):
+    """Yield lists of up to batch_size dicts at a time from the given dicts."""
+    dicts = iter(dicts)
+    while True:
+        batch = list(itertools.islice(dicts, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _iter_rows(dicts, plan, batch_size):
+    for batch in _batches(dicts, batch_size):
+        for row in table_batch(batch, plan):
+            yield row
+
+
+def table_batch(dicts, plan):
+    """Evaluate a compiled plan over a batch of dicts and return the rows.
+
+    The batch is evaluated column by column: each column's query is run over
+    every dict in the batch before moving on to the next column, so that
+    per-column work (looking up the column's options, matching keys against
+    its patterns, transforming repeated strings) is shared across the whole
+    batch instead of being redone for every cell.
+
+    Any dicts that don't pass the plan's filters are dropped first, so the
+    returned list can be shorter than the batch.
+
+    :param dicts: the batch of input dicts
+    :type dicts: list of dicts
+
+    :param plan: the compiled columns (see compile_columns()), or anything
+        that compile_columns() accepts
+
+    :rtype: list of OrderedDicts
+
+    """
+    plan = compile_columns(plan)
+    if plan.filters:
+        dicts = [d for d in dicts if plan.accepts(d)]
+    rows = [collections.OrderedDict() for _ in dicts]
+    for column in plan.columns:
+        if column.return_multiple_columns:
+            for row, d in itertools.izip(rows, dicts):
+                for k, v in column.query(d).items():
                     row[k] = v
+        else:
+            title = column.title
+            cells = column.query_batch(dicts, plan.interner)
+            for row, cell in itertools.izip(rows, cells):
+                row[title] = cell
+    return rows
+
+
+class Plan(object):
+
+    """A compiled set of columns, ready to be evaluated against dicts.
+
+    Get one from compile_columns(). Compiling the columns once up front means
+    the work of normalising the column specs, compiling their patterns and
+    building their string transformations isn't repeated for every dict.
+
+    :ivar columns: the compiled columns, in order
+    :ivar filters: the compiled filters (see compile_filter())
+    :ivar interner: the Interner that the columns' string values are passed
+        through, if any
+
+    """
 
-        table_.append(row)
+    def __init__(self, columns, filters=None, interner=None):
+        self.columns = columns
+        self.filters = filters or []
+        self.interner = interner
+        # The matchers for the first pattern of each column and filter, or
+        # None for any with an empty pattern path (which uses the whole dict).
+        self._first_matchers = [
+            (matchers or [None])[0] for matchers in
+            [column._matchers for column in self.columns] +
+            [filter_.matchers for filter_ in self.filters]]
 
+    @property
+    def titles(self):
+        return [column.title for column in self.columns]
+
+    @property
+    def joiners(self):
+        """A dict mapping column titles to the functions that join the
+        columns' list values into CSV cells, for the columns that have their
+        own separator or join (see _write_csv()).
+
+        """
+        return dict((column.title, column.joiner) for column in self.columns
+                    if column.joiner is not None)
+
+    def accepts(self, dict_):
+        """Return True if the given dict passes all of the plan's filters.
+
+        The filters are tried in order and the first one that fails stops the
+        others from being tried.
+
+        """
+        for filter_ in self.filters:
+            if not filter_(dict_):
+                return False
+        return True
+
+    def select(self, dicts):
+        """Return an iterator over the dicts that pass the plan's filters."""
+        if not self.filters:
+            return iter(dicts)
+        return itertools.ifilter(self.accepts, dicts)
+
+    def wants_key(self, key):
+        """Return True if any column or filter might use the given key.
+
+        A dict's top-level keys that no column's or filter's first pattern
+        matches can't affect the plan's results, so readers can skip them
+        (see readers.load()).
+
+        """
+        for matcher in self._first_matchers:
+            if matcher is None or matcher(key):
+                return True
+        return False
+
+
+def compile_columns(columns):
+    """Compile the given columns into a Plan.
+
+    :param columns: the dict of column query dicts, the path to a JSON file
+        containing them, or a Plan (which is returned as is)
+
+    :rtype: Plan
+
+    """
+    if isinstance(columns, Plan):
+        return columns
+    columns = _normalise_columns(columns)
+    return Plan([_CompiledColumn(title, **spec)
+                 for title, spec in columns.items() if title != FILTERS],
+                [compile_filter(filter_)
+                 for filter_ in columns.get(FILTERS, [])])
+
+
+# The maximum number of keys whose match results are remembered per pattern.
+_KEY_CACHE_SIZE = 10000
+
+
+class Interner(object):
+
+    """Maps equal strings to one shared string object.
+
+    Columns like formats or licenses repeat the same few strings over and
+    over, but each cell's string is a separate object. Passing them through
+    an Interner means each distinct string is only kept in memory once.
+
+    The Interner remembers at most ``max_size`` strings (it forgets them all
+    and starts again when it's full) so that columns of mostly distinct
+    strings don't make it grow without limit.
+
+    """
+
+    def __init__(self, max_size=100000):
+        self._max_size = max_size
+        # Byte strings and unicode strings are kept apart because in Python 2
+        # "a" == u"a", and interning shouldn't change a value's type.
+        self._strings = {str: {}, unicode: {}}
+
+    def __call__(self, s):
+        strings = self._strings[unicode if isinstance(s, unicode) else str]
+        try:
+            return strings[s]
+        except KeyError:
+            if len(strings) >= self._max_size:
+                strings.clear()
+            strings[s] = s
+            return s
+
+
+class _KeyMatcher(object):
+
+    """Matches dict keys against a pattern, remembering the results.
+
+    The same keys turn up in dict after dict, so remembering whether each key
+    matched saves re-running the regex for every dict.
+
+    """
+
+    def __init__(self, pattern, flags):
+        self._search = re.compile(pattern, flags).search
+        self._cache = {}
+
+    def __call__(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            if len(self._cache) >= _KEY_CACHE_SIZE:
+                self._cache.clear()
+            matched = self._cache[key] = bool(self._search(key))
+            return matched
+
+
+# Pattern path items with these forms are path steps rather than key patterns,
+# see _parse_step(). They all start with a "*", which no valid regex can, so
+# they can't be mistaken for key patterns.
+_DESCEND_STEP = "**"
+_INDEX_STEP = re.compile(r"^\*\[(-?\d+)\]$")
+_SLICE_STEP = re.compile(r"^\*\[(-?\d*):(-?\d*)(?::(-?\d+))?\]$")
+_HAS_KEY_STEP = re.compile(r"^\*\[\?(.+)\]$", re.DOTALL)
+
+
+def _int_or_none(text):
+    return int(text) if text else None
+
+
+def _parse_step(pattern, flags):
+    """Return one item of a pattern path as a (kind, argument) step.
+
+    The kinds of step are:
+
+    * ``"key"``: a regex that the keys of a dict are matched against, the
+      argument is its _KeyMatcher. Every item that isn't one of the forms
+      below is a key pattern.
+    * ``"descend"``: ``**``, matches zero or more levels of dicts with any
+      keys.
+    * ``"index"``: ``*[N]`` or a ``*[START:STOP]`` or ``*[START:STOP:STEP]``
+      slice, picks items out of a list (instead of going into all of them),
+      the argument is a slice. A value that isn't a list counts as a list of
+      just that value.
+    * ``"has"``: ``*[?REGEX]``, only goes on with dicts that have a key
+      matching the regex, the argument is its _KeyMatcher.
+
+    """
+    if pattern == _DESCEND_STEP:
+        return ("descend", None)
+    match = _INDEX_STEP.match(pattern)
+    if match:
+        index = int(match.group(1))
+        return ("index", slice(index, (index + 1) or None))
+    match = _SLICE_STEP.match(pattern)
+    if match:
+        start, stop, step = [_int_or_none(group) for group in match.groups()]
+        if step == 0:
+            raise ValueError("A slice step can't be 0: {0}".format(pattern))
+        return ("index", slice(start, stop, step))
+    match = _HAS_KEY_STEP.match(pattern)
+    if match:
+        return ("has", _KeyMatcher(match.group(1), flags))
+    return ("key", _KeyMatcher(pattern, flags))
+
+
+class _PathAutomaton(object):
+
+    """Finds the values matched by a pattern path that has path steps.
+
+    The automaton's states are positions in the path: state i means that
+    step i is next, and state len(steps) means that the whole path has
+    matched. Each node of the object is visited only once, with the set of
+    all the states that reach it, so a path with several ``**`` steps still
+    takes time proportional to the size of the object rather than
+    multiplying the paths through it. The set of states that each key leads
+    to from each set of states is remembered (like _KeyMatcher remembers its
+    matches), and so are the closures of each set of states for each type of
+    node, except where they depend on a dict's keys.
+
+    Unlike a path of only key patterns, the values that the path ends on
+    that are dicts are left out, rather than raising IndexError.
+
+    :param steps: the path's steps, see _parse_step()
+    :type steps: list of (kind, argument) tuples
+
+    """
+
+    def __init__(self, steps):
+        self._steps = steps
+        self._end = len(steps)
+        self._start = frozenset([0])
+        self._transitions = {}
+        self._closures = {}
+        # Without "has" steps a closure only depends on the type of the node.
+        self._has_keys_steps = any(kind == "has" for kind, _ in steps)
+
+    def collect(self, object_, result):
+        """Append the values in object_ matched by the path to result."""
+        self._walk(object_, self._start, result)
+
+    def _close(self, states, node):
+        """Return the states plus those reached without leaving the node."""
+        type_ = type(node)
+        if type_ is list or type_ is tuple:
+            node_type = list
+        elif isinstance(node, dict):
+            if self._has_keys_steps:
+                return self._compute_closure(states, node)
+            node_type = dict
+        else:
+            node_type = None
+        try:
+            return self._closures[(states, node_type)]
+        except KeyError:
+            if len(self._closures) >= _KEY_CACHE_SIZE:
+                self._closures.clear()
+            closure = self._closures[(states, node_type)] = (
+                self._compute_closure(states, node))
+            return closure
+
+    def _compute_closure(self, states, node):
+        steps = self._steps
+        end = self._end
+        closed = set(states)
+        todo = list(states)
+        while todo:
+            state = todo.pop()
+            if state == end:
+                continue
+            kind, argument = steps[state]
+            if kind == "descend":
+                follow = True
+            elif kind == "has":
+                follow = isinstance(node, dict) and any(
+                    argument(key) for key in node)
+            elif kind == "index":
+                type_ = type(node)
+                follow = (type_ is not list and type_ is not tuple and
+                          bool(range(1)[argument]))
+            else:
+                follow = False
+            if follow and state + 1 not in closed:
+                closed.add(state + 1)
+                todo.append(state + 1)
+        return frozenset(closed)
+
+    def _next(self, states, key):
+        """Return the states that a dict's key leads to from the states.
+
+        Also returns whether the path matches the key's value if it's a leaf
+        (not a list or dict).
+
+        """
+        try:
+            return self._transitions[(states, key)]
+        except KeyError:
+            steps = self._steps
+            next_states = set()
+            for state in states:
+                if state == self._end:
+                    continue
+                kind, argument = steps[state]
+                if kind == "key" and argument(key):
+                    next_states.add(state + 1)
+                elif kind == "descend":
+                    next_states.add(state)
+            if len(self._transitions) >= _KEY_CACHE_SIZE:
+                self._transitions.clear()
+            next_states = frozenset(next_states)
+            transition = self._transitions[(states, key)] = (
+                next_states, self._end in self._close(next_states, None))
+            return transition
+
+    def _walk(self, node, states, result):
+        states = self._close(states, node)
+        type_ = type(node)
+        if type_ is list or type_ is tuple:
+            steps = self._steps
+            indexes = [state for state in states if state != self._end and
+                       steps[state][0] == "index"]
+            # Lists don't use up any steps except index steps, the other
+            # states go straight on to the items.
+            through = states.difference(indexes)
+            if not indexes:
+                for item in node:
+                    self._walk(item, through, result)
+                return
+            positions = range(len(node))
+            chosen = [(state + 1, set(positions[steps[state][1]]))
+                      for state in indexes]
+            for i, item in enumerate(node):
+                item_states = set(through)
+                for next_state, chosen_positions in chosen:
+                    if i in chosen_positions:
+                        item_states.add(next_state)
+                if item_states:
+                    self._walk(item, frozenset(item_states), result)
+        elif isinstance(node, dict):
+            next_ = self._next
+            walk = self._walk
+            for key in node:
+                key_states, matches_leaf = next_(states, key)
+                if not key_states:
+                    continue
+                value = node[key]
+                type_ = type(value)
+                if (type_ is list or type_ is tuple or
+                        isinstance(value, dict)):
+                    walk(value, key_states, result)
+                elif matches_leaf:
+                    # Save a call to _walk() for the (many) leaf values.
+                    result.append(value)
+        elif self._end in states:
+            result.append(node)
+
+
+def _has_path_steps(pattern_path):
+    """Return True if any of the pattern path's items are path steps."""
+    if isinstance(pattern_path, basestring):
+        pattern_path = [pattern_path]
+    return any(_parse_step(pattern, 0)[0] != "key"
+               for pattern in pattern_path)
+
+
+def _replacements(replace):
+    """Return a column's "replace" option as a list of "replace" transforms.
+
+    :param replace: a dict with a "pattern" (a regex) and optionally a
+        "replacement" (default: ""), "case_sensitive" (default: True) and
+        "cache_size" (see transforms.replace()), or a list of them
+    :type replace: dict or list of dicts
+
+    """
+    if isinstance(replace, dict):
+        replace = [replace]
+    replacements = []
+    for replacement in replace:
+        if not isinstance(replacement, dict):
+            raise _transforms.InvalidTransformError(
+                "replace must be a dict with a \"pattern\" or a list of "
+                "them, not {0!r}".format(replacement))
+        replacement = dict(replacement)
+        replacement["name"] = "replace"
+        replacements.append(replacement)
+    return replacements
+
+
+def _string_pipeline(string_transformations=None, transforms=None,
+                     max_length=None, hyperlink=False, replace=None):
+    """Return a transforms.Pipeline applying a column's string options.
+
+    The options are applied in this order: the string_transformations
+    functions, the replace substitutions, the declarative transforms (see
+    losser.transforms), truncating to max_length, and making a hyperlink.
+    (Stripping comes before all of them, but it's left to the caller.)
+
+    """
+    functions = list(string_transformations or [])
+    if replace:
+        functions.append(
+            _transforms.compile_transforms(_replacements(replace)))
+    if transforms:
+        functions.append(_transforms.compile_transforms(transforms))
+    if max_length:
+        functions.append(lambda x: x[:max_length])
+    if hyperlink:
+        functions.append(lambda x: '=HYPERLINK("{0}")'.format(x))
+    return _transforms.Pipeline(functions)
+
+
+class _CompiledColumn(object):
+
+    """One column's query, compiled.
+
+    Gives the same results as calling query() with the column's options.
+
+    :ivar spec: the column's query options (everything except its title and
+        the options that only affect how its cells are written, ``separator``
+        and ``join``)
+    :ivar joiner: the function that joins the column's list values into CSV
+        cells, or None to use join_list() (see _joiner())
+
+    """
+
+    def __init__(self, title, pattern_path, max_length=None, strip=False,
+                 case_sensitive=False, unique=False, deduplicate=False,
+                 string_transformations=None, hyperlink=False,
+                 return_multiple_columns=False, transforms=None,
+                 replace=None, type=None, errors="null", separator=None,
+                 join=None):
+        self.title = title
+        if separator is None and join is None:
+            self.joiner = None
+        else:
+            self.joiner = _joiner(separator, join)
+        self.return_multiple_columns = return_multiple_columns
+        self._unique = unique
+        self._deduplicate = deduplicate
+
+        if isinstance(pattern_path, basestring):
+            pattern_path = [pattern_path]
+        self._pattern_path = list(pattern_path)
+
+        self.spec = dict(
+            pattern_path=self._pattern_path, max_length=max_length,
+            strip=strip, case_sensitive=case_sensitive, unique=unique,
+            deduplicate=deduplicate,
+            string_transformations=string_transformations,
+            hyperlink=hyperlink,
+            return_multiple_columns=return_multiple_columns,
+            transforms=transforms, replace=replace, type=type,
+            errors=errors)
+
+        if case_sensitive:
+            flags = re.UNICODE
+        else:
+            flags = re.UNICODE | re.IGNORECASE
+        steps = [_parse_step(pattern, flags) for pattern in self._pattern_path]
+        # The key pattern steps' matchers, and None for any other steps.
+        self._matchers = [argument if kind == "key" else None
+                          for kind, argument in steps]
+        if all(kind == "key" for kind, _ in steps):
+            self._automaton = None
+        else:
+            if return_multiple_columns:
+                raise ValueError(
+                    "return_multiple_columns can't be used with the pattern "
+                    "path steps in {0}".format(self._pattern_path))
+            self._automaton = _PathAutomaton(steps)
+            self._collect = self._collect_path
+
+        pipeline = _string_pipeline(string_transformations, transforms,
+                                    max_length, hyperlink, replace)
+        if type is None:
+            self._coerce = None
+        else:
+            self._coerce = _coercer(type, errors)
+        if strip:
+            self._pipeline = _transforms.Pipeline(
+                [lambda x: x.strip(), pipeline])
+        else:
+            self._pipeline = pipeline
+
+        # Columns that return multiple columns are evaluated by query() itself.
+        self._query_kwargs = dict(
+            pattern_path=self._pattern_path, strip=strip,
+            case_sensitive=case_sensitive, unique=unique,
+            deduplicate=deduplicate, string_transformations=[pipeline],
+            return_multiple_columns=return_multiple_columns, type=type,
+            errors=errors)
+
+    def _collect(self, object_, depth, result):
+        """Append the values in object_ matched by the pattern path to result.
+
+        Strings are appended untransformed.
+
+        """
+        type_ = type(object_)
+        if type_ is list or type_ is tuple:
+            for item in object_:
+                self._collect(item, depth, result)
+        elif isinstance(object_, dict):
+            # Like query(), this raises IndexError if the pattern path ends
+            # before the dicts do.
+            matches = self._matchers[depth]
+            for key in object_:
+                if matches(key):
+                    self._collect(object_[key], depth + 1, result)
+        else:
+            result.append(object_)
+
+    def _collect_path(self, object_, depth, result):
+        """Like _collect() but for pattern paths with path steps."""
+        self._automaton.collect(object_, result)
+
+    def _finish(self, result, dict_):
+        """Turn the list of matched values into the cell value."""
+        if not result:
+            return None
+        elif len(result) == 1:
+            return result[0]
+        if self._unique:
+            msg = "pattern_path: {0}\n\n".format(self._pattern_path)
+            msg = msg + pprint.pformat(dict_)
+            raise UniqueError(msg)
+        if self._deduplicate:
+            seen = set()
+            new_result = []
+            for item in result:
+                if item not in seen:
+                    seen.add(item)
+                    new_result.append(item)
+            result = new_result
+        return result
+
+    def query(self, dict_):
+        """Return this column's cell for the given dict."""
+        if self.return_multiple_columns:
+            return query(dict_=dict_, **self._query_kwargs)
+        return self.query_batch([dict_])[0]
+
+    def query_batch(self, dicts, interner=None):
+        """Return this column's cells for each of the given dicts.
+
+        If an Interner is given the cells' strings are passed through it.
+
+        """
+        collect = self._collect
+        results = []
+        for dict_ in dicts:
+            result = []
+            collect(dict_, 0, result)
+            results.append(result)
+
+        # Transform (and convert) the strings for the whole batch at once,
+        # transforming each distinct string only once.
+        coerce = self._coerce
+        if self._pipeline or interner or coerce:
+            distinct = {}
+            for result in results:
+                for value in result:
+                    if isinstance(value, basestring):
+                        distinct[value] = None
+            strings = list(distinct)
+            transformed = self._pipeline.map(strings)
+            if interner:
+                transformed = map(interner, transformed)
+            if coerce:
+                transformed = map(coerce, transformed)
+            transformed = dict(itertools.izip(strings, transformed))
+            for result in results:
+                for i, value in enumerate(result):
+                    if isinstance(value, basestring):
+                        result[i] = transformed[value]
+                    elif coerce:
+                        result[i] = coerce(value)
+
+        finish = self._finish
+        return [finish(result, dict_)
+                for result, dict_ in itertools.izip(results, dicts)]
+
+
+#: The types that a column's values can be converted to with its "type"
+#: option.
+TYPES = ("int", "float", "bool", "datetime")
+
+#: What a typed column can do with a value that can't be converted: replace
+#: it with None, keep it as it is, or raise CoercionError.
+ERRORS = ("null", "keep", "raise")
+
+_TRUE_STRINGS = frozenset(["true", "t", "yes", "y", "1"])
+_FALSE_STRINGS = frozenset(["false", "f", "no", "n", "0", ""])
+
+
+def _to_int(value):
+    if isinstance(value, basestring):
+        try:
+            return int(value)
+        except ValueError:
+            # For example "12.0" or "1e3".
+            value = float(value)
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError("{0!r} isn't a whole number".format(value))
+    return int(value)
+
+
+def _to_bool(value):
+    if isinstance(value, basestring):
+        value = value.strip().lower()
+        if value in _TRUE_STRINGS:
+            return True
+        elif value in _FALSE_STRINGS:
+            return False
+    elif _is_number(value) and value in (0, 1):
+        return bool(value)
+    raise ValueError("{0!r} isn't a boolean".format(value))
+
+
+def _to_datetime(value):
+    if isinstance(value, basestring):
+        value = value.strip()
+        if value.endswith(("Z", "z")):
+            value = value[:-1]
+        result = _transforms.parse_date(value)
+        if result is not None:
+            return result
+    raise ValueError("{0!r} isn't a date".format(value))
+
+
+# The type that each of TYPES produces, and the function that converts other
+# values to it.
+_CONVERTERS = {
+    "int": (int, _to_int),
+    "float": (float, float),
+    "bool": (bool, _to_bool),
+    "datetime": (datetime.datetime, _to_datetime),
+}
+
+
+def _coercer(type_, errors="null"):
+    """Return a function that converts values to the given type.
+
+    :param type_: one of TYPES
+    :type type_: string
+
+    :param errors: one of ERRORS
+    :type errors: string
+
+    :raises ValueError: if type_ or errors is invalid
+
+    """
+    if type_ not in _CONVERTERS:
+        raise ValueError("type must be one of {0}, not {1!r}".format(
+            ", ".join(TYPES), type_))
+    if errors not in ERRORS:
+        raise ValueError("errors must be one of {0}, not {1!r}".format(
+            ", ".join(ERRORS), errors))
+    target, convert = _CONVERTERS[type_]
+
+    def coerce(value):
+        if value is None or type(value) is target:
+            return value
+        try:
+            return convert(value)
+        except (TypeError, ValueError, UnicodeError, OverflowError):
+            if errors == "null":
+                return None
+            elif errors == "keep":
+                return value
+            raise CoercionError(
+                "Can't convert {0!r} to {1}".format(value, type_))
+    return coerce
+
+
+def _coerce_result(coerce, result):
+    """Convert each of the values in a query() result list (or dict of lists).
+
+    """
+    if isinstance(result, dict):
+        for key, values in result.items():
+            result[key] = _coerce_result(coerce, values)
+        return result
+    return [coerce(value) for value in result]
+
+
+def _is_number(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+
+def _as_number(value):
+    """Return the given value as a number, or None if it isn't one."""
+    if _is_number(value):
+        return value
+    if isinstance(value, basestring):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return None
+
+
+def _equals(a, b):
+    # In Python True == 1 and False == 0, but not in JSON.
+    return a == b and isinstance(a, bool) == isinstance(b, bool)
+
+
+_COMPARISONS = {
+    "lt": lambda a, b: a < b,
+    "le": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "ge": lambda a, b: a >= b,
+}
+
+
+def compile_filter(filter_):
+    """Compile a filter dict into a function that takes a dict.
+
+    A filter dict has a "pattern" (or "pattern_path") that's matched against
+    the input dict's keys in the same way as a column's, plus one or more of
+    these tests on the matched values:
+
+    * ``"equals": value`` - one of the values equals the given value
+    * ``"not_equals": value`` - none of the values equal the given value
+    * ``"regex": regex`` - one of the string values matches the regex
+    * ``"exists": true`` or ``false`` - there is (or isn't) a non-null value
+    * ``"lt"``, ``"le"``, ``"gt"`` or ``"ge": number`` - one of the values is
+      a number, or a string of a number, that's less than, less than or equal
+      to, greater than, or greater than or equal to the given number
+
+    The returned function returns True if the dict passes all of the tests.
+    Like columns, filters can also have a "case_sensitive" option (for both
+    the pattern and any "regex").
+
+    :raises InvalidFilterError: if the filter dict is invalid
+
+    :rtype: callable
+
+    """
+    if not isinstance(filter_, dict):
+        raise InvalidFilterError(
+            "A filter must be a dict, not {0!r}".format(filter_))
+    filter_ = dict(filter_)
+    if "pattern" in filter_:
+        if "pattern_path" in filter_:
+            raise InvalidFilterError(
+                'A filter must have either a "pattern" or a "pattern_path" '
+                "but not both")
+        filter_["pattern_path"] = filter_.pop("pattern")
+    pattern_path = filter_.pop("pattern_path", None)
+    if not pattern_path:
+        raise InvalidFilterError("A filter needs a pattern")
+    if isinstance(pattern_path, basestring):
+        pattern_path = [pattern_path]
+
+    if filter_.pop("case_sensitive", False):
+        flags = re.UNICODE
+    else:
+        flags = re.UNICODE | re.IGNORECASE
+    try:
+        matchers = [_KeyMatcher(pattern, flags) for pattern in pattern_path]
+    except re.error as err:
+        raise InvalidFilterError(
+            "Invalid filter pattern {0!r}: {1}".format(pattern_path, err))
+
+    if not filter_:
+        raise InvalidFilterError(
+            "The filter for {0!r} needs at least one test".format(
+                pattern_path))
+    tests = []
+    for name, expected in filter_.items():
+        tests.append(_compile_test(name, expected, flags))
+
+    def collect(object_, depth, result):
+        type_ = type(object_)
+        if type_ is list or type_ is tuple:
+            for item in object_:
+                collect(item, depth, result)
+        elif depth < len(matchers) and isinstance(object_, dict):
+            matches = matchers[depth]
+            for key in object_:
+                if matches(key):
+                    collect(object_[key], depth + 1, result)
+        elif depth == len(matchers):
+            result.append(object_)
+
+    def filter_function(dict_):
+        values = []
+        collect(dict_, 0, values)
+        for test in tests:
+            if not test(values):
+                return False
+        return True
+
+    filter_function.matchers = matchers
+    return filter_function
+
+
+def _compile_test(name, expected, flags):
+    """Return a function that runs the named filter test on a list of values.
+
+    """
+    if name == "equals":
+        return lambda values: any(_equals(v, expected) for v in values)
+    elif name == "not_equals":
+        return lambda values: not any(_equals(v, expected) for v in values)
+    elif name == "regex":
+        try:
+            search = re.compile(expected, flags).search
+        except (re.error, TypeError) as err:
+            raise InvalidFilterError(
+                "Invalid filter regex {0!r}: {1}".format(expected, err))
+        return lambda values: any(
+            isinstance(v, basestring) and search(v) for v in values)
+    elif name == "exists":
+        expected = bool(expected)
+        return lambda values: any(v is not None for v in values) == expected
+    elif name in _COMPARISONS:
+        if not _is_number(expected):
+            raise InvalidFilterError(
+                'The "{0}" filter test needs a number, not {1!r}'.format(
+                    name, expected))
+        compare = _COMPARISONS[name]
+
+        def test(values):
+            for value in values:
+                number = _as_number(value)
+                if number is not None and compare(number, expected):
+                    return True
+            return False
+        return test
+    raise InvalidFilterError("Unknown filter test {0!r}".format(name))
+
+
+def _format_table(table_, csv=False, pretty=False, joiners=None):
+    """Return the given table as a list of dicts, CSV or pretty string.
+
+    ``joiners`` is passed to _write_csv() for CSV output.
+
+    """
     if pretty:
         # Return a pretty-printed string (looks like a nice table when printed
         # to stdout).
         return tabulate.tabulate(table_, tablefmt="grid", headers="keys")
     elif csv:
         # Return a string of CSV-formatted text.
-        return _table_to_csv(table_)
+        return _table_to_csv(table_, joiners)
     else:
         # Return a list of dicts.
         return table_
@@ -154,7 +1350,8 @@ def table(dicts, columns, csv=False, pretty=False):
 def query(pattern_path, dict_, max_length=None, strip=False,
           case_sensitive=False, unique=False, deduplicate=False,
           string_transformations=None, hyperlink=False,
-          return_multiple_columns=False):
+          return_multiple_columns=False, transforms=None, replace=None,
+          type=None, errors="null"):
     """Query the given dict with the given pattern path and return the result.
 
     The ``pattern_path`` is a either a single regular expression string or a
@@ -168,16 +1365,21 @@ def query(pattern_path, dict_, max_length=None, strip=False,
     If the dict contains sub-lists or sub-dicts values from these will be
     flattened into a simple flat list to be returned.
 
-    """
-    if string_transformations is None:
-        string_transformations = []
+    The pattern path can also contain path steps (``**``, ``*[N]``,
+    ``*[START:STOP]`` and ``*[?REGEX]``), see _parse_step().
 
-    if max_length:
-        string_transformations.append(lambda x: x[:max_length])
-
-    if hyperlink:
-        string_transformations.append(
-            lambda x: '=HYPERLINK("{0}")'.format(x))
+    """
+    if not return_multiple_columns and _has_path_steps(pattern_path):
+        return _CompiledColumn(
+            None, pattern_path, max_length=max_length, strip=strip,
+            case_sensitive=case_sensitive, unique=unique,
+            deduplicate=deduplicate,
+            string_transformations=string_transformations,
+            hyperlink=hyperlink, transforms=transforms, replace=replace,
+            type=type, errors=errors).query(dict_)
+
+    string_transformations = [_string_pipeline(
+        string_transformations, transforms, max_length, hyperlink, replace)]
 
     if isinstance(pattern_path, basestring):
         pattern_path = [pattern_path]
@@ -196,6 +1398,8 @@ def query(pattern_path, dict_, max_length=None, strip=False,
                              string_transformations=string_transformations,
                              strip=strip, case_sensitive=case_sensitive,
                              return_multiple_columns=return_multiple_columns)
+    if type is not None:
+        result = _coerce_result(_coercer(type, errors), result)
 
     if not result:
         return None  # Empty lists finally get turned into None.
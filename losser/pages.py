@@ -0,0 +1,103 @@
+"""Read input objects from paginated sources such as CKAN's package_search.
+
+iter_pages() fetches several pages at once in background threads while the
+caller is busy turning the objects from earlier pages into rows, so network
+latency overlaps with row evaluation. For example::
+
+    fetch_page = losser.pages.ckan_package_search("http://demo.ckan.org")
+    rows = losser.losser.iter_table(
+        losser.pages.iter_pages(fetch_page), columns)
+
+"""
+from __future__ import absolute_import
+
+import collections
+import json
+import multiprocessing.pool
+import urllib
+import urllib2
+
+
+def iter_pages(fetch_page, concurrency=4, first_page=0):
+    """Yield the objects from each page of a paginated source, in order.
+
+    Up to ``concurrency`` pages are fetched at once. Fetching is only ever
+    that many pages ahead of the page that the caller is consuming, so a slow
+    consumer doesn't cause pages to pile up in memory.
+
+    :param fetch_page: a function that takes a page number and returns the
+        list of objects on that page. An empty page marks the end of the
+        source. It's called from background threads so it has to be
+        thread-safe.
+    :type fetch_page: callable
+
+    :param concurrency: the maximum number of pages to fetch at once
+    :type concurrency: int
+
+    :param first_page: the number of the first page to fetch
+    :type first_page: int
+
+    :raises: any exception raised by fetch_page(), when the caller reaches
+        that page
+
+    """
+    assert concurrency > 0
+    pool = multiprocessing.pool.ThreadPool(concurrency)
+    try:
+        next_page = first_page
+        in_flight = collections.deque()
+        for _ in range(concurrency):
+            in_flight.append(pool.apply_async(fetch_page, (next_page,)))
+            next_page += 1
+
+        while in_flight:
+            objects = in_flight.popleft().get()
+            if not objects:
+                break
+            in_flight.append(pool.apply_async(fetch_page, (next_page,)))
+            next_page += 1
+            for object_ in objects:
+                yield object_
+    finally:
+        # Any pages still in flight are past the end of the source, or the
+        # caller has stopped iterating, so their results aren't needed.
+        pool.terminate()
+        pool.join()
+
+
+def ckan_package_search(url, rows=1000, apikey=None, timeout=60, **params):
+    """Return a fetch_page() function for a CKAN site's package_search API.
+
+    Pass the returned function to iter_pages() to get all the datasets
+    matching the search.
+
+    :param url: the CKAN site's root URL, for example "http://demo.ckan.org"
+    :type url: string
+
+    :param rows: the number of datasets to fetch per page
+    :type rows: int
+
+    :param apikey: the CKAN API key to send with the requests, if any
+    :type apikey: string
+
+    :param timeout: the timeout for each request, in seconds
+    :type timeout: number
+
+    Any other keyword arguments (e.g. ``q`` or ``fq``) are sent to
+    package_search as search parameters.
+
+    """
+    endpoint = url.rstrip('/') + '/api/3/action/package_search'
+
+    def fetch_page(page):
+        query = dict(params, start=page * rows, rows=rows)
+        request = urllib2.Request(endpoint + '?' + urllib.urlencode(query))
+        if apikey:
+            request.add_header('Authorization', apikey)
+        response = urllib2.urlopen(request, timeout=timeout)
+        try:
+            return json.loads(response.read())['result']['results']
+        finally:
+            response.close()
+
+    return fetch_page
@@ -0,0 +1,90 @@
+"""Process multiple input files concurrently in a pool of worker processes.
+
+Each worker reads one input file and runs table() on it, and the resulting
+rows are merged back together in the order that the files were given in, so
+the output is the same as if the files had been concatenated and processed
+by a single process.
+
+"""
+from __future__ import absolute_import
+
+import copy
+import itertools
+import multiprocessing
+
+import losser.backends as backends
+import losser.losser as losser
+import losser.readers as readers
+
+
+def _table_file(args):
+    """Read one input file and return its table (runs in a worker process)."""
+    path, columns, json_backend, table_function = args
+    backend = backends.get(json_backend)
+    if table_function is losser.table:
+        dicts = readers.load(path, backend=backend,
+                             keys=losser.compile_columns(columns).wants_key)
+    else:
+        # Other table functions get the whole objects in a list, like the
+        # "list of dicts" that table() takes.
+        dicts = readers.materialise(readers.load(path, backend=backend))
+    return table_function(dicts, columns)
+
+
+def iter_table_files(paths, columns, processes=None, json_backend=None,
+                     table_function=None):
+    """Read the input objects from multiple JSON files and yield the rows.
+
+    The files are processed concurrently by a pool of worker processes, and
+    the rows are yielded in the same order as the files in ``paths``, each
+    file's rows as soon as that file (and all the files before it) are done.
+
+    :param paths: the paths to the input files
+    :type paths: list of strings
+
+    :param processes: the number of worker processes to use (default: the
+        number of CPUs)
+    :type processes: int
+
+    :param json_backend: the name of the JSON backend to read the files with
+    :type json_backend: string
+
+    :param table_function: the function that each worker calls to turn the
+        objects from a file into rows (default: losser.table()). This has to
+        be picklable, e.g. a module-level function.
+
+    See table() for the other params.
+
+    """
+    table_function = table_function or losser.table
+
+    # Read the columns file once here rather than once in each worker.
+    if isinstance(columns, basestring):
+        columns = losser._read_columns_file(columns)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        tables = pool.imap(
+            _table_file,
+            [(path, columns, json_backend, table_function) for path in paths])
+        for row in itertools.chain.from_iterable(tables):
+            yield row
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def table_files(paths, columns, csv=False, pretty=False, **kwargs):
+    """Like table() but reads the input objects from multiple JSON files.
+
+    The result is a single table with the rows in the same order as the files
+    in ``paths``. See iter_table_files() and table() for the params.
+
+    """
+    table_ = list(iter_table_files(paths, columns, **kwargs))
+    return losser._format_table(
+        table_, csv=csv, pretty=pretty,
+        joiners=losser.compile_columns(copy.deepcopy(columns)).joiners)
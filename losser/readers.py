@@ -0,0 +1,417 @@
+"""Readers for losser's JSON input files.
+
+Input files are memory-mapped and scanned in place rather than read into one
+big string, so that the OS pages the file in on demand and at most one JSON
+value's worth of bytes (plus a bounded read-ahead window) is copied into
+Python at a time.
+
+"""
+from __future__ import absolute_import
+
+import collections
+import itertools
+import mmap
+import os
+import random
+import re
+
+import losser.backends as backends
+import losser.losser as losser
+
+
+#: How many bytes of the memory-mapped file to copy into Python at a time.
+#: The window grows (doubling) whenever a single JSON value doesn't fit in it.
+CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Matches everything up to and including the next string or bracket.
+_NEXT_STRUCTURE = re.compile(
+    r'[^"\[\]{}]*("[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}])')
+
+# Matches the rest of the window if it could all be more of a number.
+_NUMBER_TAIL = re.compile(r'[-+.0-9eE]*\Z')
+
+# Matches a JSON string, number, true, false or null.
+_SCALAR = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[-+.0-9eE]+|true|false|null')
+
+# Matches the start of a string, true, false or null that's been cut off by
+# the end of the window.
+_PARTIAL_SCALAR = re.compile(r'"|(?:t(?:r(?:u)?)?|f(?:a(?:l(?:s)?)?)?|'
+                             r'n(?:u(?:l)?)?)\Z')
+
+# Matches the position in the json and simplejson modules' error messages.
+_ERROR_POSITION = re.compile(r'line \d+ column \d+ \(char (\d+)\)')
+
+
+class _Incomplete(Exception):
+
+    """Raised when a JSON value runs past the end of the window."""
+
+    pass
+
+
+def _value_end(buf, idx):
+    """Return the index where the JSON value that starts at buf[idx] ends.
+
+    This finds the end of the value without decoding it. It doesn't validate
+    the value (that's left to whatever decodes it) but it does correctly skip
+    over brackets and escaped quotes inside strings.
+
+    :raises _Incomplete: if the value doesn't end before the end of buf
+
+    """
+    if buf[idx:idx + 1] not in ('{', '['):
+        match = _SCALAR.match(buf, idx)
+        if match and match.end() < len(buf):
+            return match.end()
+        if match or idx == len(buf) or _PARTIAL_SCALAR.match(buf, idx):
+            raise _Incomplete()
+        # Not a valid value, leave it to the decoder to complain about.
+        return idx + 1
+    depth = 0
+    while True:
+        match = _NEXT_STRUCTURE.match(buf, idx)
+        if not match:
+            raise _Incomplete()
+        idx = match.end()
+        token = match.group(1)
+        if token in ('{', '['):
+            depth += 1
+        elif token in ('}', ']'):
+            depth -= 1
+            if depth == 0:
+                return idx
+
+
+class _Window(object):
+
+    """A sliding window onto a memory-mapped file.
+
+    ``buf`` holds a copy of the part of the file that's currently being
+    scanned. Indexes passed to and returned from the methods below are
+    relative to ``buf``, and may change whenever the window slides.
+
+    """
+
+    def __init__(self, mm, chunk_size=CHUNK_SIZE):
+        self._mm = mm
+        self._base = 0  # The offset into the file of buf[0].
+        self._size = chunk_size
+        self.buf = mm[0:chunk_size]
+
+    @property
+    def eof(self):
+        return self._base + len(self.buf) >= len(self._mm)
+
+    def _slide(self, idx):
+        """Move the start of the window to buf[idx] and return the new idx.
+
+        If the window already starts at idx then it's doubled in size instead.
+
+        """
+        if idx == 0:
+            self._size *= 2
+        self._base += idx
+        self.buf = self._mm[self._base:self._base + self._size]
+        return 0
+
+    def skip_whitespace(self, idx):
+        while True:
+            idx = _WHITESPACE.match(self.buf, idx).end()
+            if idx < len(self.buf) or self.eof:
+                return idx
+            idx = self._slide(idx)
+
+    def decode(self, idx, backend):
+        """Decode the JSON value at buf[idx], return the value and its end."""
+        if backend.raw_decode is None:
+            return self._find_and_decode(idx, backend.loads)
+        while True:
+            try:
+                value, end = backend.raw_decode(self.buf, idx)
+            except ValueError as err:
+                if self.eof or not self._cut_off(idx):
+                    # A real syntax error, raise it straight away rather than
+                    # growing the window to the end of the file first.
+                    if self._base:
+                        raise ValueError(self._error_message(err))
+                    raise
+                idx = self._slide(idx)
+                continue
+            if not self.eof and (
+                    end == len(self.buf) or
+                    (losser._is_number(value) and
+                     _NUMBER_TAIL.match(self.buf, end))):
+                # The value may have been cut short by the end of the window
+                # (e.g. the number 1234 read as 12, or 12.5 read as 12 when
+                # the window ends after the ".").
+                idx = self._slide(idx)
+                continue
+            return value, end
+
+    def _cut_off(self, idx):
+        """Return True if the value at buf[idx] runs past the end of buf."""
+        try:
+            _value_end(self.buf, idx)
+        except _Incomplete:
+            return True
+        return False
+
+    def _error_message(self, err):
+        """Return a decoding error's message with the position in it made
+        relative to the start of the file rather than to the window.
+
+        """
+        return _ERROR_POSITION.sub(
+            lambda match: "char {0}".format(
+                self._base + int(match.group(1))),
+            str(err))
+
+    def _find_and_decode(self, idx, loads):
+        """Decode the value at buf[idx] with a backend that has no raw_decode.
+
+        """
+        while True:
+            try:
+                end = _value_end(self.buf, idx)
+            except _Incomplete:
+                if self.eof:
+                    # Let the backend raise its own error for the truncated
+                    # value.
+                    return loads(self.buf[idx:]), len(self.buf)
+                idx = self._slide(idx)
+                continue
+            return loads(self.buf[idx:end]), end
+
+
+def _pruner(keys):
+    """Return a function that drops the unwanted keys from a decoded object.
+
+    Any keys of the object for which ``keys(key)`` is false are deleted. The
+    same keys turn up in object after object, so which keys are wanted is
+    remembered rather than calling keys() for every key of every object.
+
+    """
+    wanted = set()
+    unwanted = set()
+
+    def prune(value):
+        if isinstance(value, dict):
+            for key in value.keys():
+                if key in unwanted:
+                    del value[key]
+                elif key not in wanted:
+                    if len(wanted) + len(unwanted) >= losser._KEY_CACHE_SIZE:
+                        wanted.clear()
+                        unwanted.clear()
+                    if keys(key):
+                        wanted.add(key)
+                    else:
+                        unwanted.add(key)
+                        del value[key]
+        return value
+    return prune
+
+
+def _decoder(window, backend, keys):
+    """Return the function to decode each of the top-level values with.
+
+    If ``keys`` is given, the returned function drops any keys of a decoded
+    object for which ``keys(key)`` is false.
+
+    """
+    if keys is None:
+        return lambda idx: window.decode(idx, backend)
+    prune = _pruner(keys)
+
+    def decode(idx):
+        value, idx = window.decode(idx, backend)
+        return prune(value), idx
+    return decode
+
+
+def _iter_array(window, idx, backend, keys=None):
+    """Yield the items of the JSON array that starts at window.buf[idx]."""
+    decode = _decoder(window, backend, keys)
+    idx = window.skip_whitespace(idx + 1)
+    if window.buf[idx:idx + 1] == ']':
+        return
+    while True:
+        value, idx = decode(idx)
+        yield value
+        idx = window.skip_whitespace(idx)
+        char = window.buf[idx:idx + 1]
+        if char == ']':
+            return
+        elif char != ',':
+            raise ValueError(
+                "Expecting , delimiter in JSON array, got {0!r}".format(char))
+        idx = window.skip_whitespace(idx + 1)
+
+
+def _iter_values(window, idx, backend, keys=None):
+    """Yield each of a stream of whitespace-separated JSON values.
+
+    This is used for JSON Lines files (one JSON value per line).
+
+    """
+    decode = _decoder(window, backend, keys)
+    while idx < len(window.buf):
+        value, idx = decode(idx)
+        yield value
+        idx = window.skip_whitespace(idx)
+
+
+def _closing(iterator, *resources):
+    """Yield from iterator then close the given resources."""
+    try:
+        for item in iterator:
+            yield item
+    finally:
+        for resource in resources:
+            resource.close()
+
+
+def _read(data, chunk_size, backend, keys, resources):
+    """Return the JSON data from data (an mmap or a string), see load()."""
+    try:
+        window = _Window(data, chunk_size)
+        idx = window.skip_whitespace(0)
+        if window.buf[idx:idx + 1] == '[':
+            return _closing(_iter_array(window, idx, backend, keys),
+                            *resources)
+        value, idx = _decoder(window, backend, keys)(idx)
+        idx = window.skip_whitespace(idx)
+    except Exception:
+        for resource in resources:
+            resource.close()
+        raise
+
+    if idx >= len(window.buf):
+        for resource in resources:
+            resource.close()
+        return value
+    return _closing(itertools.chain([value],
+                                    _iter_values(window, idx, backend, keys)),
+                    *resources)
+
+
+def load(path, chunk_size=CHUNK_SIZE, backend=None, keys=None):
+    """Return the JSON data from the given file.
+
+    If the file contains a JSON array an iterator over the array's items is
+    returned, and items are decoded lazily as the iterator is consumed.
+    If the file contains a stream of JSON values (for example a JSON Lines
+    file with one object per line) an iterator over the values is returned.
+    Otherwise the file's single JSON value is returned.
+
+    :param path: the path to the JSON file to read
+    :type path: string
+
+    :param chunk_size: the initial size (in bytes) of the read-ahead window
+    :type chunk_size: int
+
+    :param backend: the JSON backend to decode with (default: the fastest
+        backend that's installed)
+    :type backend: losser.backends.Backend
+
+    :param keys: a function that takes a key of an object and returns whether
+        it's wanted, for example a Plan's wants_key(). If given, unwanted keys
+        are dropped from each of the array's (or stream's) objects as soon as
+        it's decoded, so they don't take up memory while the objects are
+        waiting to be turned into rows (default: keep all keys)
+    :type keys: callable
+
+    :raises ValueError: if the file doesn't contain valid JSON. For arrays and
+        streams this may not be raised until the iterator reaches the invalid
+        part of the file.
+
+    """
+    backend = backend or backends.get()
+
+    f = open(path, 'rb')
+    if os.fstat(f.fileno()).st_size == 0:
+        f.close()
+        return backend.loads('')  # Raises the backend's usual error.
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return _read(mm, chunk_size, backend, keys, (mm, f))
+
+
+def loads(text, backend=None, keys=None):
+    """Return the JSON data from the given string.
+
+    Like load() but for JSON that's already in memory (for example read from
+    stdin). The items of an array or stream are decoded one at a time as the
+    returned iterator is consumed, rather than all at once, so with ``keys``
+    the unwanted parts of the objects are never all in memory together.
+    (Backends without raw_decode() decode the whole string at once, unless
+    it's a stream of values.)
+
+    See load() for the params.
+
+    """
+    backend = backend or backends.get()
+    if not text.strip():
+        return backend.loads(text)  # Raises the backend's usual error.
+    if backend.raw_decode is None:
+        # Backends without raw_decode() would have to find the end of each
+        # value with _value_end() first, which is slower than decoding the
+        # whole string at once, so try that first.
+        try:
+            value = backend.loads(text)
+        except ValueError:
+            # Could be a stream of values (JSON Lines), which has to be
+            # decoded one value at a time.
+            return _read(text, len(text), backend, keys, ())
+        if keys is not None and isinstance(value, list):
+            return itertools.imap(_pruner(keys), value)
+        return value
+    return _read(text, len(text), backend, keys, ())
+
+
+def materialise(data):
+    """Return load()'s or loads()' result with any iterator read into a list.
+
+    This is for passing the input objects to code that expects a list of
+    dicts, as table() documents, rather than an iterator (for example a
+    table function that calls len()).
+
+    """
+    if isinstance(data, collections.Iterator):
+        return list(data)
+    return data
+
+
+def sample(objects, n, random_=None):
+    """Return a random sample of n of the given objects, in their input order.
+
+    The objects are consumed in a single pass (reservoir sampling), keeping
+    at most n of them in memory at once, so this works on iterators that are
+    too big to fit in memory such as the ones returned by load(). If there are
+    fewer than n objects then all of them are returned.
+
+    :param objects: the objects to sample from
+    :type objects: iterable
+
+    :param n: the number of objects to return
+    :type n: int
+
+    :param random_: the random number generator to use (default: the random
+        module's global generator)
+    :type random_: random.Random
+
+    :rtype: list
+
+    """
+    random_ = random_ or random
+    reservoir = []
+    for i, object_ in enumerate(objects):
+        if i < n:
+            reservoir.append((i, object_))
+        else:
+            j = random_.randint(0, i)
+            if j < n:
+                reservoir[j] = (i, object_)
+    reservoir.sort(key=lambda item: item[0])
+    return [object_ for _, object_ in reservoir]
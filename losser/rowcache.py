@@ -0,0 +1,202 @@
+"""A persistent cache of evaluated cells, shared between column specs.
+
+A RowCache stores each cell that's evaluated in a local sqlite file, keyed by
+a digest of the input object and a digest of the column's options (not its
+title). Any later export of the same objects, even with a different
+columns.json, reuses the cells of any columns that it has in common with
+earlier exports instead of evaluating them again. For example::
+
+    cache = losser.rowcache.RowCache("cells.cache")
+    try:
+        for row in cache.iter_table(dicts, columns):
+            ...
+    finally:
+        cache.close()
+
+The cache holds at most ``max_cells`` cells. When it's closed the least
+recently used cells beyond that are evicted.
+
+"""
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import itertools
+import json
+import marshal
+import sqlite3
+
+import losser.caching as caching
+import losser.losser as losser
+
+
+#: The default maximum number of cells to keep in the cache.
+MAX_CELLS = 10000000
+
+
+def _object_digest(dict_):
+    # Hashing every input object is most of the work of a warm run, so this
+    # uses marshal, which is much faster than json, and md5, which is faster
+    # than sha1 (the digests are only cache keys). Objects that marshal can't
+    # serialise, such as OrderedDicts, fall back on json.
+    #
+    # The keys aren't sorted. Objects decoded from the same JSON have their
+    # keys in the same order anyway, and if they didn't the worst that could
+    # happen is a cache miss.
+    try:
+        data = marshal.dumps(dict_)
+    except ValueError:
+        data = json.dumps(dict_, default=repr)
+    return hashlib.md5(data).hexdigest()
+
+
+class RowCache(object):
+
+    """A cache of cells keyed by (object digest, column digest).
+
+    :param path: the path to the sqlite file to keep the cache in (it's
+        created if it doesn't exist)
+    :type path: string
+
+    :param max_cells: the maximum number of cells to keep
+    :type max_cells: int
+
+    """
+
+    def __init__(self, path, max_cells=MAX_CELLS):
+        self._max_cells = max_cells
+        self._connection = sqlite3.connect(path)
+        self._connection.text_factory = str
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cells (object TEXT, column TEXT, "
+            "value TEXT, used INTEGER, PRIMARY KEY (object, column))")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS cells_used ON cells (used)")
+
+        # Each time the cache is opened is a new "run", cells are stamped
+        # with the run they were last used in.
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = 'run'").fetchone()
+        self._run = (row[0] if row else 0) + 1
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('run', ?)",
+            (self._run,))
+        self._connection.commit()
+
+        #: The number of cells that came from the cache, and the number that
+        #: had to be evaluated, so far.
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, objects, columns):
+        """Return a dict mapping (object, column) digests to cached values."""
+        cached = {}
+        column_digests = ", ".join("?" * len(columns))
+        for i in range(0, len(objects), caching.LOOKUP_SIZE):
+            chunk = objects[i:i + caching.LOOKUP_SIZE]
+            cached.update(
+                ((object_, column), value) for object_, column, value in
+                self._connection.execute(
+                    "SELECT object, column, value FROM cells "
+                    "WHERE object IN ({0}) AND column IN ({1})".format(
+                        ", ".join("?" * len(chunk)), column_digests),
+                    chunk + columns))
+        return cached
+
+    def _stamp(self, objects, columns):
+        """Mark the given objects' cells for the given columns as used in this
+        run, with one query per chunk of objects rather than one per cell.
+
+        """
+        column_digests = ", ".join("?" * len(columns))
+        for i in range(0, len(objects), caching.LOOKUP_SIZE):
+            chunk = objects[i:i + caching.LOOKUP_SIZE]
+            self._connection.execute(
+                "UPDATE cells SET used = ? WHERE object IN ({0}) AND "
+                "column IN ({1}) AND used != ?".format(
+                    ", ".join("?" * len(chunk)), column_digests),
+                [self._run] + chunk + columns + [self._run])
+
+    def table_batch(self, dicts, plan):
+        """Like losser.table_batch() but using and updating the cache.
+
+        Columns with ``return_multiple_columns`` are always evaluated.
+
+        """
+        plan = losser.compile_columns(plan)
+        if plan.filters:
+            dicts = [d for d in dicts if plan.accepts(d)]
+        objects = [_object_digest(dict_) for dict_ in dicts]
+        cacheable = [column for column in plan.columns
+                     if not column.return_multiple_columns]
+        columns = dict((column, caching.digest(column.spec))
+                       for column in cacheable)
+        cached = self._lookup(objects, list(set(columns.values())))
+
+        rows = [collections.OrderedDict() for _ in dicts]
+        used = set()
+        new = []
+        for column in plan.columns:
+            if column.return_multiple_columns:
+                for row, d in itertools.izip(rows, dicts):
+                    for k, v in column.query(d).items():
+                        row[k] = v
+                continue
+
+            column_digest = columns[column]
+            cells = [None] * len(dicts)
+            misses = []
+            for i, object_ in enumerate(objects):
+                try:
+                    cells[i] = caching.load_json(
+                        cached[(object_, column_digest)])
+                    used.add(object_)
+                except KeyError:
+                    misses.append(i)
+            if misses:
+                values = column.query_batch([dicts[i] for i in misses])
+                for i, value in itertools.izip(misses, values):
+                    cells[i] = value
+                    encoded = caching.dump_json(value)
+                    # Duplicate objects in the batch get the same cell.
+                    cached[(objects[i], column_digest)] = encoded
+                    new.append(
+                        (objects[i], column_digest, encoded, self._run))
+            self.hits += len(dicts) - len(misses)
+            self.misses += len(misses)
+
+            title = column.title
+            for row, cell in itertools.izip(rows, cells):
+                row[title] = cell
+
+        self._stamp(list(used), list(set(columns.values())))
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO cells (object, column, value, used) "
+            "VALUES (?, ?, ?, ?)", new)
+        return rows
+
+    def iter_table(self, dicts, columns, batch_size=256):
+        """Like losser.iter_table() but using and updating the cache."""
+        plan = losser.compile_columns(columns)
+        try:
+            for batch in losser._batches(dicts, batch_size):
+                for row in self.table_batch(batch, plan):
+                    yield row
+        finally:
+            self._connection.commit()
+
+    def _evict(self):
+        """Evict the least recently used cells beyond max_cells."""
+        count = self._connection.execute(
+            "SELECT COUNT(*) FROM cells").fetchone()[0]
+        if count > self._max_cells:
+            self._connection.execute(
+                "DELETE FROM cells WHERE rowid IN (SELECT rowid FROM cells "
+                "ORDER BY used LIMIT ?)", (count - self._max_cells,))
+
+    def close(self):
+        self._evict()
+        self._connection.commit()
+        self._connection.close()
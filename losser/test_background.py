@@ -0,0 +1,132 @@
+"""Tests for computing table rows in a background thread."""
+from __future__ import absolute_import
+
+import collections
+import threading
+import time
+
+import nose.tools
+
+import losser.background as background
+import losser.losser as losser
+import losser.writers as writers
+
+
+def _dicts(number_of_dicts):
+    return [{"title": "dataset {0}".format(i), "author": "author {0}".format(i)}
+            for i in range(number_of_dicts)]
+
+
+def _columns():
+    columns = collections.OrderedDict()
+    columns["Title"] = dict(pattern_path="^title$")
+    columns["Author"] = dict(pattern_path="^author$")
+    return columns
+
+
+def test_same_rows_as_iter_table():
+    for batch_size in (1, 7, 1000):
+        rows = background.iter_table_in_background(
+            _dicts(50), _columns(), batch_size=batch_size)
+        assert list(rows) == list(losser.iter_table(_dicts(50), _columns()))
+
+
+def test_rows_are_computed_in_another_thread():
+    threads = set()
+
+    def dicts():
+        for d in _dicts(10):
+            threads.add(threading.current_thread())
+            yield d
+
+    list(background.iter_table_in_background(dicts(), _columns()))
+
+    assert threads and threading.current_thread() not in threads
+
+
+def test_errors_are_raised_in_the_callers_thread():
+    columns = {"Title": dict(pattern_path=".*", unique=True)}
+    rows = background.iter_table_in_background(_dicts(10), columns)
+
+    nose.tools.assert_raises(losser.UniqueError, list, rows)
+
+
+def test_invalid_columns_file_is_raised_straight_away():
+    nose.tools.assert_raises(
+        losser.InvalidColumnsFileError, background.iter_table_in_background,
+        _dicts(10), "does_not_exist.json")
+
+
+def test_stopping_early_stops_the_worker():
+    consumed = []
+
+    def dicts():
+        for i in range(100000):
+            consumed.append(i)
+            yield {"title": i}
+
+    rows = background.iter_table_in_background(
+        dicts(), _columns(), batch_size=10, max_batches=2)
+    next(rows)
+    rows.close()
+    time.sleep(0.3)
+    count = len(consumed)
+    time.sleep(0.2)
+
+    assert len(consumed) == count
+    assert count < 100
+
+
+def test_poll():
+    """poll() should hand over the finished batches without blocking."""
+    release = threading.Event()
+
+    def dicts():
+        for d in _dicts(25):
+            release.wait()
+            yield d
+
+    table_ = background.BackgroundTable(dicts(), _columns(), batch_size=10)
+    # The worker is stuck waiting for the first dict, so nothing's ready.
+    assert table_.poll() is None
+    assert not table_.done
+    release.set()
+
+    batches = []
+    deadline = time.time() + 5
+    while not table_.done and time.time() < deadline:
+        batch = table_.poll()
+        if batch is None:
+            time.sleep(0.01)
+        else:
+            batches.append(batch)
+
+    assert table_.done
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert sum(batches, []) == losser.table(_dicts(25), _columns())
+    assert table_.poll() is None
+
+
+def test_poll_raises_errors():
+    columns = {"Title": dict(pattern_path=".*", unique=True)}
+    table_ = background.BackgroundTable(_dicts(10), columns)
+
+    deadline = time.time() + 5
+    with nose.tools.assert_raises(losser.UniqueError):
+        while time.time() < deadline:
+            table_.poll()
+            time.sleep(0.01)
+    assert table_.done
+
+
+def test_iter_csv():
+    """iter_csv() should produce the same CSV as table(), in chunks."""
+    expected = losser.table(_dicts(100), _columns(), csv=True)
+
+    chunks = list(writers.iter_csv(
+        background.iter_table_in_background(_dicts(100), _columns()),
+        chunk_size=256))
+
+    assert len(chunks) > 1
+    assert all(len(chunk) < 256 + 100 for chunk in chunks)
+    assert "".join(chunks) == expected
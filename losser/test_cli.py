@@ -3,13 +3,19 @@ from __future__ import absolute_import
 
 import collections
 import inspect
+import json
 import os
 import os.path
+import shutil
+import StringIO
+import tempfile
 
+import losser.backends as backends
 import losser.cli as cli
 
 import mock
 
+import nose
 import nose.tools
 
 
@@ -138,6 +144,41 @@ def test_input():
             "foobar", "test_columns.json", csv=True, pretty=False)
 
 
+def _len_table(dicts, columns, csv=False, pretty=False):
+    """A custom table function that needs a list of whole objects."""
+    row = {"Count": len(dicts), "Keys": " ".join(sorted(dicts[0].keys()))}
+    if csv:
+        return "{Count} {Keys}\n".format(**row)
+    return [row]
+
+
+def test_custom_table_function_gets_a_list():
+    """A custom table_function should get the input objects as a list, with
+    none of their keys pruned, however they're read.
+
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "input.json")
+        with open(path, "w") as f:
+            json.dump([{"title": "a", "notes": "b"}, {"title": "c"}], f)
+        args = ["--column", "Title", "--pattern", "^title$"]
+        expected = "2 notes title\n"
+
+        assert cli.do(args=args + ["-i", path],
+                      table_function=_len_table) == expected
+        assert cli.do(args=args, in_=open(path),
+                      table_function=_len_table) == expected
+        assert cli.do(args=args + ["-i", path, "--limit", "1"],
+                      table_function=_len_table) == "1 notes title\n"
+        # Each worker process passes its file's objects separately.
+        assert cli.do(args=args + ["-i", path, "-i", path],
+                      table_function=_len_table) == (
+            "Count,Keys\r\n2,notes title\r\n2,notes title\r\n")
+    finally:
+        shutil.rmtree(directory)
+
+
 def test_with_one_column_argument():
     """Simple test with one --column and one --pattern argument."""
     table_function = mock.Mock()
@@ -408,3 +449,516 @@ def test_column_and_columns_together():
         table_function=table_function, in_=mock_stdin)
 
     assert not table_function.called
+
+
+def test_json_backend():
+    """--json-backend should choose the library used to decode the input."""
+    mock_stdin = mock.Mock()
+    mock_stdin.read.return_value = '"foobar"'
+
+    for name in backends.available():
+        table_function = mock.Mock()
+        cli.do(
+            args=['--columns', 'test_columns.json', '--json-backend', name],
+            table_function=table_function, in_=mock_stdin)
+
+        table_function.assert_called_once_with(
+            "foobar", "test_columns.json", csv=True, pretty=False)
+
+
+@mock.patch.dict('losser.backends._cache', clear=True)
+@mock.patch('losser.backends._make_backend', side_effect=ImportError)
+def test_json_backend_not_installed(mock_make_backend):
+    """It should raise if the --json-backend isn't installed."""
+    table_function = mock.Mock()
+    nose.tools.assert_raises(
+        cli.JSONBackendError, cli.do,
+        args=['--columns', 'test_columns.json', '--json-backend', 'ujson'],
+        table_function=table_function)
+    assert not table_function.called
+
+
+def test_output():
+    """--output should write the CSV to the file instead of returning it."""
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "export.csv")
+        result = cli.do(
+            args=["--columns", _absolute_path("test_columns.json"),
+                  "--input", _absolute_path("../input.json"),
+                  "--output", path])
+
+        assert result == ""
+        expected = cli.do(
+            args=["--columns", _absolute_path("test_columns.json"),
+                  "--input", _absolute_path("../input.json")])
+        assert open(path, 'rb').read() == expected
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_output_with_return_multiple_columns():
+    """--output should work when later rows add columns.
+
+    The header should have all the columns, the same as without --output,
+    and sharding or partitioning (which write headers before they've seen
+    all the rows) should be refused up front.
+
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        columns_path = os.path.join(directory, "columns.json")
+        with open(columns_path, "w") as f:
+            json.dump({"Extras": {"pattern": ["^extras$", ".*"],
+                                  "return_multiple_columns": True}}, f)
+        input_path = os.path.join(directory, "input.json")
+        with open(input_path, "w") as f:
+            json.dump([{"extras": {"x": 1}}, {"extras": {"y": 2}}], f)
+        path = os.path.join(directory, "export.csv")
+        args = ["--columns", columns_path, "--input", input_path]
+
+        assert cli.do(args=args + ["--output", path]) == ""
+
+        assert open(path, 'rb').read() == cli.do(args=args) == (
+            "extras_x,extras_y\r\n1,\r\n,2\r\n")
+        assert cli.do(args=args + ["--pretty"]).splitlines()[1] == (
+            "| extras_x | extras_y |")
+        nose.tools.assert_raises(
+            cli.InvalidShardingError, cli.do,
+            args=args + ["--output", path, "--shard-rows", "1"])
+        nose.tools.assert_raises(
+            cli.InvalidPartitionError, cli.do,
+            args=args + ["--output", path, "--partition-by", "extras_x"])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_shard_rows():
+    """--shard-rows should split the --output file into numbered files."""
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "export.csv")
+        cli.do(
+            args=["--column", "Title", "--pattern", "^title$",
+                  "--input", _absolute_path("../input.json"),
+                  "--output", path, "--shard-rows", "3"])
+
+        shards = sorted(os.listdir(directory))
+        assert shards[0] == "export-00001.csv"
+        for shard in shards:
+            lines = open(os.path.join(directory, shard)).read().splitlines()
+            assert lines[0] == "Title"
+            assert 2 <= len(lines) <= 4
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_invalid_sharding():
+    """It should raise if sharding without --output or with --pretty."""
+    for args in (["--shard-rows", "10"],
+                 ["--shard-bytes", "1000"],
+                 ["--shard-rows", "10", "-o", "out.csv", "--pretty"],
+                 ["--shard-rows", "0", "-o", "out.csv"],
+                 ["--shard-bytes", "-1", "-o", "out.csv"]):
+        table_function = mock.Mock()
+        nose.tools.assert_raises(
+            cli.InvalidShardingError, cli.do,
+            args=["--column", "Title", "--pattern", "^title$"] + args,
+            table_function=table_function)
+        assert not table_function.called
+
+
+def test_partition_by():
+    """--partition-by should write one --output file per column value."""
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "export.csv")
+        cli.do(
+            args=["--column", "Title", "--pattern", "^title$",
+                  "--column", "License", "--pattern", "^license_id$",
+                  "--input", _absolute_path("../input.json"),
+                  "--output", path, "--partition-by", "License"])
+
+        everything = cli.do(
+            args=["--column", "Title", "--pattern", "^title$",
+                  "--column", "License", "--pattern", "^license_id$",
+                  "--input", _absolute_path("../input.json")])
+        expected_rows = everything.splitlines()[1:]
+
+        rows = []
+        for name in os.listdir(directory):
+            assert name.startswith("export-")
+            lines = open(os.path.join(directory, name)).read().splitlines()
+            assert lines[0] == "Title,License"
+            license_id = name[len("export-"):-len(".csv")]
+            if license_id == "_":
+                license_id = ""  # Datasets with no license.
+            assert all(line.endswith("," + license_id)
+                       for line in lines[1:])
+            rows.extend(lines[1:])
+        assert sorted(rows) == sorted(expected_rows)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_invalid_partition_by():
+    """It should raise if using --partition-by wrongly."""
+    for args in (["--partition-by", "Title"],
+                 ["--partition-by", "Title", "-o", "out.csv", "--pretty"],
+                 ["--partition-by", "Title", "-o", "out.csv",
+                  "--shard-rows", "10"]):
+        table_function = mock.Mock()
+        nose.tools.assert_raises(
+            cli.InvalidPartitionError, cli.do,
+            args=["--column", "Title", "--pattern", "^title$"] + args,
+            table_function=table_function)
+        assert not table_function.called
+
+
+def test_parquet_format():
+    """--format parquet should write a typed Parquet --output file."""
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise nose.SkipTest("pyarrow isn't installed")
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "export.parquet")
+        cli.do(
+            args=["--column", "Title", "--pattern", "^title$",
+                  "--column", "Views", "--pattern", "^tracking_summary$",
+                  "^total$",
+                  "--input", _absolute_path("../input.json"),
+                  "--output", path, "--format", "parquet"])
+
+        table = pyarrow.parquet.read_table(path)
+        assert table.column_names == ["Title", "Views"]
+        assert str(table.schema.field_by_name("Views").type) == "int64"
+        assert table.to_pydict()["Views"][0] == 456
+
+        # If the filters leave no rows the file is still written.
+        cli.do(
+            args=["--column", "Title", "--pattern", "^title$",
+                  "--where", "^title$", "=", "no such title",
+                  "--input", _absolute_path("../input.json"),
+                  "--output", path, "--format", "parquet"])
+
+        table = pyarrow.parquet.read_table(path)
+        assert table.column_names == ["Title"] and table.num_rows == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_invalid_parquet_format():
+    """It should raise if using --format parquet wrongly."""
+    for args in (["--format", "parquet"],
+                 ["--format", "parquet", "-o", "out.parquet", "--pretty"],
+                 ["--format", "parquet", "-o", "out.parquet",
+                  "--shard-rows", "10"],
+                 ["--format", "parquet", "-o", "out.parquet",
+                  "--partition-by", "Title"]):
+        table_function = mock.Mock()
+        nose.tools.assert_raises(
+            cli.InvalidFormatError, cli.do,
+            args=["--column", "Title", "--pattern", "^title$"] + args,
+            table_function=table_function)
+        assert not table_function.called
+
+
+def test_json_formats():
+    """--format json and jsonl should keep lists as lists."""
+    args = ["--column", "Title", "--pattern", "^title$",
+            "--column", "Formats", "--pattern", "^resources$", "^format$",
+            "--input", _absolute_path("../input.json")]
+    csv_rows = cli.do(args=args).splitlines()[1:]
+
+    objects = json.loads(cli.do(args=args + ["--format", "json"]))
+    assert len(objects) == len(csv_rows)
+    assert objects[0] == {
+        "Title": "Gold Prices in London 1950-2008 (Monthly)",
+        "Formats": ["CSV", "XLS"]}
+
+    lines = cli.do(args=args + ["--format", "jsonl"]).splitlines()
+    assert [json.loads(line) for line in lines] == objects
+
+
+def test_json_format_output_file():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "export.json")
+        args = ["--column", "Title", "--pattern", "^title$",
+                "--input", _absolute_path("../input.json")]
+
+        cli.do(args=args + ["--format", "json", "--output", path])
+
+        assert json.load(open(path)) == json.loads(
+            cli.do(args=args + ["--format", "json"]))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_pretty():
+    """--pretty should print a grid with a line for each row."""
+    args = ["--column", "Title", "--pattern", "^title$",
+            "--column", "Formats", "--pattern", "^resources$", "^format$",
+            "--input", _absolute_path("../input.json")]
+    csv_rows = cli.do(args=args).splitlines()[1:]
+
+    lines = cli.do(args=args + ["--pretty"]).splitlines()
+
+    assert lines[1].split("|")[1].strip() == "Title"
+    assert lines[3].split("|")[1].strip() == (
+        "Gold Prices in London 1950-2008 (Monthly)")
+    assert lines[3].split("|")[2].strip() == "CSV, XLS"
+    assert len(lines) == 3 + 2 * len(csv_rows)
+    assert len(set(len(line.decode("utf-8")) for line in lines)) == 1
+
+
+def test_pretty_custom_table_function():
+    """--pretty should still go through a custom table_function."""
+    table_function = mock.Mock(return_value="table")
+    mock_stdin = mock.Mock()
+    mock_stdin.read.return_value = '"foobar"'
+
+    assert cli.do(args=["--column", "Title", "--pattern", "^title$", "-p"],
+                  table_function=table_function, in_=mock_stdin) == "table"
+
+    table_function.assert_called_once_with(
+        u"foobar", collections.OrderedDict(Title={"pattern": "^title$"}),
+        csv=True, pretty=True)
+
+
+def test_pretty_width():
+    """--pretty-width should truncate the cells."""
+    args = ["--column", "Title", "--pattern", "^title$",
+            "--input", _absolute_path("../input.json"),
+            "--pretty", "--pretty-width", "10"]
+
+    lines = cli.do(args=args).splitlines()
+
+    assert lines[3] == "| Gold Pr... |"
+
+
+def test_pretty_out():
+    """If given an out file do() should write the --pretty output to it."""
+    args = ["--column", "Title", "--pattern", "^title$",
+            "--input", _absolute_path("../input.json"), "--pretty"]
+    out = StringIO.StringIO()
+
+    assert cli.do(args=args, out=out) == ""
+    assert out.getvalue() == cli.do(args=args)
+
+
+def test_invalid_pretty_width():
+    table_function = mock.Mock()
+    nose.tools.assert_raises(
+        cli.InvalidPrettyWidthError, cli.do,
+        args=["--column", "Title", "--pattern", "^title$", "--pretty",
+              "--pretty-width", "0"],
+        table_function=table_function)
+    assert not table_function.called
+
+
+def test_limit():
+    """--limit should output the rows for the first N objects only."""
+    args = ["--column", "Title", "--pattern", "^title$",
+            "--input", _absolute_path("../input.json")]
+    rows = cli.do(args=args).splitlines()
+
+    assert cli.do(args=args + ["--limit", "3"]).splitlines() == rows[:4]
+    assert cli.do(
+        args=args + ["--limit", "3", "--format", "jsonl"]).count("\n") == 3
+
+
+def test_limit_stops_reading_the_input():
+    """--limit shouldn't decode any of the input after the first N objects."""
+    fd, path = tempfile.mkstemp(suffix=".json")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write('[{"title": "one"}, {"title": "two"}, this is not JSON')
+
+        result = cli.do(args=["--column", "Title", "--pattern", "^title$",
+                              "--input", path, "--limit", "2"])
+
+        assert result.splitlines() == ["Title", "one", "two"]
+    finally:
+        os.remove(path)
+
+
+def test_sample():
+    """--sample should output the rows for N random objects, in order."""
+    args = ["--column", "Title", "--pattern", "^title$",
+            "--input", _absolute_path("../input.json")]
+    rows = cli.do(args=args).splitlines()
+
+    sample = cli.do(args=args + ["--sample", "3"]).splitlines()
+
+    assert sample[0] == "Title"
+    assert len(sample) == 4
+    assert sorted(sample[1:], key=rows.index) == sample[1:]
+
+
+def test_limit_and_sample_come_after_the_filters():
+    """--limit and --sample should count the objects that pass the filters,
+    not the input objects.
+
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "input.json")
+        with open(path, "w") as f:
+            json.dump([{"title": str(i), "state": "deleted"}
+                       for i in range(5)] +
+                      [{"title": str(i), "state": "active"}
+                       for i in range(5, 10)], f)
+        args = ["--column", "Title", "--pattern", "^title$",
+                "--where", "^state$", "=", "active", "--input", path]
+        cache_path = os.path.join(directory, "export.cache")
+
+        for extra in ([], ["--pretty"], ["--row-cache", cache_path]):
+            lines = cli.do(args=args + ["--limit", "3"] + extra).splitlines()
+            assert [line.strip("| ") for line in lines
+                    if line.strip("| ").isdigit()] == ["5", "6", "7"]
+
+            lines = cli.do(args=args + ["--sample", "3"] + extra).splitlines()
+            sample = [line.strip("| ") for line in lines
+                      if line.strip("| ").isdigit()]
+            assert len(sample) == 3
+            assert set(sample) <= set(["5", "6", "7", "8", "9"])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_invalid_limit():
+    """It should raise if --limit or --sample is invalid."""
+    for args in (["--limit", "0"], ["--sample", "-1"],
+                 ["--limit", "2", "--sample", "2"]):
+        table_function = mock.Mock()
+        nose.tools.assert_raises(
+            cli.InvalidLimitError, cli.do,
+            args=["--column", "Title", "--pattern", "^title$"] + args,
+            table_function=table_function)
+        assert not table_function.called
+
+
+def test_where():
+    """--where should only output rows for the objects that match."""
+    args = ["--column", "Resources", "--pattern", "^num_resources$",
+            "--input", _absolute_path("../input.json")]
+
+    assert cli.do(args=args + ["--where", "^num_resources$", ">", "2"]) == (
+        "Resources\r\n4\r\n3\r\n9\r\n")
+    assert cli.do(args=args + ["--where", "^license_id$", "=", "cc-by",
+                               "--where", "^private$", "=", "false"]) == (
+        "Resources\r\n9\r\n")
+    assert cli.do(args=args + ["--where", "^license_id$", "~", "^not"]) == (
+        "Resources\r\n4\r\n1\r\n")
+    assert cli.do(args=args + ["--where", "^foo$", "exists"]) == ""
+
+
+def test_separator_and_join():
+    """--separator and --join should change how the column's lists are joined.
+
+    """
+    args = ["--column", "Tags", "--pattern", "^tags$", "^name$",
+            "--separator", ";", "--input", _absolute_path("../input.json"),
+            "--limit", "1"]
+
+    assert cli.do(args=args) == "Tags\r\neconomics;gold;price;time-series\r\n"
+    assert cli.do(args=args + ["--format", "jsonl"]) == (
+        '{"Tags": ["economics", "gold", "price", "time-series"]}\n')
+    assert cli.do(args=args[:5] + ["--join", "json"] + args[7:]) == (
+        'Tags\r\n"[""economics"", ""gold"", ""price"", ""time-series""]"\r\n')
+
+
+def test_replace():
+    """--replace should substitute matches in the column's strings."""
+    args = ["--column", "Formats", "--pattern", "^resources$", "^format$",
+            "--replace", "^(.*)$", r"<\1>", "--input",
+            _absolute_path("../input.json"), "--limit", "1"]
+
+    assert cli.do(args=args) == 'Formats\r\n"<CSV>, <XLS>"\r\n'
+
+
+def test_type():
+    """--type should convert the column's values."""
+    args = ["--column", "Modified", "--pattern", "^metadata_modified$",
+            "--type", "datetime", "--column", "Private", "--pattern",
+            "^private$", "--type", "int", "--errors", "keep",
+            "--input", _absolute_path("../input.json"), "--limit", "1"]
+
+    assert cli.do(args=args) == (
+        "Modified,Private\r\n2014-10-16 15:56:49.740459,0\r\n")
+    assert cli.do(args=args + ["--format", "jsonl"]) == (
+        '{"Modified": "2014-10-16 15:56:49.740459", "Private": 0}\n')
+
+
+def test_where_with_columns_file():
+    """--where should be added to any filters from the columns file."""
+    table_function = mock.Mock()
+    mock_stdin = mock.Mock()
+    mock_stdin.read.return_value = '"foobar"'
+
+    cli.do(args=["--columns", _absolute_path("test_columns.json"),
+                 "--where", "^state$", "=", "active"],
+           table_function=table_function, in_=mock_stdin)
+
+    columns = table_function.call_args[0][1]
+    assert columns["__filters"] == [
+        {"pattern_path": ["^state$"], "equals": "active"}]
+    assert "Data Owner" in columns
+
+
+def test_invalid_where():
+    for args in (["--where", "^state$"],
+                 ["--where", "=", "active"],
+                 ["--where", "^views$", ">", "lots"],
+                 ["--where", "^state$", "~", "("]):
+        table_function = mock.Mock()
+        nose.tools.assert_raises(
+            cli.InvalidWhereError, cli.do,
+            args=["--column", "Title", "--pattern", "^title$"] + args,
+            table_function=table_function)
+        assert not table_function.called
+
+
+def test_incremental():
+    """--incremental should give the same output as a normal export."""
+    directory = tempfile.mkdtemp()
+    try:
+        args = ["--column", "Title", "--pattern", "^title$",
+                "--input", _absolute_path("../input.json")]
+        expected = cli.do(args=args)
+        args += ["--incremental", os.path.join(directory, "export.cache")]
+
+        assert cli.do(args=args) == expected
+        assert cli.do(args=args) == expected
+        assert cli.do(args=args + ["--incremental-marker", "hash"]) == (
+            expected)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_incremental_with_limit():
+    table_function = mock.Mock()
+    nose.tools.assert_raises(
+        cli.InvalidLimitError, cli.do,
+        args=["--column", "Title", "--pattern", "^title$",
+              "--incremental", "export.cache", "--limit", "10"],
+        table_function=table_function)
+    assert not table_function.called
+
+
+def test_row_cache():
+    """--row-cache should give the same output as a normal export."""
+    directory = tempfile.mkdtemp()
+    try:
+        args = ["--columns", _absolute_path("../columns.json"),
+                "--input", _absolute_path("../input.json")]
+        expected = cli.do(args=args)
+        args += ["--row-cache", os.path.join(directory, "cells.cache")]
+
+        assert cli.do(args=args) == expected
+        assert cli.do(args=args) == expected
+    finally:
+        shutil.rmtree(directory)
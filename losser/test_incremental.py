@@ -0,0 +1,166 @@
+"""Tests for incremental exports."""
+from __future__ import absolute_import
+
+import collections
+import os.path
+import shutil
+import tempfile
+
+import mock
+
+import losser.incremental as incremental
+import losser.losser as losser
+
+
+def _columns():
+    columns = collections.OrderedDict()
+    columns["Title"] = dict(pattern="^title$")
+    columns["Formats"] = dict(pattern=["^resources$", "^format$"])
+    return columns
+
+
+def _dicts():
+    return [
+        dict(id=str(i), title="dataset {0}".format(i),
+             metadata_modified="2016-01-0{0}".format(i),
+             resources=[dict(format="CSV")])
+        for i in range(1, 6)
+    ]
+
+
+class TestIncrementalCache(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "export.cache")
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def _run(self, dicts, columns=None, **kwargs):
+        """Run an export with a new cache, return its rows and the cache."""
+        cache = incremental.IncrementalCache(
+            self.path, columns or _columns(), **kwargs)
+        try:
+            return list(cache.iter_table(dicts, batch_size=2)), cache
+        finally:
+            cache.close()
+
+    def test_unchanged_objects_come_from_the_cache(self):
+        dicts = _dicts()
+        expected = losser.table(dicts, _columns())
+
+        rows, cache = self._run(dicts)
+        assert rows == expected
+        assert (cache.hits, cache.misses) == (0, 5)
+
+        dicts[2]["title"] = "new title"
+        dicts[2]["metadata_modified"] = "2016-02-01"
+        with mock.patch("losser.losser.table_batch",
+                        wraps=losser.table_batch) as table_batch:
+            rows, cache = self._run(dicts)
+
+        assert rows == losser.table(dicts, _columns())
+        assert rows[2]["Title"] == "new title"
+        assert (cache.hits, cache.misses) == (4, 1)
+        assert [len(call[0][0]) for call in table_batch.call_args_list] == [
+            0, 1, 0]
+
+    def test_changing_the_columns_clears_the_cache(self):
+        self._run(_dicts())
+
+        columns = _columns()
+        columns["Title"]["max_length"] = 3
+        rows, cache = self._run(_dicts(), columns=columns)
+
+        assert rows[0]["Title"] == "dat"
+        assert cache.misses == 5
+
+    def test_objects_missing_from_the_input_are_removed(self):
+        self._run(_dicts())
+        self._run(_dicts()[:2])
+
+        rows, cache = self._run(_dicts())
+
+        assert (cache.hits, cache.misses) == (2, 3)
+
+    def test_content_hash(self):
+        """With no marker_pattern a hash of each object should be used."""
+        dicts = _dicts()
+        self._run(dicts, marker_pattern=None)
+
+        dicts[0]["title"] = "new title"
+        rows, cache = self._run(dicts, marker_pattern=None)
+
+        assert rows[0]["Title"] == "new title"
+        assert (cache.hits, cache.misses) == (4, 1)
+
+    def test_filtered_out_objects_are_cached(self):
+        columns = _columns()
+        columns["__filters"] = [dict(pattern="^title$", not_equals="dataset 2")]
+        self._run(_dicts(), columns=columns)
+
+        rows, cache = self._run(_dicts(), columns=columns)
+
+        assert [row["Title"] for row in rows] == [
+            "dataset 1", "dataset 3", "dataset 4", "dataset 5"]
+        assert (cache.hits, cache.misses) == (5, 0)
+
+    def test_objects_without_ids_are_always_evaluated(self):
+        dicts = _dicts()
+        del dicts[0]["id"]
+        self._run(dicts)
+
+        rows, cache = self._run(dicts)
+
+        assert rows == losser.table(dicts, _columns())
+        assert (cache.hits, cache.misses) == (4, 1)
+
+    def test_typed_cells(self):
+        """Datetime cells, including ones before 1900, should come out of the
+        cache unchanged.
+
+        """
+        dicts = _dicts()
+        dicts[0]["metadata_modified"] = "1850-01-01"
+        columns = {"Modified": dict(pattern="^metadata_modified$",
+                                    type="datetime")}
+        self._run(dicts, columns=columns)
+
+        rows, cache = self._run(dicts, columns=columns)
+
+        assert rows == losser.table(dicts, columns)
+        assert rows[0]["Modified"].year == 1850
+        assert (cache.hits, cache.misses) == (5, 0)
+
+    def test_wants_key(self):
+        cache = incremental.IncrementalCache(self.path, _columns())
+        try:
+            assert [key for key in ("id", "title", "notes", "resources",
+                                    "metadata_modified")
+                    if cache.wants_key(key)] == [
+                "id", "title", "resources", "metadata_modified"]
+        finally:
+            cache.close()
+
+    def test_id_pattern_with_path_steps(self):
+        """An id pattern that starts with a path step such as "**" could be
+        under any key, so every key should be wanted.
+
+        """
+        dicts = [dict(title="dataset {0}".format(i), meta=dict(id=str(i)))
+                 for i in range(1, 4)]
+        cache = incremental.IncrementalCache(
+            self.path, _columns(), id_pattern=["**", "^id$"],
+            marker_pattern=None)
+        try:
+            assert cache.wants_key("meta") and cache.wants_key("anything")
+        finally:
+            cache.close()
+        self._run(dicts, id_pattern=["**", "^id$"], marker_pattern=None)
+
+        rows, cache = self._run(dicts, id_pattern=["**", "^id$"],
+                                marker_pattern=None)
+
+        assert rows == losser.table(dicts, _columns())
+        assert (cache.hits, cache.misses) == (3, 0)
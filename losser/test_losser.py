@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+import array
 import collections
+import datetime
 import os.path
 import inspect
 
+import mock
+import nose
 import nose.tools
 
 import losser
@@ -477,6 +481,44 @@ def test_returning_csv():
     )
 
 
+def test_returning_csv_does_not_change_the_rows():
+    """Joining lists into CSV cells shouldn't change the table's rows."""
+    table_ = [collections.OrderedDict([("Formats", ["CSV", "JSON"])]),
+              collections.OrderedDict([("Formats", "CSV"), ("Extra", 1)])]
+
+    csv_string = losser._table_to_csv(table_)
+
+    assert csv_string == 'Formats,Extra\r\n"CSV, JSON",\r\nCSV,1\r\n'
+    assert table_[0]["Formats"] == ["CSV", "JSON"]
+
+
+def test_separator_and_join():
+    """Each column's lists should be joined with its own separator or join.
+
+    """
+    rows = [{"tags": ["a", "b"], "formats": ["CSV", u"\xfc"], "ids": [1, 2]}]
+    columns = collections.OrderedDict()
+    columns["Tags"] = dict(pattern="^tags$", separator=u" | ")
+    columns["Formats"] = dict(pattern="^formats$", join="json")
+    columns["Ids"] = dict(pattern="^ids$")
+
+    csv_string = losser.table(rows, columns, csv=True)
+
+    assert csv_string == (
+        "Tags,Formats,Ids\r\n"
+        'a | b,"[""CSV"", ""\xc3\xbc""]","1, 2"\r\n')
+    # The rows themselves are the same either way.
+    assert losser.table(rows, columns) == [collections.OrderedDict(
+        [("Tags", ["a", "b"]), ("Formats", ["CSV", u"\xfc"]),
+         ("Ids", [1, 2])])]
+
+
+def test_invalid_join():
+    nose.tools.assert_raises(
+        ValueError, losser.table, [], {"Tags": dict(pattern="^tags$",
+                                                    join="semicolons")})
+
+
 def test_returning_multiple_matches_as_extra_columns():
     """Test table() returns additional multiple matches as appended columns"""
     rows = [
@@ -593,3 +635,503 @@ def test_that_options_are_not_supported_yet():
     assert '__options' not in columns, (
         "'__options' should be filtered out of columns.json files because it "
         "isn't supported yet.")
+
+
+def _query_test_cases():
+    """Return (pattern_path, dict, query options) tuples for testing plans."""
+    d = collections.OrderedDict((
+        ("title", u" my dataset "),
+        ("author", "Guybrush"),
+        ("tags", ["b", "a", "b", ["c", 1, None, True]]),
+        ("extras", collections.OrderedDict((
+            ("Update", " daily "), ("updated", "hourly"), ("foo", 42)))),
+        ("resources", [
+            collections.OrderedDict((("format", "CSV"), ("size", 10))),
+            collections.OrderedDict((("format", "CSV"), ("Format", "JSON"))),
+            {"url": "http://example.com"},
+        ]),
+        ("views", ((1, 2), (3,))),
+    ))
+    return [
+        ("^title$", d, {}),
+        ("^title$", d, dict(strip=True)),
+        ("^title$", d, dict(strip=True, max_length=3, hyperlink=True)),
+        ("^title$", d, dict(string_transformations=[lambda x: x.upper()])),
+        ("^tags$", d, {}),
+        ("^tags$", d, dict(deduplicate=True)),
+        ("^views$", d, {}),
+        ("missing", d, {}),
+        (["^extras$", "update"], d, dict(strip=True)),
+        (["^extras$", "Update"], d, dict(case_sensitive=True)),
+        (["^extras$", ".*"], d, {}),
+        (["^resources$", "format"], d, {}),
+        (["^resources$", "format"], d, dict(deduplicate=True)),
+        (["^resources$", "format"], d, dict(case_sensitive=True)),
+        ([], " foo ", dict(strip=True)),
+        ([], 42, {}),
+        ("^(title|author|tags)$", d, dict(deduplicate=True, strip=True)),
+    ]
+
+
+def test_compiled_columns_match_query():
+    """A compiled column should give the same result as query()."""
+    for pattern_path, d, options in _query_test_cases():
+        plan = losser.compile_columns(
+            {"Column": dict(pattern_path=pattern_path, **options)})
+        expected = losser.query(pattern_path, d, **options)
+        assert plan.columns[0].query(d) == expected, (pattern_path, options)
+
+
+def test_compiled_column_unique():
+    plan = losser.compile_columns(
+        {"Column": dict(pattern_path="update", unique=True)})
+    d = {"last_updated": "recently", "update_frequency": "quite often"}
+
+    nose.tools.assert_raises(losser.UniqueError, plan.columns[0].query, d)
+
+
+def test_compile_columns_from_file():
+    plan = losser.compile_columns(
+        os.path.join(_this_directory(), "test_columns.json"))
+
+    assert plan.titles == ["Data Owner", "Description", "Formats"]
+    assert losser.compile_columns(plan) is plan
+
+
+def test_compile_columns_with_unknown_option():
+    nose.tools.assert_raises(
+        TypeError, losser.compile_columns,
+        {"Title": dict(pattern_path="^title$", foo=True)})
+
+
+def test_table_batch():
+    """table_batch() should give the same rows as calling query() per cell."""
+    dicts = [
+        dict(title="dataset {0}".format(i), extras=dict(update="hourly"),
+             resources=[dict(format="CSV"), dict(format=" csv ")])
+        for i in range(10)
+    ]
+    columns = collections.OrderedDict()
+    columns["Title"] = dict(pattern_path="^title$", max_length=9)
+    columns["Update"] = dict(pattern_path=["^extras$", "update"])
+    columns["Formats"] = dict(pattern_path=["^resources$", "^format$"],
+                              strip=True)
+    columns["Extras"] = dict(pattern_path=["^extras$", ".*"],
+                             return_multiple_columns=True)
+    plan = losser.compile_columns(columns)
+
+    rows = losser.table_batch(dicts, plan)
+
+    assert rows == [
+        collections.OrderedDict((
+            ("Title", "dataset {0}".format(i)[:9]),
+            ("Update", "hourly"),
+            ("Formats", ["CSV", "csv"]),
+            ("extras_update", ["hourly"]),
+        ))
+        for i in range(10)
+    ]
+    assert [row.keys() for row in rows] == [
+        ["Title", "Update", "Formats", "extras_update"]] * 10
+
+
+def test_table_batch_transforms_each_string_once():
+    """Repeated strings in a batch should only be transformed once."""
+    calls = []
+
+    def transform(s):
+        calls.append(s)
+        return s.upper()
+
+    dicts = [dict(format=format_) for format_ in ["csv", "json", "csv"] * 10]
+    plan = losser.compile_columns({
+        "Format": dict(pattern_path="^format$",
+                       string_transformations=[transform])})
+
+    rows = losser.table_batch(dicts, plan)
+
+    assert [row["Format"] for row in rows] == ["CSV", "JSON", "CSV"] * 10
+    assert sorted(calls) == ["csv", "json"]
+
+
+def test_iter_table_batch_sizes():
+    """iter_table() should give the same rows whatever the batch size."""
+    dicts = [dict(title="dataset {0}".format(i)) for i in range(10)]
+    columns = {"Title": dict(pattern_path="^title$")}
+    expected = losser.table(dicts, columns)
+
+    for batch_size in (1, 3, 10, 100):
+        assert list(losser.iter_table(
+            iter(dicts), columns, batch_size=batch_size)) == expected
+
+
+def test_columns_layout():
+    """layout="columns" should return the table column by column."""
+    rows = [
+        dict(title="dataset one", views=10, score=1.5, private=False,
+             resources=[dict(format="CSV")]),
+        dict(title="dataset two", views=20, score=2.5, private=True,
+             resources=[dict(format="CSV"), dict(format="JSON")]),
+        dict(title="dataset three", views=30, score=None, private=False),
+    ]
+    columns = collections.OrderedDict()
+    columns["Title"] = dict(pattern_path="^title$")
+    columns["Views"] = dict(pattern_path="^views$")
+    columns["Score"] = dict(pattern_path="^score$")
+    columns["Private"] = dict(pattern_path="^private$")
+    columns["Formats"] = dict(pattern_path=["^resources$", "^format$"])
+
+    table = losser.table(rows, columns, layout="columns")
+
+    assert table.keys() == ["Title", "Views", "Score", "Private", "Formats"]
+    assert table["Title"] == ["dataset one", "dataset two", "dataset three"]
+    assert table["Formats"] == ["CSV", ["CSV", "JSON"], None]
+    assert table["Private"] == [False, True, False]
+    assert table["Score"] == [1.5, 2.5, None]
+
+    # All-int columns are stored compactly.
+    assert isinstance(table["Views"], array.array)
+    assert table["Views"].tolist() == [10, 20, 30]
+
+    # The values should be the same as in the rows layout.
+    for i, row in enumerate(losser.table(rows, columns)):
+        for title, value in row.items():
+            assert table[title][i] == value
+
+
+def test_columns_layout_with_multiple_columns():
+    """Columns that appear part way through should be padded with Nones."""
+    rows = [
+        dict(title="one", extras=dict(a=1.5)),
+        dict(title="two", extras=dict(b="x")),
+        dict(title="three", extras=collections.OrderedDict(
+            (("a", 2.5), ("b", "y")))),
+    ]
+    columns = collections.OrderedDict()
+    columns["Extras"] = dict(pattern_path=["^extras$", ".*"],
+                             return_multiple_columns=True)
+    columns["Title"] = dict(pattern_path="^title$")
+
+    for batch_size in (1, 2, 10):
+        table = losser._table_columns(rows, losser.compile_columns(columns),
+                                      batch_size=batch_size)
+
+        assert table == collections.OrderedDict((
+            ("extras_a", [[1.5], None, [2.5]]),
+            ("extras_b", [None, ["x"], ["y"]]),
+            ("Title", ["one", "two", "three"]),
+        ))
+
+
+def test_columns_to_dataframe():
+    try:
+        import pandas
+    except ImportError:
+        raise nose.SkipTest("pandas isn't installed")
+    rows = [dict(title="one", views=1, score=0.5),
+            dict(title="two", views=2, score=1.5)]
+    columns = collections.OrderedDict()
+    columns["Title"] = dict(pattern_path="^title$")
+    columns["Views"] = dict(pattern_path="^views$")
+    columns["Score"] = dict(pattern_path="^score$")
+
+    dataframe = losser.columns_to_dataframe(
+        losser.table(rows, columns, layout="columns"))
+
+    assert list(dataframe.columns) == ["Title", "Views", "Score"]
+    assert dataframe["Views"].dtype.kind == "i"
+    assert dataframe["Score"].tolist() == [0.5, 1.5]
+    assert dataframe["Title"].tolist() == ["one", "two"]
+
+
+def test_tuples_layout():
+    """layout="tuples" should return a Table that acts like the list of dicts.
+
+    """
+    rows = [
+        dict(title="dataset {0}".format(i), resources=[dict(format="CSV")])
+        for i in range(5)
+    ]
+    columns = collections.OrderedDict()
+    columns["Title"] = dict(pattern_path="^title$")
+    columns["Formats"] = dict(pattern_path=["^resources$", "^format$"])
+    expected = losser.table(rows, columns)
+
+    table = losser.table(rows, columns, layout="tuples")
+
+    assert table.header == ("Title", "Formats")
+    assert table.rows == [("dataset {0}".format(i), "CSV") for i in range(5)]
+    assert table == expected
+    assert not table != expected
+    assert expected == table and tuple(expected) == table
+    # Comparing with things that aren't tables shouldn't raise.
+    assert table != None and not table == 5 and table != "abc"
+    assert table in [None, 5, table]
+    assert len(table) == 5
+    assert table[1] == expected[1]
+    assert table[1].keys() == ["Title", "Formats"]
+    assert table[1:3] == expected[1:3]
+    assert list(table) == expected
+    assert losser._table_to_csv(list(table)) == losser._table_to_csv(expected)
+
+
+def test_tuples_layout_with_multiple_columns():
+    columns = {"Extras": dict(pattern_path=["^extras$", ".*"],
+                              return_multiple_columns=True)}
+    nose.tools.assert_raises(ValueError, losser.table,
+                             [dict(extras=dict(a=1))], columns,
+                             layout="tuples")
+
+
+def _filter_test_dicts():
+    return [
+        dict(name="a", state="active", private=False, views="12",
+             resources=[dict(format="CSV"), dict(format="JSON")]),
+        dict(name="b", state="deleted", private=False, views=100,
+             resources=[dict(format="XLS")]),
+        dict(name="c", state="active", private=True, views=None,
+             resources=[]),
+        dict(name="d", state="active", private=0, views=3),
+    ]
+
+
+def _filtered_names(*filters):
+    columns = collections.OrderedDict()
+    columns["Name"] = dict(pattern="^name$")
+    columns["__filters"] = list(filters)
+    return [row["Name"] for row in losser.table(_filter_test_dicts(), columns)]
+
+
+def test_filters():
+    assert _filtered_names(
+        dict(pattern="^state$", equals="active")) == ["a", "c", "d"]
+    assert _filtered_names(
+        dict(pattern="^state$", not_equals="active")) == ["b"]
+    assert _filtered_names(
+        dict(pattern="^private$", equals=False)) == ["a", "b"]
+    assert _filtered_names(
+        dict(pattern="^name$", regex="^[ab]$")) == ["a", "b"]
+    assert _filtered_names(dict(pattern="^views$", exists=False)) == ["c"]
+    assert _filtered_names(
+        dict(pattern="^views$", gt=5, le=100)) == ["a", "b"]
+    assert _filtered_names(
+        dict(pattern_path=["^resources$", "^format$"], equals="JSON")) == [
+            "a"]
+    assert _filtered_names(
+        dict(pattern="^resources$", exists=True)) == ["a", "b"]
+
+
+def test_all_filters_must_pass():
+    assert _filtered_names(
+        dict(pattern="^state$", equals="active"),
+        dict(pattern="^private$", equals=False)) == ["a"]
+
+
+def test_rejected_dicts_are_not_evaluated():
+    """Columns shouldn't be evaluated for dicts that don't pass the filters.
+
+    """
+    # A column whose pattern path ends before the dicts do raises IndexError
+    # (like query()), so this would fail if the rejected dict was evaluated.
+    columns = collections.OrderedDict()
+    columns["Extras"] = dict(pattern="^extras$")
+    columns["__filters"] = [dict(pattern="^name$", equals="a")]
+    dicts = [dict(name="a", extras="x"), dict(name="b", extras=dict(c=1))]
+
+    assert losser.table(dicts, columns) == [{"Extras": "x"}]
+
+
+def test_filters_with_other_layouts():
+    columns = collections.OrderedDict()
+    columns["Name"] = dict(pattern="^name$")
+    columns["__filters"] = [dict(pattern="^state$", equals="deleted")]
+
+    assert losser.table(_filter_test_dicts(), columns,
+                        layout="tuples").rows == [("b",)]
+    assert losser.table(_filter_test_dicts(), columns,
+                        layout="columns") == {"Name": ["b"]}
+    assert losser.table_batch(_filter_test_dicts(), columns) == [
+        {"Name": "b"}]
+
+
+def test_invalid_filters():
+    for filter_ in ("^state$",
+                    dict(equals="active"),
+                    dict(pattern="^state$"),
+                    dict(pattern="^state$", foo="active"),
+                    dict(pattern="^views$", gt="5"),
+                    dict(pattern="^name$", regex="(")):
+        nose.tools.assert_raises(
+            losser.InvalidFilterError, losser.compile_filter, filter_)
+
+
+def test_wants_key():
+    """A plan should want the keys that its columns and filters start with.
+
+    """
+    columns = collections.OrderedDict()
+    columns["Title"] = dict(pattern="^title$")
+    columns["Formats"] = dict(pattern=["^resources$", "^format$"])
+    columns["__filters"] = [dict(pattern="^state$", equals="active")]
+    plan = losser.compile_columns(columns)
+
+    assert [key for key in ("title", "resources", "format", "state", "notes")
+            if plan.wants_key(key)] == ["title", "resources", "state"]
+
+
+def test_interner():
+    interner = losser.Interner(max_size=2)
+    a = "".join(["fo", "o"])
+    b = "".join(["f", "oo"])
+    assert a is not b
+
+    assert interner(a) is a
+    assert interner(b) is a
+    assert type(interner(u"foo")) is unicode
+    interner("bar")
+    interner("baz")  # The interner is full, so it starts again.
+    assert interner(b) is b
+
+
+def test_intern_strings():
+    """intern_strings=True should make equal cells share one string."""
+    dicts = [dict(format="".join(["CS", "V"]), title=" dataset ")
+             for _ in range(600)]
+    columns = collections.OrderedDict()
+    columns["Format"] = dict(pattern="^format$")
+    columns["Title"] = dict(pattern="^title$", strip=True)
+
+    table = losser.table(dicts, columns, layout="columns",
+                         intern_strings=True)
+
+    assert table == losser.table(dicts, columns, layout="columns")
+    assert len(set(id(value) for value in table["Format"])) == 1
+    assert len(set(id(value) for value in table["Title"])) == 1
+    assert len(set(id(row["Format"]) for row in losser.table(
+        dicts, columns, intern_strings=True))) == 1
+
+
+def test_typed_columns():
+    """The type option should convert the column's values."""
+    dicts = [
+        {"n": "12", "f": "1.5", "b": "Yes", "d": "2016-01-02T03:04:05Z"},
+        {"n": 3.0, "f": 2, "b": 0, "d": u"2016-01-02"},
+        {"n": ["1", "2e1"], "f": None, "b": False, "d": "2016-01-02 03:04:05"},
+    ]
+    columns = collections.OrderedDict()
+    columns["N"] = dict(pattern="^n$", type="int")
+    columns["F"] = dict(pattern="^f$", type="float")
+    columns["B"] = dict(pattern="^b$", type="bool")
+    columns["D"] = dict(pattern="^d$", type="datetime")
+
+    rows = losser.table(dicts, columns)
+
+    assert [row.values() for row in rows] == [
+        [12, 1.5, True, datetime.datetime(2016, 1, 2, 3, 4, 5)],
+        [3, 2.0, False, datetime.datetime(2016, 1, 2)],
+        [[1, 20], None, False, datetime.datetime(2016, 1, 2, 3, 4, 5)],
+    ]
+    assert type(rows[1]["N"]) is int
+    for dict_, row in zip(dicts, rows):
+        assert row.values() == [
+            losser.query(dict_=dict_, **spec) for spec in
+            losser._normalise_columns(columns).values()]
+
+    assert losser.table(dicts, columns, csv=True).splitlines()[1] == (
+        "12,1.5,True,2016-01-02 03:04:05")
+
+
+def test_type_errors():
+    dicts = [{"n": "12"}, {"n": "twelve"}, {"n": 1.5}, {"n": [1, "x"]}]
+
+    def column(**kwargs):
+        rows = losser.table(dicts, {"N": dict(pattern="^n$", type="int",
+                                              **kwargs)})
+        return [row["N"] for row in rows]
+
+    assert column() == [12, None, None, [1, None]]
+    assert column(errors="keep") == [12, "twelve", 1.5, [1, "x"]]
+    nose.tools.assert_raises(losser.CoercionError, column, errors="raise")
+    nose.tools.assert_raises(ValueError, column, errors="ignore")
+    nose.tools.assert_raises(
+        ValueError, losser.table, dicts, {"N": dict(pattern="^n$",
+                                                    type="decimal")})
+
+
+def test_path_steps():
+    """Pattern paths can contain **, [N], [START:STOP] and [?REGEX] steps."""
+    dict_ = {
+        "title": "Gold",
+        "resources": [
+            {"format": "CSV", "url": "http://a", "extras": {"format": "TXT"}},
+            {"format": "XLS"},
+            {"format": "PDF", "url": "http://c"},
+        ],
+        "format": "JSON",
+    }
+
+    def query(*pattern_path):
+        result = losser.query(pattern_path=list(pattern_path), dict_=dict_)
+        assert losser.table([dict_], {"X": dict(
+            pattern_path=list(pattern_path))})[0]["X"] == result
+        return result
+
+    assert sorted(query("**", "^format$")) == [
+        "CSV", "JSON", "PDF", "TXT", "XLS"]
+    # Each value is only found once, however many ways the path matches it.
+    assert sorted(query("**", "**", "^format$")) == sorted(
+        query("**", "^format$"))
+    assert sorted(query("^resources$", "**", "^format$")) == [
+        "CSV", "PDF", "TXT", "XLS"]
+    assert query("^resources$", "*[0]", "^format$") == "CSV"
+    assert query("^resources$", "*[-1]", "^format$") == "PDF"
+    assert query("^resources$", "*[1:]", "^format$") == ["XLS", "PDF"]
+    assert query("^resources$", "*[::2]", "^url$") == ["http://a", "http://c"]
+    assert query("^resources$", "*[?^url$]", "^format$") == ["CSV", "PDF"]
+    assert sorted(query("^resources$", "*[?^extras$]", "**", "^format$")) == [
+        "CSV", "TXT"]
+    # A value that isn't a list counts as a one-item list.
+    assert query("^title$", "*[0]") == "Gold"
+    assert query("^title$", "*[1]") is None
+    # Dicts that the path ends on are left out.
+    assert query("^resources$", "*[0]", "^extras$") is None
+    # Anything that a regex could match is a key pattern, not a step.
+    assert query("[0]") is None
+    assert losser.query(pattern_path="[0]", dict_={"a0": 1}) == 1
+    assert losser.query(pattern_path=["[?a]"], dict_={"?": 1}) == 1
+
+
+def test_path_steps_visit_each_node_once():
+    deep = {"value": 0}
+    for i in range(1, 100):
+        deep = {"child": deep, "value": i}
+    column = losser._CompiledColumn(
+        "X", ["**", "**", "**", "^value$"])
+
+    calls = []
+    original_walk = losser._PathAutomaton._walk
+
+    def walk(self, node, states, result):
+        calls.append(node)
+        return original_walk(self, node, states, result)
+
+    with mock.patch.object(losser._PathAutomaton, "_walk", walk):
+        assert sorted(column.query(deep)) == range(100)
+
+    # Once for each dict (the leaf values are handled without a call).
+    assert len(calls) == 100
+
+
+def test_path_steps_with_return_multiple_columns():
+    nose.tools.assert_raises(
+        ValueError, losser.table, [], {"X": dict(
+            pattern_path=["**", "^format$"], return_multiple_columns=True)})
+
+
+def test_path_steps_wants_key():
+    plan = losser.compile_columns({"X": dict(pattern_path=["**", "^a$"]),
+                                   "Y": dict(pattern_path=["^b$", "*[0]"])})
+    assert plan.wants_key("anything")
+
+    plan = losser.compile_columns({"Y": dict(pattern_path=["^b$", "*[0]"])})
+    assert plan.wants_key("b") and not plan.wants_key("c")
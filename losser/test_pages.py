@@ -0,0 +1,135 @@
+"""Tests for reading input objects from paginated sources."""
+from __future__ import absolute_import
+
+import BaseHTTPServer
+import collections
+import json
+import SocketServer
+import threading
+import time
+import urlparse
+
+import nose.tools
+
+import losser.losser as losser
+import losser.pages as pages
+
+
+class _PackageSearchHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """A stand-in for a CKAN site's package_search API."""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.requests.append(self.path)
+        try:
+            time.sleep(0.01)  # Pretend to be a slow network.
+            query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+            start = int(query['start'][0])
+            rows = int(query['rows'][0])
+            body = json.dumps({
+                "success": True,
+                "result": {
+                    "count": len(server.datasets),
+                    "results": server.datasets[start:start + rows],
+                },
+            })
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestCKANPackageSearch(object):
+
+    def setup(self):
+        self.server = _Server(("127.0.0.1", 0), _PackageSearchHandler)
+        self.server.datasets = [
+            {"name": "dataset-{0}".format(i), "author": "author {0}".format(i)}
+            for i in range(23)]
+        self.server.lock = threading.Lock()
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.01,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:{0}".format(self.server.server_port)
+
+    def teardown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_all_pages_in_order(self):
+        fetch_page = pages.ckan_package_search(self.url, rows=5)
+
+        datasets = list(pages.iter_pages(fetch_page, concurrency=3))
+
+        assert datasets == self.server.datasets
+        assert 1 < self.server.max_in_flight <= 3
+
+    def test_search_params(self):
+        fetch_page = pages.ckan_package_search(self.url, rows=10,
+                                               q="tags:economy")
+
+        list(pages.iter_pages(fetch_page, concurrency=1))
+
+        assert len(self.server.requests) == 4
+        for path in self.server.requests:
+            assert "q=tags%3Aeconomy" in path
+
+    def test_into_table(self):
+        """The objects can be piped straight into iter_table()."""
+        columns = collections.OrderedDict()
+        columns["Name"] = dict(pattern_path="^name$")
+        fetch_page = pages.ckan_package_search(self.url, rows=4)
+
+        rows = losser.iter_table(pages.iter_pages(fetch_page), columns)
+
+        assert [row["Name"] for row in rows] == [
+            "dataset-{0}".format(i) for i in range(23)]
+
+
+def test_backpressure():
+    """Pages should only be fetched a bounded distance ahead of the consumer.
+
+    """
+    fetched = []
+
+    def fetch_page(page):
+        fetched.append(page)
+        return [page] if page < 100 else []
+
+    iterator = pages.iter_pages(fetch_page, concurrency=2)
+    assert next(iterator) == 0
+    assert next(iterator) == 1
+    time.sleep(0.05)
+    assert max(fetched) <= 4
+    iterator.close()
+
+
+def test_fetch_error():
+    """Errors from fetch_page() should be raised when the page is reached."""
+    def fetch_page(page):
+        if page == 2:
+            raise IOError("Connection refused")
+        return [page]
+
+    iterator = pages.iter_pages(fetch_page, concurrency=2)
+    assert next(iterator) == 0
+    assert next(iterator) == 1
+    nose.tools.assert_raises(IOError, next, iterator)
@@ -0,0 +1,92 @@
+"""Tests for processing multiple input files in parallel."""
+from __future__ import absolute_import
+
+import collections
+import json
+import os
+import os.path
+import shutil
+import tempfile
+
+import losser.cli as cli
+import losser.parallel as parallel
+
+
+def _write_input_files(directory, number_of_files, rows_per_file):
+    """Write some input files to the directory and return their paths."""
+    paths = []
+    for i in range(number_of_files):
+        path = os.path.join(directory, "input_{0:02d}.json".format(i))
+        with open(path, 'w') as f:
+            json.dump(
+                [{"title": "file {0} row {1}".format(i, j),
+                  "resources": [{"format": "CSV"}, {"format": "JSON"}]}
+                 for j in range(rows_per_file)],
+                f)
+        paths.append(path)
+    return paths
+
+
+def _columns():
+    columns = collections.OrderedDict()
+    columns["Title"] = dict(pattern_path="^title$")
+    columns["Formats"] = dict(pattern_path=["^resources$", "^format$"])
+    return columns
+
+
+def test_table_files():
+    """The rows from all the files should be merged in file order."""
+    directory = tempfile.mkdtemp()
+    try:
+        paths = _write_input_files(directory, 12, 3)
+
+        table = parallel.table_files(paths, _columns(), processes=3)
+
+        assert [row["Title"] for row in table] == [
+            "file {0} row {1}".format(i, j)
+            for i in range(12) for j in range(3)]
+        assert all(row["Formats"] == ["CSV", "JSON"] for row in table)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_table_files_csv():
+    """The CSV output should have one header row."""
+    directory = tempfile.mkdtemp()
+    try:
+        paths = _write_input_files(directory, 3, 2)
+
+        csv_string = parallel.table_files(paths, _columns(), csv=True)
+
+        assert csv_string == (
+            "Title,Formats\r\n"
+            'file 0 row 0,"CSV, JSON"\r\n'
+            'file 0 row 1,"CSV, JSON"\r\n'
+            'file 1 row 0,"CSV, JSON"\r\n'
+            'file 1 row 1,"CSV, JSON"\r\n'
+            'file 2 row 0,"CSV, JSON"\r\n'
+            'file 2 row 1,"CSV, JSON"\r\n'
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_multiple_input_arguments():
+    """Multiple --input args and globs should all be read, in order."""
+    directory = tempfile.mkdtemp()
+    try:
+        paths = _write_input_files(directory, 4, 1)
+        args = ["--column", "Title", "--pattern", "^title$", "--jobs", "2"]
+
+        # Globs are expanded in sorted order.
+        expected = ("Title\r\n" +
+                    "".join("file {0} row 0\r\n".format(i) for i in range(4)))
+        assert cli.do(args=args + [
+            "--input", os.path.join(directory, "*.json")]) == expected
+
+        # Explicitly listed files are processed in the order given.
+        expected = "Title\r\nfile 3 row 0\r\nfile 0 row 0\r\nfile 1 row 0\r\n"
+        assert cli.do(args=args + [
+            "--input", paths[3], paths[0], "-i", paths[1]]) == expected
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""Tests for reading JSON input files."""
+from __future__ import absolute_import
+
+import json
+import random
+import os
+import tempfile
+import types
+
+import mock
+import nose.tools
+
+import losser.backends as backends
+import losser.readers as readers
+
+
+def _write_temp_file(contents):
+    """Write the given string to a new temporary file and return its path."""
+    fd, path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(contents)
+    return path
+
+
+def _load(contents, **kwargs):
+    path = _write_temp_file(contents)
+    try:
+        result = readers.load(path, **kwargs)
+        if isinstance(result, types.GeneratorType):
+            result = list(result)
+        return result
+    finally:
+        os.remove(path)
+
+
+def test_array_is_returned_lazily():
+    """A top-level JSON array should be returned as an iterator of its items.
+
+    """
+    path = _write_temp_file('[{"title": "one"}, {"title": "two"}]')
+    try:
+        result = readers.load(path)
+        assert not isinstance(result, list)
+        assert list(result) == [{"title": "one"}, {"title": "two"}]
+    finally:
+        os.remove(path)
+
+
+def test_empty_array():
+    assert _load(' [ ] ') == []
+
+
+def test_single_value():
+    """A file containing one non-array value should return that value."""
+    assert _load('"foobar"\n') == "foobar"
+    assert _load('{"title": "one"}') == {"title": "one"}
+
+
+def test_json_lines():
+    """A file with one JSON object per line should return all the objects."""
+    assert _load('{"title": "one"}\n{"title": "two"}\n\n{"title": "3"}\n') == [
+        {"title": "one"}, {"title": "two"}, {"title": "3"}]
+
+
+def test_values_larger_than_the_window():
+    """Values that don't fit in the read-ahead window should still be read.
+
+    """
+    objects = [
+        {"title": u"dataset {0} ü".format(i), "views": 10 ** i,
+         "notes": "x" * (i * 7)}
+        for i in range(20)
+    ]
+    contents = json.dumps(objects, indent=2)
+
+    for chunk_size in (1, 2, 5, 16, 100, len(contents)):
+        assert _load(contents, chunk_size=chunk_size) == objects
+
+    lines = '\n'.join(json.dumps(object_) for object_ in objects)
+    for chunk_size in (1, 3, 64):
+        assert _load(lines, chunk_size=chunk_size) == objects
+
+
+def test_numbers_cut_off_by_the_window():
+    """Numbers that the window ends in the middle of should be read whole.
+
+    For example with a 7 byte window "[1, 12.5, 3]" ends the first window at
+    "12." and the decoder stops before the ".".
+
+    """
+    contents = '[1, 12.5, 3, -4e+10, 6E2, 0.125]'
+    for chunk_size in range(1, len(contents) + 1):
+        assert _load(contents, chunk_size=chunk_size) == [
+            1, 12.5, 3, -4e+10, 6E2, 0.125]
+
+
+def test_invalid_json():
+    nose.tools.assert_raises(ValueError, _load, '')
+    nose.tools.assert_raises(ValueError, _load, '[{"title": "one"} x')
+    nose.tools.assert_raises(ValueError, _load, '{"title": ')
+
+
+def test_syntax_errors_are_raised_straight_away():
+    """A syntax error shouldn't grow the window to the end of the file before
+    it's raised, and its position should be relative to the whole file.
+
+    """
+    head = '[{"a": 1}, {"a": 2}, '
+    contents = head + '{"a" 3}, ' + ', '.join(['{"a": 4}'] * 10000) + ']'
+    sizes = []
+    original_slide = readers._Window._slide
+
+    def slide(self, idx):
+        result = original_slide(self, idx)
+        sizes.append(len(self.buf))
+        return result
+
+    for name in backends.available():
+        path = _write_temp_file(contents)
+        try:
+            with mock.patch.object(readers._Window, "_slide", slide):
+                objects = readers.load(path, chunk_size=8,
+                                       backend=backends.get(name))
+                assert next(objects) == {"a": 1}
+                assert next(objects) == {"a": 2}
+                with nose.tools.assert_raises(ValueError) as context:
+                    next(objects)
+        finally:
+            os.remove(path)
+
+        assert max(sizes) <= 16
+        if name in ("json", "simplejson"):
+            assert "char {0}".format(len(head) + 5) in str(context.exception)
+    # A value cut off by the end of the window still isn't an error.
+    for chunk_size in range(1, 12):
+        assert _load('[true, false, null, "abc"]', chunk_size=chunk_size) == [
+            True, False, None, "abc"]
+
+
+def test_backend_without_raw_decode():
+    """Backends that can only decode whole strings should work too.
+
+    The reader has to find where each value ends itself, including skipping
+    over brackets and escaped quotes inside strings.
+
+    """
+    backend = backends.Backend("loads_only", json.loads)
+    objects = [
+        {"title": 'brackets ] } [ { in "strings"', "views": 10 ** i,
+         "tags": [[], {}, [{"a": None}], True, False, -1.5e3],
+         "notes": "\\" * i}
+        for i in range(10)
+    ]
+    contents = json.dumps(objects)
+
+    for chunk_size in (1, 7, 100, len(contents)):
+        assert _load(contents, chunk_size=chunk_size,
+                     backend=backend) == objects
+
+    lines = '\n'.join(json.dumps(object_) for object_ in objects)
+    assert _load(lines, chunk_size=3, backend=backend) == objects
+
+    assert _load('12345', chunk_size=2, backend=backend) == 12345
+    nose.tools.assert_raises(ValueError, _load, '[{"title": "one"',
+                             backend=backend)
+
+
+def test_installed_backends():
+    """Every installed backend should read the same data."""
+    objects = [{"title": u"dataset {0} ü".format(i), "views": i}
+               for i in range(10)]
+    contents = json.dumps(objects)
+    for name in backends.available():
+        backend = backends.get(name)
+        assert _load(contents, chunk_size=16, backend=backend) == objects
+
+
+def test_unknown_backend():
+    nose.tools.assert_raises(backends.UnavailableBackendError, backends.get,
+                             "foobar")
+
+
+def test_auto_backend():
+    """"auto" should prefer backends that can decode in place."""
+    assert backends.get("auto").raw_decode is not None
+
+
+def test_sample():
+    sample = readers.sample(iter(range(1000)), 10, random_=random.Random(0))
+
+    assert len(sample) == 10
+    assert sample == sorted(sample)
+    assert len(set(sample)) == 10
+    assert sample != range(10)
+
+
+def test_sample_fewer_objects_than_n():
+    assert readers.sample(iter(range(3)), 10) == [0, 1, 2]
+
+
+def test_keys():
+    """Unwanted keys should be dropped from each object."""
+    contents = '[{"title": "one", "notes": {"long": [1, 2]}}, {"title": "2"}]'
+    wanted = lambda key: key == "title"
+
+    assert _load(contents, keys=wanted) == [{"title": "one"}, {"title": "2"}]
+    lines = '{"title": "one", "notes": {"long": [1, 2]}}\n{"title": "2"}\n'
+    assert _load(lines, keys=wanted) == [{"title": "one"}, {"title": "2"}]
+
+
+def test_loads():
+    """loads() should decode arrays from strings lazily, like load()."""
+    contents = '[{"title": "one", "notes": "x"}, {"title": "two"}]'
+
+    result = readers.loads(contents)
+    assert not isinstance(result, list)
+    assert list(result) == [{"title": "one", "notes": "x"}, {"title": "two"}]
+
+    assert list(readers.loads(contents, keys=lambda key: key == "title")) == [
+        {"title": "one"}, {"title": "two"}]
+    assert readers.loads(' "foobar" ') == "foobar"
+    assert list(readers.loads('{"a": 1}\n{"a": 2}')) == [{"a": 1}, {"a": 2}]
+    nose.tools.assert_raises(ValueError, readers.loads, '')
+
+
+def test_loads_backend_without_raw_decode():
+    backend = backends.Backend("loads_only", json.loads)
+    contents = '[{"title": "one", "notes": "x"}, {"title": "two"}]'
+
+    assert list(readers.loads(contents, backend=backend,
+                              keys=lambda key: key == "title")) == [
+        {"title": "one"}, {"title": "two"}]
+
+
+def test_loads_json_lines_with_every_backend():
+    """Every backend should accept the same input formats from loads() as
+    from load(), including JSON Lines.
+
+    """
+    contents = '{"title": "one"}\n{"title": "two"}\n'
+    backends_ = [backends.get(name) for name in backends.available()]
+    backends_.append(backends.Backend("loads_only", json.loads))
+    for backend in backends_:
+        assert list(readers.loads(contents, backend=backend)) == [
+            {"title": "one"}, {"title": "two"}]
+        assert list(readers.loads(contents, backend=backend,
+                                  keys=lambda key: False)) == [{}, {}]
+        with nose.tools.assert_raises(ValueError):
+            list(readers.loads('{"title": "one"} x', backend=backend))
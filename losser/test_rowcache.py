@@ -0,0 +1,118 @@
+"""Tests for the persistent cell cache."""
+from __future__ import absolute_import
+
+import collections
+import os.path
+import shutil
+import tempfile
+
+import losser.losser as losser
+import losser.rowcache as rowcache
+
+
+def _dicts():
+    return [
+        dict(title="dataset {0}".format(i), author="author {0}".format(i % 2),
+             resources=[dict(format="CSV"), dict(format="XLS")])
+        for i in range(5)
+    ]
+
+
+class TestRowCache(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cells.cache")
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def _run(self, dicts, columns, **kwargs):
+        """Run an export with a new cache, return its rows and the cache."""
+        cache = rowcache.RowCache(self.path, **kwargs)
+        try:
+            return list(cache.iter_table(dicts, columns, batch_size=2)), cache
+        finally:
+            cache.close()
+
+    def test_cells_are_shared_between_columns_specs(self):
+        columns = collections.OrderedDict()
+        columns["Title"] = dict(pattern="^title$")
+        columns["Formats"] = dict(pattern=["^resources$", "^format$"])
+        rows, cache = self._run(_dicts(), columns)
+        assert rows == losser.table(_dicts(), columns)
+        assert (cache.hits, cache.misses) == (0, 10)
+
+        # Same Formats column with a different title, plus a new column.
+        other_columns = collections.OrderedDict()
+        other_columns["Author"] = dict(pattern="^author$")
+        other_columns["File Formats"] = dict(
+            pattern_path=["^resources$", "^format$"])
+        other_columns["__filters"] = [
+            dict(pattern="^title$", not_equals="dataset 0")]
+        rows, cache = self._run(_dicts(), other_columns)
+
+        assert rows == losser.table(_dicts(), other_columns)
+        assert (cache.hits, cache.misses) == (4, 4)
+
+    def test_changed_objects_are_evaluated(self):
+        columns = {"Title": dict(pattern="^title$")}
+        self._run(_dicts(), columns)
+
+        dicts = _dicts()
+        dicts[1]["title"] = "new title"
+        rows, cache = self._run(dicts, columns)
+
+        assert rows[1] == {"Title": "new title"}
+        assert (cache.hits, cache.misses) == (4, 1)
+
+    def test_eviction(self):
+        """The least recently used cells should be evicted on close."""
+        title = {"Title": dict(pattern="^title$")}
+        author = {"Author": dict(pattern="^author$")}
+        self._run(_dicts(), title, max_cells=6)
+        self._run(_dicts()[:3], author, max_cells=6)
+
+        rows, cache = self._run(_dicts(), title, max_cells=6)
+
+        # 2 of the 5 title cells were evicted to make room for the authors.
+        assert (cache.hits, cache.misses) == (3, 2)
+
+    def test_hits_are_marked_as_used(self):
+        """Cells that came from the cache should count as recently used."""
+        title = {"Title": dict(pattern="^title$")}
+        author = {"Author": dict(pattern="^author$")}
+        self._run(_dicts(), title, max_cells=5)
+        self._run(_dicts()[:2], title, max_cells=5)
+        self._run(_dicts()[:3], author, max_cells=5)
+
+        # The title cells of the first 2 objects were used again, so the
+        # others were evicted to make room for the authors.
+        rows, cache = self._run(_dicts()[:2], title, max_cells=5)
+        assert (cache.hits, cache.misses) == (2, 0)
+
+    def test_ordered_dicts(self):
+        dicts = [collections.OrderedDict(d) for d in _dicts()]
+        columns = {"Title": dict(pattern="^title$")}
+        self._run(dicts, columns)
+
+        rows, cache = self._run(dicts, columns)
+
+        assert rows == losser.table(dicts, columns)
+        assert cache.hits == 5
+
+    def test_typed_cells(self):
+        """Cells of typed columns should come out of the cache unchanged."""
+        dicts = [dict(modified="2016-01-02T03:04:05.678"),
+                 dict(modified=["2016-01-02", "not a date"]),
+                 dict(modified="1850-01-01")]
+        columns = {"Modified": dict(pattern="^modified$", type="datetime",
+                                    errors="keep")}
+        self._run(dicts, columns)
+
+        rows, cache = self._run(dicts, columns)
+
+        assert rows == losser.table(dicts, columns)
+        assert rows[0]["Modified"].microsecond == 678000
+        assert rows[2]["Modified"].year == 1850
+        assert cache.hits == 3
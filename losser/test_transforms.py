@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Tests for the declarative string transformations."""
+from __future__ import absolute_import
+
+import nose.tools
+
+import losser.losser as losser
+import losser.transforms as transforms
+
+
+def _transform(specs, s):
+    return transforms.compile_transforms(specs)(s)
+
+
+def test_transforms():
+    assert _transform(["strip", "upper"], u"  csv ") == u"CSV"
+    assert _transform("lower", "CSV") == "csv"
+    assert _transform("collapse_whitespace", u" a \n b\tc ") == u"a b c"
+    assert _transform({"name": "truncate", "length": 3}, "abcdef") == "abc"
+    assert _transform("hyperlink", "http://x") == '=HYPERLINK("http://x")'
+    assert _transform(
+        {"name": "replace", "pattern": "<[^>]+>"}, u"<p>Hi <b>there</b></p>"
+    ) == u"Hi there"
+    assert _transform(
+        {"name": "replace", "pattern": "csv", "replacement": "x",
+         "case_sensitive": False}, "CSV, csv") == "x, x"
+
+
+def test_date():
+    assert _transform("date", u"2016-01-02T03:04:05.123456") == u"2016-01-02"
+    assert _transform({"name": "date", "format": "%d/%m/%Y"},
+                      "2016-01-02 03:04:05") == "02/01/2016"
+    assert _transform({"name": "date", "input_formats": ["%d/%m/%Y"]},
+                      "02/01/2016") == "2016-01-02"
+    # Strings that aren't dates are left alone.
+    assert _transform("date", u"not a date ü") == u"not a date ü"
+
+
+def test_date_before_1900():
+    """Python 2's strftime() doesn't do years before 1900 but the "date"
+    transformation should.
+
+    """
+    assert _transform("date", u"1850-01-01") == u"1850-01-01"
+    assert _transform({"name": "date", "format": "%a %d/%m/%Y (%y) %%Y"},
+                      "1896-02-29 12:00:00") == "Sat 29/02/1896 (96) %Y"
+    assert _transform({"name": "date", "format": "%Y"}, "0001-01-01") == (
+        "0001")
+
+
+def test_pipeline_map():
+    pipeline = transforms.compile_transforms(
+        ["strip", {"name": "truncate", "length": 2}])
+    strings = [u" abc", "de ", ""]
+
+    assert pipeline.map(strings) == [pipeline(s) for s in strings]
+    assert pipeline.map(strings) == [u"ab", "de", ""]
+    assert not transforms.compile_transforms([])
+
+
+def test_invalid_transforms():
+    for specs in (["nonexistent"], [{"length": 3}], [3],
+                  [{"name": "truncate"}],
+                  [{"name": "truncate", "length": 3, "foo": "bar"}],
+                  [{"name": "replace", "pattern": "("}]):
+        nose.tools.assert_raises(transforms.InvalidTransformError,
+                                 transforms.compile_transforms, specs)
+
+
+def test_register():
+    transforms.register("prefix")(lambda text: lambda s: text + s)
+    try:
+        assert _transform({"name": "prefix", "text": "a-"}, "b") == "a-b"
+    finally:
+        del transforms.TRANSFORMS["prefix"]
+
+
+def test_column_transforms():
+    """A column's transforms should come between its string_transformations
+    and its max_length, in both table() and query().
+
+    """
+    dicts = [{"notes": u"  <p>Some  notes</p> "}, {"notes": ["<i>A</i>", 1]}]
+    spec = dict(pattern_path="^notes$", strip=True, max_length=8,
+                string_transformations=[lambda s: s + u"!"],
+                transforms=[{"name": "replace", "pattern": "<[^>]+>"},
+                            "collapse_whitespace", "upper"])
+
+    rows = losser.table(dicts, {"Notes": spec})
+
+    assert [row["Notes"] for row in rows] == [u"SOME NOT", [u"A!", 1]]
+    assert [losser.query(dict_=d, **spec) for d in dicts] == [
+        row["Notes"] for row in rows]
+
+
+def test_memo():
+    calls = []
+
+    def function(s):
+        calls.append(s)
+        return s.upper()
+
+    memo = transforms._Memo(function, 2)
+    assert [memo(s) for s in ("a", "b", "a", "c", "a", "b")] == [
+        "A", "B", "A", "C", "A", "B"]
+    # "b" was the least recently used when "c" came in, so it was forgotten.
+    assert calls == ["a", "b", "c", "b"]
+    # Byte strings and unicode strings are remembered separately.
+    assert type(memo(u"a")) is unicode
+
+
+def test_column_replace():
+    """The replace option should apply its substitutions in order, before the
+    column's transforms.
+
+    """
+    dicts = [{"notes": u"<p>Some&nbsp;notes</p>"}, {"notes": "plain"}] * 3
+    columns = {"Notes": dict(
+        pattern="^notes$",
+        replace=[{"pattern": "<[^>]+>"},
+                 {"pattern": "&nbsp;", "replacement": " "}],
+        transforms=["upper"])}
+
+    rows = losser.table(dicts, columns)
+
+    assert [row["Notes"] for row in rows] == [u"SOME NOTES", "PLAIN"] * 3
+
+    columns = {"Notes": dict(pattern="^notes$",
+                             replace={"pattern": "notes", "replacement": "x",
+                                      "case_sensitive": False,
+                                      "cache_size": 0})}
+    assert losser.table(dicts[:1], columns)[0]["Notes"] == (
+        u"<p>Some&nbsp;x</p>")
+
+
+def test_invalid_replace():
+    for replace in ("<[^>]+>", [{"replacement": "x"}], {"pattern": "("}):
+        nose.tools.assert_raises(
+            transforms.InvalidTransformError, losser.table, [],
+            {"Notes": dict(pattern="^notes$", replace=replace)})
@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+"""Tests for the streaming output writers."""
+from __future__ import absolute_import
+
+import collections
+import cStringIO
+import json
+import os
+import os.path
+import shutil
+import tempfile
+
+import nose.tools
+
+import losser.losser as losser
+import losser.writers as writers
+
+
+def _rows(number_of_rows):
+    rows = []
+    for i in range(number_of_rows):
+        row = collections.OrderedDict()
+        row["Title"] = u"dataset {0} ü".format(i)
+        row["Formats"] = ["CSV", "JSON"]
+        rows.append(row)
+    return rows
+
+
+def test_csv_writer():
+    f = cStringIO.StringIO()
+    rows = _rows(2)
+
+    writers.CSVWriter(f).writerows(rows)
+
+    assert f.getvalue() == (
+        "Title,Formats\r\n"
+        'dataset 0 \xc3\xbc,"CSV, JSON"\r\n'
+        'dataset 1 \xc3\xbc,"CSV, JSON"\r\n'
+    )
+    # The rows shouldn't have been modified.
+    assert rows == _rows(2)
+
+
+def test_csv_writer_with_missing_and_extra_keys():
+    """Later rows can leave out columns but can't add new ones."""
+    f = cStringIO.StringIO()
+    writer = writers.CSVWriter(f)
+    writer.writerow(collections.OrderedDict([("a", 1), ("b", 2)]))
+    writer.writerow({"b": 3})
+
+    assert f.getvalue() == "a,b\r\n1,2\r\n,3\r\n"
+    nose.tools.assert_raises(ValueError, writer.writerow, {"c": 4})
+
+
+def _tricky_rows():
+    rows = []
+    for value in (u"ü", "plain", 'with "quotes"', "a, b", "two\nlines",
+                  "\r", 1, 2L, 1 / 3.0, 1e20, True, None, "", ["x", u"ü"],
+                  ("1", 2), []):
+        row = collections.OrderedDict()
+        row["Value"] = value
+        row["Again"] = value
+        rows.append(row)
+    rows.append({"Value": "missing"})
+    return rows
+
+
+def test_fast_csv_writer():
+    """FastCSVWriter should write exactly the same CSV as CSVWriter."""
+    expected = cStringIO.StringIO()
+    writers.CSVWriter(expected).writerows(_tricky_rows())
+
+    for buffer_size in (0, 10, 64 * 1024):
+        f = cStringIO.StringIO()
+        writer = writers.FastCSVWriter(f, buffer_size=buffer_size,
+                                       cache_size=3)
+        writer.writerows(_tricky_rows())
+        writer.close()
+        assert f.getvalue() == expected.getvalue()
+
+
+def test_fast_csv_writer_joiners():
+    """FastCSVWriter should join lists like CSVWriter does with joiners."""
+    joiners = {"Value": losser._joiner(separator=u"; "),
+               "Again": losser._joiner(join="json")}
+    expected = cStringIO.StringIO()
+    writers.CSVWriter(expected, joiners=joiners).writerows(_tricky_rows())
+
+    f = cStringIO.StringIO()
+    writer = writers.FastCSVWriter(f, joiners=joiners)
+    writer.writerows(_tricky_rows())
+    writer.close()
+
+    assert f.getvalue() == expected.getvalue()
+    assert 'x; \xc3\xbc,"[""x"", ""\xc3\xbc""]"\r\n' in f.getvalue()
+
+
+def test_fast_csv_writer_tuples():
+    f = cStringIO.StringIO()
+    writer = writers.FastCSVWriter(f, fieldnames=["Title", "Formats"])
+    writer.writetuples([(u"dataset ü", ["CSV", "JSON"]), ("x", None)])
+    writer.close()
+
+    assert f.getvalue() == (
+        'Title,Formats\r\ndataset \xc3\xbc,"CSV, JSON"\r\nx,\r\n')
+
+
+def test_fast_csv_writer_single_empty_field():
+    """A row of one empty field should be written as "" (like csv does)."""
+    f = cStringIO.StringIO()
+    writer = writers.FastCSVWriter(f)
+    writer.writerows([{"a": None}, {"a": ""}, {"a": "x"}])
+    writer.close()
+
+    assert f.getvalue() == 'a\r\n""\r\n""\r\nx\r\n'
+
+
+def test_fast_csv_writer_with_extra_keys():
+    writer = writers.FastCSVWriter(cStringIO.StringIO())
+    writer.writerow(collections.OrderedDict([("a", 1), ("b", 2)]))
+    nose.tools.assert_raises(ValueError, writer.writerow, {"c": 4})
+
+
+def test_shard_path():
+    assert writers.shard_path("/tmp/export.csv", 3) == (
+        "/tmp/export-00003.csv")
+    assert writers.shard_path("export", 12) == "export-00012"
+
+
+class TestShardedCSVWriter(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "export.csv")
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, rows, **kwargs):
+        writer = writers.ShardedCSVWriter(self.path, **kwargs)
+        writer.writerows(rows)
+        writer.close()
+        assert writer.paths == sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory))
+        return [open(path, 'rb').read() for path in writer.paths]
+
+    def test_shard_rows(self):
+        shards = self._write(_rows(5), shard_rows=2)
+
+        assert shards == [
+            'Title,Formats\r\n'
+            'dataset 0 \xc3\xbc,"CSV, JSON"\r\n'
+            'dataset 1 \xc3\xbc,"CSV, JSON"\r\n',
+            'Title,Formats\r\n'
+            'dataset 2 \xc3\xbc,"CSV, JSON"\r\n'
+            'dataset 3 \xc3\xbc,"CSV, JSON"\r\n',
+            'Title,Formats\r\n'
+            'dataset 4 \xc3\xbc,"CSV, JSON"\r\n',
+        ]
+
+    def test_shard_bytes(self):
+        header_size = len('Title,Formats\r\n')
+        row_size = len('dataset 0 \xc3\xbc,"CSV, JSON"\r\n')
+
+        shards = self._write(_rows(7),
+                             shard_bytes=header_size + row_size * 3)
+
+        assert [len(shard) for shard in shards] == [
+            header_size + row_size * 3,
+            header_size + row_size * 3,
+            header_size + row_size,
+        ]
+        assert all(shard.startswith('Title,Formats\r\n') for shard in shards)
+
+    def test_row_bigger_than_shard_bytes(self):
+        """A row that's too big for any shard should get a shard to itself."""
+        shards = self._write(_rows(2), shard_bytes=10)
+
+        assert len(shards) == 2
+
+    def test_shard_rows_and_bytes(self):
+        """Whichever limit is reached first should start a new shard."""
+        shards = self._write(_rows(5), shard_rows=2, shard_bytes=10 ** 6)
+
+        assert len(shards) == 3
+
+
+class TestPartitionedCSVWriter(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "export.csv")
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def _rows(self, organizations):
+        rows = []
+        for i, organization in enumerate(organizations):
+            row = collections.OrderedDict()
+            row["Title"] = "dataset {0}".format(i)
+            row["Organization"] = organization
+            rows.append(row)
+        return rows
+
+    def test_partition_by(self):
+        writer = writers.PartitionedCSVWriter(self.path, "Organization")
+        writer.writerows(self._rows(
+            ["health", "transport", "health", None, ["a", "b"]]))
+        writer.close()
+
+        assert writer.paths == {
+            "health": os.path.join(self.directory, "export-health.csv"),
+            "transport": os.path.join(self.directory, "export-transport.csv"),
+            None: os.path.join(self.directory, "export-_.csv"),
+            "a, b": os.path.join(self.directory, "export-a_b.csv"),
+        }
+        assert open(writer.paths["health"]).read() == (
+            "Title,Organization\r\n"
+            "dataset 0,health\r\n"
+            "dataset 2,health\r\n"
+        )
+        assert open(writer.paths["a, b"]).read() == (
+            "Title,Organization\r\n"
+            'dataset 4,"a, b"\r\n'
+        )
+
+    def test_max_open_files(self):
+        """Closed files should be reopened and appended to without a header.
+
+        """
+        organizations = ["one", "two", "three", "one", "two", "three", "one"]
+        writer = writers.PartitionedCSVWriter(self.path, "Organization",
+                                              max_open_files=2)
+        for row in self._rows(organizations):
+            writer.writerow(row)
+            assert len(writer._open) <= 2
+        writer.close()
+
+        assert open(writer.paths["one"]).read() == (
+            "Title,Organization\r\n"
+            "dataset 0,one\r\n"
+            "dataset 3,one\r\n"
+            "dataset 6,one\r\n"
+        )
+
+    def test_clashing_file_names(self):
+        """Values that make the same file name should get different files."""
+        writer = writers.PartitionedCSVWriter(self.path, "Organization")
+        writer.writerows(self._rows(["a/b", "a b", "a/b"]))
+        writer.close()
+
+        assert writer.paths == {
+            "a/b": os.path.join(self.directory, "export-a_b.csv"),
+            "a b": os.path.join(self.directory, "export-a_b-2.csv"),
+        }
+
+    def test_unknown_column(self):
+        writer = writers.PartitionedCSVWriter(self.path, "Foo")
+        nose.tools.assert_raises(
+            writers.PartitionColumnError, writer.writerow,
+            self._rows(["health"])[0])
+
+
+class TestParquetWriter(object):
+
+    def setup(self):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise nose.SkipTest("pyarrow isn't installed")
+        self.parquet = pyarrow.parquet
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "export.parquet")
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def _rows(self):
+        rows = []
+        for i in range(10):
+            row = collections.OrderedDict()
+            row["Title"] = u"dataset {0} ü".format(i)
+            row["Views"] = i * 10
+            row["Private"] = i % 2 == 0
+            row["Formats"] = ["CSV", "JSON"] if i % 3 else "CSV"
+            row["Score"] = None if i == 5 else i / 2.0
+            rows.append(row)
+        return rows
+
+    def test_types_are_preserved(self):
+        for row_group_size in (3, 100):
+            writer = writers.ParquetWriter(self.path,
+                                           row_group_size=row_group_size)
+            writer.writerows(self._rows())
+            writer.close()
+
+            table = self.parquet.read_table(self.path)
+            assert table.column_names == [
+                "Title", "Views", "Private", "Formats", "Score"]
+            assert str(table.schema.field_by_name("Views").type) == "int64"
+            assert str(table.schema.field_by_name("Private").type) == "bool"
+            assert str(table.schema.field_by_name("Formats").type) == (
+                "list<item: string>")
+            assert table.to_pydict()["Formats"][:3] == [
+                ["CSV"], ["CSV", "JSON"], ["CSV", "JSON"]]
+            assert table.to_pydict()["Score"][4:7] == [2.0, None, 3.0]
+            assert table.to_pydict()["Title"][0] == u"dataset 0 ü"
+
+    def test_row_groups(self):
+        writer = writers.ParquetWriter(self.path, row_group_size=4)
+        writer.writerows(self._rows())
+        writer.close()
+
+        assert self.parquet.ParquetFile(self.path).num_row_groups == 3
+
+    def test_no_rows(self):
+        """A file should be written even if there are no rows."""
+        writers.ParquetWriter(self.path, fieldnames=["Title", "Views"]).close()
+
+        table = self.parquet.read_table(self.path)
+        assert table.num_rows == 0
+        assert table.column_names == ["Title", "Views"]
+
+        writers.ParquetWriter(self.path).close()
+        assert self.parquet.read_table(self.path).num_rows == 0
+
+    def test_fieldnames(self):
+        writer = writers.ParquetWriter(self.path, fieldnames=["B", "A"])
+        writer.writerows([{"A": 1}, {"B": "x"}])
+        writer.close()
+
+        assert self.parquet.read_table(self.path).to_pydict() == {
+            "B": [None, "x"], "A": [1, None]}
+
+    def test_mixed_types(self):
+        writer = writers.ParquetWriter(self.path)
+        writer.writerows([{"Value": 1}, {"Value": "one"}, {"Value": None}])
+        nose.tools.assert_raises(writers.ParquetSchemaError, writer.close)
+
+    def _write(self, values):
+        writer = writers.ParquetWriter(self.path, row_group_size=2)
+        writer.writerows([{"Value": value} for value in values])
+        writer.close()
+        return self.parquet.read_table(self.path).to_pydict()["Value"]
+
+    def test_schema_drift(self):
+        """Values in later row groups that don't fit the schema inferred from
+        the first one should raise, not be converted to fit.
+
+        """
+        # A list that first appears in the second row group.
+        nose.tools.assert_raises(writers.ParquetSchemaError, self._write,
+                                 ["CSV", "JSON", ["CSV", "JSON"], None])
+        # A float in a column that started out as ints.
+        nose.tools.assert_raises(writers.ParquetSchemaError, self._write,
+                                 [1, 2, 2.5, None])
+        nose.tools.assert_raises(writers.ParquetSchemaError, self._write,
+                                 [1, 2, "3", None])
+        nose.tools.assert_raises(writers.ParquetSchemaError, self._write,
+                                 [1.5, 2.5, True, None])
+
+        # These fit without losing anything.
+        assert self._write([["CSV", "JSON"], None, "CSV", ["JSON"]]) == [
+            ["CSV", "JSON"], None, ["CSV"], ["JSON"]]
+        assert self._write([1.5, 2.5, 3, None]) == [1.5, 2.5, 3.0, None]
+        assert self._write([True, False, None, True]) == [
+            True, False, None, True]
+
+
+def _nested_rows():
+    rows = []
+    for i in range(2):
+        row = collections.OrderedDict()
+        row["Title"] = u"dataset {0} ü".format(i)
+        row["Formats"] = ["CSV", "JSON"]
+        row["Views"] = i
+        row["Extras"] = collections.OrderedDict((("b", [1]), ("a", None)))
+        rows.append(row)
+    return rows
+
+
+def test_json_lines_writer():
+    f = cStringIO.StringIO()
+    writers.JSONLinesWriter(f).writerows(_nested_rows())
+
+    assert f.getvalue() == (
+        '{"Title": "dataset 0 \xc3\xbc", "Formats": ["CSV", "JSON"], '
+        '"Views": 0, "Extras": {"b": [1], "a": null}}\n'
+        '{"Title": "dataset 1 \xc3\xbc", "Formats": ["CSV", "JSON"], '
+        '"Views": 1, "Extras": {"b": [1], "a": null}}\n'
+    )
+
+
+def test_json_writer():
+    f = cStringIO.StringIO()
+    writer = writers.JSONWriter(f)
+    writer.writerows(_nested_rows())
+    writer.close()
+
+    assert json.loads(f.getvalue()) == _nested_rows()
+    assert f.getvalue().startswith('[\n{"Title": "dataset 0 \xc3\xbc", ')
+
+
+def test_json_writer_with_no_rows():
+    f = cStringIO.StringIO()
+    writers.JSONWriter(f).close()
+
+    assert json.loads(f.getvalue()) == []
+
+
+def test_pretty_writer():
+    f = cStringIO.StringIO()
+    writer = writers.PrettyWriter(f)
+    rows = _nested_rows()
+    for row in rows:
+        del row["Extras"]
+    writer.writerows(rows)
+    writer.close()
+
+    assert f.getvalue() == (
+        "+-------------+-----------+-------+\n"
+        "| Title       | Formats   | Views |\n"
+        "+=============+===========+=======+\n"
+        "| dataset 0 \xc3\xbc | CSV, JSON | 0     |\n"
+        "+-------------+-----------+-------+\n"
+        "| dataset 1 \xc3\xbc | CSV, JSON | 1     |\n"
+        "+-------------+-----------+-------+\n"
+    )
+
+
+def test_pretty_writer_no_rows():
+    f = cStringIO.StringIO()
+    writers.PrettyWriter(f).close()
+
+    assert f.getvalue() == ""
+
+
+def test_pretty_writer_widths_come_from_the_sample():
+    """Rows after the sample should be truncated to the sample's widths."""
+    f = cStringIO.StringIO()
+    writer = writers.PrettyWriter(f, sample_size=2)
+    writer.writerow({"Title": "one"})
+    writer.writerow({"Title": "two"})
+    assert f.getvalue() == (
+        "+-------+\n"
+        "| Title |\n"
+        "+=======+\n"
+        "| one   |\n"
+        "+-------+\n"
+        "| two   |\n"
+        "+-------+\n"
+    )
+
+    writer.writerow({"Title": "a much\nlonger title"})
+    writer.writerow({})
+    writer.close()
+    assert f.getvalue().endswith(
+        "| a ... |\n"
+        "+-------+\n"
+        "|       |\n"
+        "+-------+\n"
+    )
+
+
+def test_pretty_writer_header_comes_from_all_the_sample_rows():
+    """The header should have the keys of all the sample rows, and rows after
+    the sample that add keys should raise instead of losing them.
+
+    """
+    f = cStringIO.StringIO()
+    writer = writers.PrettyWriter(f, sample_size=2)
+    writer.writerow({"extras_x": 1})
+    writer.writerow({"extras_y": 2})
+    assert f.getvalue() == (
+        "+----------+----------+\n"
+        "| extras_x | extras_y |\n"
+        "+==========+==========+\n"
+        "| 1        |          |\n"
+        "+----------+----------+\n"
+        "|          | 2        |\n"
+        "+----------+----------+\n"
+    )
+
+    nose.tools.assert_raises(ValueError, writer.writerow, {"extras_z": 3})
+
+    f = cStringIO.StringIO()
+    writer = writers.PrettyWriter(f, sample_size=1,
+                                  fieldnames=["extras_x", "extras_z"])
+    writer.writerows([{"extras_x": 1}, {"extras_z": 3}])
+    writer.close()
+    assert f.getvalue().splitlines()[1] == "| extras_x | extras_z |"
+
+
+def test_pretty_writer_max_width():
+    f = cStringIO.StringIO()
+    writer = writers.PrettyWriter(f, max_width=6)
+    writer.writerows([{"Title": "a long title", "Formats": ["CSV", "XLS"]}])
+    writer.close()
+
+    assert "| a l... |" in f.getvalue()
+
+
+def test_pretty_writer_joiners():
+    f = cStringIO.StringIO()
+    writer = writers.PrettyWriter(
+        f, joiners={"Formats": losser._joiner(separator=u"/")})
+    writer.writerows([{"Formats": ["CSV", "XLS"]}])
+    writer.close()
+
+    assert "| CSV/XLS |" in f.getvalue()
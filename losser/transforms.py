@@ -0,0 +1,285 @@
+"""Declarative string transformations for columns.
+
+A column's ``"transforms"`` option (in a columns.json file or a columns dict)
+is a list of transformations to apply, in order, to each string value that
+the column's pattern path finds. Each transformation is either the name of
+one that takes no options or a dict with a ``"name"`` and its options, for
+example::
+
+    "Notes": {
+        "pattern": "^notes$",
+        "transforms": [
+            "strip",
+            {"name": "replace", "pattern": "<[^>]+>", "replacement": ""},
+            {"name": "truncate", "length": 100}
+        ]
+    }
+
+The available transformations are in TRANSFORMS, and more can be added with
+register(). A column's transformations (together with its ``strip``,
+``string_transformations``, ``replace``, ``max_length`` and ``hyperlink``
+options) are
+compiled into a single Pipeline, which can transform a whole batch of values
+at a time with Pipeline.map().
+
+"""
+from __future__ import absolute_import
+
+import collections
+import datetime
+import re
+
+
+class InvalidTransformError(Exception):
+
+    """Raised when a column's "transforms" option is invalid."""
+
+    pass
+
+
+#: A dict mapping the name of each transformation to its factory: a function
+#: that takes the transformation's options as keyword arguments and returns
+#: the function that transforms one string.
+TRANSFORMS = {}
+
+
+def register(name):
+    """Return a decorator that registers a transformation factory.
+
+    For example::
+
+        @losser.transforms.register("prefix")
+        def prefix(text):
+            return lambda s: text + s
+
+    makes ``{"name": "prefix", "text": "..."}`` available as a transformation.
+
+    """
+    def decorator(factory):
+        TRANSFORMS[name] = factory
+        return factory
+    return decorator
+
+
+@register("strip")
+def strip():
+    return lambda s: s.strip()
+
+
+@register("lower")
+def lower():
+    return lambda s: s.lower()
+
+
+@register("upper")
+def upper():
+    return lambda s: s.upper()
+
+
+@register("collapse_whitespace")
+def collapse_whitespace():
+    """Replace each run of whitespace with a single space."""
+    return lambda s: u" ".join(s.split())
+
+
+@register("truncate")
+def truncate(length):
+    return lambda s: s[:length]
+
+
+@register("hyperlink")
+def hyperlink():
+    """Turn the string into a spreadsheet hyperlink formula."""
+    return lambda s: '=HYPERLINK("{0}")'.format(s)
+
+
+class _Memo(object):
+
+    """Remembers a function's results for the most recently used strings.
+
+    At most ``size`` results are kept, and when it's full the least recently
+    used one is forgotten.
+
+    """
+
+    def __init__(self, function, size):
+        self._function = function
+        self._size = size
+        self._results = collections.OrderedDict()
+
+    def __call__(self, s):
+        # Byte strings and unicode strings are kept apart because in Python 2
+        # "a" == u"a", and the result's type should match the argument's.
+        key = (s.__class__, s)
+        results = self._results
+        try:
+            result = results.pop(key)
+        except KeyError:
+            result = self._function(s)
+            if len(results) >= self._size:
+                results.popitem(last=False)
+        results[key] = result
+        return result
+
+
+@register("replace")
+def replace(pattern, replacement=u"", case_sensitive=True, cache_size=1000):
+    """Replace each match of a regular expression.
+
+    The results for the last ``cache_size`` distinct strings are remembered,
+    so strings that keep coming up aren't substituted again (0 turns this
+    off).
+
+    """
+    flags = re.UNICODE
+    if not case_sensitive:
+        flags |= re.IGNORECASE
+    sub = re.compile(pattern, flags).sub
+    function = lambda s: sub(replacement, s)
+    if cache_size:
+        return _Memo(function, cache_size)
+    return function
+
+
+#: The formats that the "date" transformation tries to read dates in, if it
+#: isn't given its own.
+DATE_FORMATS = (
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d",
+)
+
+
+def parse_date(s, input_formats=DATE_FORMATS):
+    """Return the given string as a datetime, or None if it isn't a date.
+
+    :param input_formats: the strptime() formats to try, in order
+    :type input_formats: list of strings
+
+    """
+    for input_format in input_formats:
+        try:
+            return datetime.datetime.strptime(s, input_format)
+        except (ValueError, UnicodeError):
+            continue
+    return None
+
+
+def _strftime(value, format):
+    """Return value.strftime(format), even for years before 1900.
+
+    Python 2's strftime() refuses years before 1900, so those dates are
+    moved forward by a multiple of 400 years (which keeps the days of the
+    week and the leap years the same) and then the year is put back.
+
+    """
+    if value.year >= 1900:
+        return value.strftime(format)
+    year = u"{0:04d}".format(value.year)
+    format = re.sub(r"%.", lambda match: year if match.group() == "%Y"
+                    else match.group(), format)
+    shifted = value.replace(year=value.year + (2299 - value.year) // 400 * 400)
+    return shifted.strftime(format)
+
+
+@register("date")
+def date(format="%Y-%m-%d", input_formats=DATE_FORMATS):
+    """Rewrite dates in the given format.
+
+    Strings that aren't dates in any of the input formats are left as they
+    are.
+
+    """
+    def normalise(s):
+        value = parse_date(s, input_formats)
+        if value is None:
+            return s
+        result = _strftime(value, format)
+        if isinstance(s, unicode):
+            result = result.decode("utf-8")
+        return result
+    return normalise
+
+
+def _function(spec):
+    """Return the string function for one item of a "transforms" list."""
+    if isinstance(spec, basestring):
+        name, options = spec, {}
+    elif isinstance(spec, dict) and "name" in spec:
+        options = dict(spec)
+        name = options.pop("name")
+    else:
+        raise InvalidTransformError(
+            "A transform must be a name or a dict with a \"name\", not "
+            "{0!r}".format(spec))
+    try:
+        factory = TRANSFORMS[name]
+    except KeyError:
+        raise InvalidTransformError(
+            "Unknown transform {0!r}, the available transforms are: "
+            "{1}".format(name, ", ".join(sorted(TRANSFORMS))))
+    try:
+        return factory(**options)
+    except (TypeError, ValueError, re.error) as err:
+        raise InvalidTransformError(
+            "Invalid options for the {0!r} transform: {1}".format(name, err))
+
+
+class Pipeline(object):
+
+    """A sequence of string functions fused into one.
+
+    :param functions: the functions to apply, in order, each taking and
+        returning one string. Any Pipelines among them have their functions
+        spliced in.
+    :type functions: list of callables
+
+    """
+
+    def __init__(self, functions=()):
+        self._functions = []
+        for function in functions:
+            if isinstance(function, Pipeline):
+                self._functions.extend(function._functions)
+            else:
+                self._functions.append(function)
+
+    def __nonzero__(self):
+        return bool(self._functions)
+
+    def __call__(self, s):
+        for function in self._functions:
+            s = function(s)
+        return s
+
+    def map(self, strings):
+        """Return the list of the given strings, transformed.
+
+        Gives the same results as calling the pipeline on each string, but
+        applies each function to the whole list before moving on to the next
+        one, which saves a Python function call per function per string.
+
+        """
+        for function in self._functions:
+            strings = map(function, strings)
+        return list(strings)
+
+
+def compile_transforms(specs):
+    """Return a Pipeline for a column's "transforms" list.
+
+    :param specs: the list of transformation names and dicts (see the module
+        docstring)
+    :type specs: list
+
+    :rtype: Pipeline
+
+    :raises InvalidTransformError: if any of the transformations are unknown
+        or have invalid options
+
+    """
+    if isinstance(specs, (basestring, dict)):
+        specs = [specs]
+    return Pipeline([_function(spec) for spec in specs or []])
@@ -0,0 +1,869 @@
+"""Writers that stream losser's output rows to files one row at a time.
+
+Unlike table(), which builds the whole table in memory before returning it,
+these write each row as soon as it arrives so they can be fed directly from
+losser.iter_table().
+
+Since the rows are written before the later rows have been seen, the CSV
+header is taken from the first row's keys. Later rows may be missing some of
+these keys (the cells are left empty) but they can't add new ones.
+
+"""
+from __future__ import absolute_import
+
+import collections
+import cStringIO
+import datetime
+import itertools
+import json
+import os.path
+import re
+
+import unicodecsv
+
+import losser.losser as losser
+
+
+def _csv_row(row, joiners=None):
+    """Return a copy of the row with lists joined into strings.
+
+    Each column's lists are joined by its function in ``joiners``, or by
+    losser.join_list() (into comma-separated strings).
+
+    """
+    joiners = joiners or {}
+    csv_row = {}
+    for key, value in row.items():
+        if type(value) in (list, tuple):
+            value = joiners.get(key, losser.join_list)(value)
+        csv_row[key] = value
+    return csv_row
+
+
+class CSVWriter(object):
+
+    """Write rows to a file as UTF8-encoded CSV, one row at a time.
+
+    :param f: the file to write to, could be an opened file, sys.stdout, or a
+        StringIO
+
+    :param fieldnames: the column titles to write in the header (default: the
+        keys of the first row)
+    :type fieldnames: list of strings
+
+    :param write_header: whether to write the header row (pass False when
+        appending to a file that already has one)
+    :type write_header: bool
+
+    :param joiners: a dict mapping column titles to the functions that join
+        their list values into cells (default: losser.join_list() for every
+        column), for example losser.compile_columns(columns).joiners
+    :type joiners: dict
+
+    """
+
+    def __init__(self, f, fieldnames=None, write_header=True, joiners=None):
+        self._f = f
+        self._writer = None
+        self._write_header = write_header
+        self._joiners = joiners
+        if fieldnames is not None:
+            self._start(fieldnames)
+
+    def _start(self, fieldnames):
+        self.fieldnames = list(fieldnames)
+        self._writer = unicodecsv.DictWriter(
+            self._f, self.fieldnames, encoding='utf-8')
+        if self._write_header:
+            self._writer.writeheader()
+
+    def writerow(self, row):
+        if self._writer is None:
+            self._start(row.keys())
+        self._writer.writerow(_csv_row(row, self._joiners))
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        pass
+
+
+# Matches the characters that make a CSV field need quoting.
+_NEEDS_QUOTING = re.compile(r'[,"\r\n]')
+
+
+def _encode_cell(value, join=losser.join_list):
+    """Return a cell value as a UTF8-encoded, quoted-if-necessary CSV field.
+
+    Gives the same output as CSVWriter. List values are joined by ``join``.
+
+    """
+    if value is None:
+        return ''
+    if type(value) in (list, tuple):
+        value = join(value)
+    if isinstance(value, unicode):
+        field = value.encode('utf-8')
+    elif isinstance(value, str):
+        field = value
+    elif isinstance(value, float):
+        field = repr(value)
+    else:
+        field = str(value)
+    if _NEEDS_QUOTING.search(field):
+        field = '"' + field.replace('"', '""') + '"'
+    return field
+
+
+class FastCSVWriter(object):
+
+    """A faster drop-in replacement for CSVWriter.
+
+    Writes the same CSV as CSVWriter, but:
+
+    * Rows can also be given as tuples of cell values in the same order as the
+      fieldnames (writetuple()), which avoids building a dict for each row,
+      e.g. the rows of a Table from table(..., layout="tuples").
+    * The encoded and quoted CSV field for each distinct string is remembered,
+      so strings that are repeated from row to row are only encoded once.
+    * Rows are written to the file in chunks of about ``buffer_size`` bytes,
+      so close() must be called after the last row.
+
+    :param buffer_size: the size (in bytes) of the chunks to write to the
+        file, or 0 to write each row as soon as it arrives
+    :type buffer_size: int
+
+    :param cache_size: the maximum number of distinct strings' fields to
+        remember (they're all forgotten when it's full)
+    :type cache_size: int
+
+    See CSVWriter for the other params.
+
+    """
+
+    def __init__(self, f, fieldnames=None, write_header=True,
+                 buffer_size=64 * 1024, cache_size=10000, joiners=None):
+        self._f = f
+        self._write_header = write_header
+        self._joiners = joiners or {}
+        self._buffer_size = buffer_size
+        self._cache_size = cache_size
+        self._buffer = []
+        self._buffered = 0
+        self._fields = {}
+        self._joins = []
+        self.fieldnames = None
+        if fieldnames is not None:
+            self._start(fieldnames)
+
+    def _start(self, fieldnames):
+        self.fieldnames = list(fieldnames)
+        self._fieldnames_set = set(self.fieldnames)
+        # The joiner for each column, in fieldnames order.
+        self._joins = [self._joiners.get(name, losser.join_list)
+                       for name in self.fieldnames]
+        if self._write_header:
+            self._write_line([self._field(name) for name in self.fieldnames])
+
+    def _field(self, value, join=losser.join_list):
+        if not isinstance(value, basestring):
+            return _encode_cell(value, join)
+        try:
+            return self._fields[value]
+        except KeyError:
+            if len(self._fields) >= self._cache_size:
+                self._fields.clear()
+            field = self._fields[value] = _encode_cell(value)
+            return field
+
+    def writetuple(self, values):
+        """Write a row given as a sequence of values in fieldnames order."""
+        field = self._field
+        # Any values beyond the fieldnames are joined by the default joiner.
+        joins = itertools.chain(self._joins,
+                                itertools.repeat(losser.join_list))
+        self._write_line([field(value, join)
+                          for value, join in itertools.izip(values, joins)])
+
+    def _write_line(self, fields):
+        """Write a row given as a list of encoded fields."""
+        line = ','.join(fields)
+        if not line and len(fields) == 1:
+            # Like the csv module, write a row of one empty field as "" so it
+            # isn't mistaken for a blank line.
+            line = '""'
+        self._buffer.append(line + '\r\n')
+        self._buffered += len(line) + 2
+        if self._buffered >= self._buffer_size:
+            self.flush()
+
+    def writetuples(self, rows):
+        for values in rows:
+            self.writetuple(values)
+
+    def writerow(self, row):
+        if self.fieldnames is None:
+            self._start(row.keys())
+        if not self._fieldnames_set.issuperset(row):
+            raise ValueError(
+                "The row has keys that aren't in the CSV header: {0}".format(
+                    [key for key in row if key not in self._fieldnames_set]))
+        self.writetuple([row.get(key) for key in self.fieldnames])
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        """Write any buffered rows to the file."""
+        if self._buffer:
+            self._f.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        self.flush()
+
+
+class JSONLinesWriter(object):
+
+    """Write rows to a file as JSON Lines: one JSON object per row per line.
+
+    Lists and other nested values are written as is, not joined into
+    strings as they are in CSV, and the order of each row's keys is kept.
+
+    :param f: the file to write to, could be an opened file, sys.stdout, or a
+        StringIO
+
+    """
+
+    def __init__(self, f):
+        self._f = f
+
+    def writerow(self, row):
+        self._f.write(_json_dumps(row) + '\n')
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        pass
+
+
+class JSONWriter(object):
+
+    """Write rows to a file as a JSON list of objects, one row at a time.
+
+    Like JSONLinesWriter but the output is a single JSON list. The closing
+    bracket is written by close().
+
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self._rows = 0
+
+    def writerow(self, row):
+        if self._rows:
+            self._f.write(',\n')
+        else:
+            self._f.write('[\n')
+        self._f.write(_json_dumps(row))
+        self._rows += 1
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        if self._rows:
+            self._f.write('\n]\n')
+        else:
+            self._f.write('[]\n')
+
+
+def _json_dumps(value):
+    """Return the given value as UTF8-encoded JSON text."""
+    text = json.dumps(value, ensure_ascii=False, default=unicode)
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return text
+
+
+def _pretty_cell(value, join=losser.join_list):
+    """Return the given cell value as a single line of text."""
+    if value is None:
+        return u''
+    if type(value) in (list, tuple):
+        value = join(value)
+        if isinstance(value, str):
+            value = value.decode('utf-8')
+    elif isinstance(value, str):
+        value = value.decode('utf-8')
+    else:
+        value = unicode(value)
+    return u' '.join(value.splitlines())
+
+
+def _truncate(text, width):
+    if len(text) <= width:
+        return text
+    if width > 3:
+        return text[:width - 3] + u'...'
+    return text[:width]
+
+
+class PrettyWriter(object):
+
+    """Write rows to a file as a pretty-printed, human-readable grid.
+
+    The column widths are worked out from the first ``sample_size`` rows (and
+    capped at ``max_width``) instead of from the whole table, so that after
+    the sample rows each row can be written as soon as it arrives. Cells that
+    are too wide for their column are truncated.
+
+    The header is all the keys of the sample rows, in the same order as
+    table() would put them. Rows after the sample can't add new keys.
+
+    :param f: the file to write to, could be an opened file, sys.stdout, or a
+        StringIO
+
+    :param sample_size: the number of rows to work out the widths from
+    :type sample_size: int
+
+    :param max_width: the maximum width of any column (default: no maximum)
+    :type max_width: int
+
+    :param joiners: see CSVWriter
+    :type joiners: dict
+
+    :param fieldnames: the header, if it's known in advance (default: work it
+        out from the sample rows)
+    :type fieldnames: list of strings
+
+    """
+
+    def __init__(self, f, sample_size=100, max_width=None, joiners=None,
+                 fieldnames=None):
+        self._f = f
+        self._sample_size = sample_size
+        self._max_width = max_width
+        self._joiners = joiners or {}
+        self._joins = None
+        self._sample = []
+        self._fieldnames = fieldnames
+        self._widths = None
+
+    def _write_line(self, cells, fill=u' ', edge=u'|'):
+        line = (edge + fill +
+                (fill + edge + fill).join(
+                    _truncate(cell, width).ljust(width, fill)
+                    for cell, width in zip(cells, self._widths)) +
+                fill + edge + u'\n')
+        self._f.write(line.encode('utf-8'))
+
+    def _write_border(self, fill=u'-'):
+        self._write_line([u''] * len(self._widths), fill=fill, edge=u'+')
+
+    def _write_row(self, row):
+        if not self._fieldnames_set.issuperset(row):
+            raise ValueError(
+                "The row has keys that aren't in the header: {0}".format(
+                    [key for key in row if key not in self._fieldnames_set]))
+        self._write_line([_pretty_cell(row.get(fieldname), join)
+                          for fieldname, join in zip(self._fieldnames,
+                                                     self._joins)])
+        self._write_border()
+
+    def _start(self):
+        """Work out the widths from the sample and write the sample rows."""
+        if self._fieldnames is None:
+            self._fieldnames = losser._csv_fieldnames(self._sample)
+        self._fieldnames_set = set(self._fieldnames)
+        self._joins = [self._joiners.get(fieldname, losser.join_list)
+                       for fieldname in self._fieldnames]
+        self._widths = []
+        for fieldname, join in zip(self._fieldnames, self._joins):
+            width = max([len(_pretty_cell(fieldname))] +
+                        [len(_pretty_cell(row.get(fieldname), join))
+                         for row in self._sample])
+            if self._max_width:
+                width = min(width, self._max_width)
+            self._widths.append(width)
+
+        self._write_border()
+        self._write_line([_pretty_cell(fieldname)
+                          for fieldname in self._fieldnames])
+        self._write_border(fill=u'=')
+        for row in self._sample:
+            self._write_row(row)
+        self._sample = None
+
+    def writerow(self, row):
+        if self._widths is not None:
+            self._write_row(row)
+        else:
+            self._sample.append(row)
+            if len(self._sample) >= self._sample_size:
+                self._start()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        if self._widths is None and self._sample:
+            self._start()
+
+
+def iter_csv(rows, chunk_size=64 * 1024, joiners=None):
+    """Yield the given rows as chunks of UTF8-encoded CSV text.
+
+    This is for streaming CSV into an HTTP response (for example by returning
+    it from a WSGI app) without building the whole CSV string first.
+
+    :param rows: the rows to write
+    :type rows: iterable of dicts
+
+    :param chunk_size: the approximate size (in bytes) of each chunk, each
+        chunk is made of whole rows so they can be a little bigger than this
+    :type chunk_size: int
+
+    :param joiners: see CSVWriter
+    :type joiners: dict
+
+    :rtype: iterator of strings
+
+    """
+    buffer_ = cStringIO.StringIO()
+    writer = FastCSVWriter(buffer_, buffer_size=0, joiners=joiners)
+    for row in rows:
+        writer.writerow(row)
+        if buffer_.tell() >= chunk_size:
+            yield buffer_.getvalue()
+            buffer_.seek(0)
+            buffer_.truncate()
+    if buffer_.tell():
+        yield buffer_.getvalue()
+
+
+def shard_path(path, number):
+    """Return the path of the given numbered shard of the given output file.
+
+    For example shard 3 of ``export.csv`` is ``export-00003.csv``.
+
+    """
+    root, ext = os.path.splitext(path)
+    return "{0}-{1:05d}{2}".format(root, number, ext)
+
+
+class ShardedCSVWriter(object):
+
+    """Write rows as CSV to a numbered series of files, each with a header.
+
+    A new file is started whenever the current one has ``shard_rows`` rows,
+    or whenever adding the next row would take it over ``shard_bytes``
+    bytes (a single row that's bigger than ``shard_bytes`` on its own gets a
+    file to itself).
+
+    :param path: the output file path that the shard paths are based on,
+        see shard_path()
+    :type path: string
+
+    :param shard_rows: the maximum number of rows (not counting the header)
+        per file
+    :type shard_rows: int
+
+    :param shard_bytes: the maximum size of each file in bytes
+    :type shard_bytes: int
+
+    :param joiners: see CSVWriter
+    :type joiners: dict
+
+    :ivar paths: the paths of the files that have been written so far
+
+    """
+
+    def __init__(self, path, shard_rows=None, shard_bytes=None,
+                 joiners=None):
+        assert shard_rows or shard_bytes
+        self._path = path
+        self._joiners = joiners
+        self._shard_rows = shard_rows
+        self._shard_bytes = shard_bytes
+        self.paths = []
+
+        # Each row is encoded into this buffer first so that we know its size
+        # before deciding which file to write it to.
+        self._buffer = cStringIO.StringIO()
+        self._writer = None
+        self._header = None
+
+        self._f = None
+        self._rows = 0
+        self._bytes = 0
+
+    def _take_buffer(self):
+        """Return the buffer's contents and empty it."""
+        contents = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return contents
+
+    def _shard_is_full(self, next_row_size):
+        if self._rows == 0:
+            return False
+        if self._shard_rows and self._rows >= self._shard_rows:
+            return True
+        if (self._shard_bytes and
+                self._bytes + next_row_size > self._shard_bytes):
+            return True
+        return False
+
+    def _next_shard(self):
+        self.close()
+        path = shard_path(self._path, len(self.paths) + 1)
+        self._f = open(path, 'wb')
+        self.paths.append(path)
+        self._f.write(self._header)
+        self._rows = 0
+        self._bytes = len(self._header)
+
+    def writerow(self, row):
+        if self._writer is None:
+            self._writer = FastCSVWriter(self._buffer, row.keys(),
+                                         buffer_size=0,
+                                         joiners=self._joiners)
+            self._header = self._take_buffer()
+
+        self._writer.writerow(row)
+        encoded = self._take_buffer()
+
+        if self._f is None or self._shard_is_full(len(encoded)):
+            self._next_shard()
+
+        self._f.write(encoded)
+        self._rows += 1
+        self._bytes += len(encoded)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class PartitionColumnError(Exception):
+
+    """Raised when partitioning by a column that isn't in the output."""
+
+    pass
+
+
+def _partition_name(value):
+    """Return a filename-safe version of the given cell value."""
+    if value is None:
+        value = ''
+    name = re.sub(r'[^\w.-]+', '_', unicode(value), flags=re.UNICODE)
+    return name.strip('._') or '_'
+
+
+class PartitionedCSVWriter(object):
+
+    """Write each row as CSV to a file chosen by the row's value in a column.
+
+    For example partitioning ``export.csv`` by an "Organization" column
+    writes rows with "Organization" "Health" to ``export-Health.csv``, rows
+    with "Organization" "Transport" to ``export-Transport.csv``, etc. Each
+    file gets a header row.
+
+    Only ``max_open_files`` files are kept open at once. When another file
+    needs to be opened the least recently used one is closed, and reopened in
+    append mode if more rows for it arrive later.
+
+    :param path: the output file path that the partition paths are based on
+    :type path: string
+
+    :param column: the title of the column to partition by
+    :type column: string
+
+    :param max_open_files: the maximum number of files to keep open at once
+    :type max_open_files: int
+
+    :param joiners: see CSVWriter
+    :type joiners: dict
+
+    :ivar paths: a dict mapping the partition column values (after joining
+        lists into strings) to the paths of the files that their rows were
+        written to
+
+    """
+
+    def __init__(self, path, column, max_open_files=64, joiners=None):
+        assert max_open_files > 0
+        self._joiners = joiners or {}
+        self._root, self._ext = os.path.splitext(path)
+        self._column = column
+        self._max_open_files = max_open_files
+        self._fieldnames = None
+        self.paths = {}
+
+        # The open files and their CSVWriters, least recently used first.
+        self._open = collections.OrderedDict()
+
+    def _path(self, name):
+        """Return a path for a new partition, not clashing with earlier ones.
+
+        """
+        used = set(self.paths.values())
+        path = "{0}-{1}{2}".format(self._root, name, self._ext)
+        number = 1
+        while path in used:
+            number += 1
+            path = "{0}-{1}-{2}{3}".format(self._root, name, number,
+                                           self._ext)
+        return path
+
+    def _writer(self, key):
+        """Return the CSVWriter for the given partition, opening it if needed.
+
+        """
+        if key in self._open:
+            # Move it to the most recently used end.
+            self._open[key] = self._open.pop(key)
+            return self._open[key][1]
+
+        if len(self._open) >= self._max_open_files:
+            _, (f, _) = self._open.popitem(last=False)
+            f.close()
+
+        if key in self.paths:
+            f = open(self.paths[key], 'ab')
+            writer = CSVWriter(f, self._fieldnames, write_header=False,
+                               joiners=self._joiners)
+        else:
+            self.paths[key] = self._path(_partition_name(key))
+            f = open(self.paths[key], 'wb')
+            writer = CSVWriter(f, self._fieldnames, joiners=self._joiners)
+        self._open[key] = (f, writer)
+        return writer
+
+    def writerow(self, row):
+        if self._fieldnames is None:
+            if self._column not in row:
+                raise PartitionColumnError(
+                    "Can't partition by {0!r}, there's no column with that "
+                    "title".format(self._column))
+            self._fieldnames = row.keys()
+
+        value = row.get(self._column)
+        if type(value) in (list, tuple):
+            value = self._joiners.get(self._column, losser.join_list)(value)
+
+        self._writer(value).writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        while self._open:
+            _, (f, _) = self._open.popitem()
+            f.close()
+
+
+def _decode(value):
+    """Return the given value with any byte strings decoded from UTF8."""
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    elif type(value) in (list, tuple):
+        return [_decode(item) for item in value]
+    return value
+
+
+class ParquetSchemaError(Exception):
+
+    """Raised when a column's values can't be written to a Parquet file.
+
+    Either the values in the first row group are of types that don't go
+    together in one column (for example ints and strings), or a later row
+    group has values that don't fit the column type inferred from the first.
+
+    """
+
+    pass
+
+
+def _fits(value, type_):
+    """Return True if the given value can be written as the pyarrow type
+    without losing anything."""
+    import pyarrow.types as types
+    if value is None:
+        return True
+    if types.is_list(type_):
+        return (type(value) in (list, tuple) and
+                all(_fits(item, type_.value_type) for item in value))
+    if types.is_string(type_):
+        return isinstance(value, basestring)
+    if types.is_boolean(type_):
+        return isinstance(value, bool)
+    if types.is_integer(type_):
+        return isinstance(value, (int, long)) and not isinstance(value, bool)
+    if types.is_floating(type_):
+        return (isinstance(value, (int, long, float)) and
+                not isinstance(value, bool))
+    if types.is_timestamp(type_):
+        return isinstance(value, datetime.datetime)
+    # Any other types are left to pyarrow, which won't do unsafe casts.
+    return True
+
+
+class ParquetWriter(object):
+
+    """Write rows to a Parquet file, ``row_group_size`` rows at a time.
+
+    Unlike CSV, Parquet keeps the types of the values: ints, floats and
+    booleans are written as such, and list values are written as lists rather
+    than being joined into strings. Since a column's query returns a single
+    value instead of a one-item list when it only matches one thing, a column
+    that has any list values has all its other (non-None) values wrapped in
+    lists too.
+
+    The schema is inferred from the first row group, and later row groups
+    have to fit it: a column whose first values were all ints can't have a
+    float or a list later on, for example. Values are never converted to
+    make them fit, ParquetSchemaError is raised instead. Ints are fine in a
+    float column and single values are fine in a list column.
+
+    Requires `pyarrow <https://arrow.apache.org/docs/python/>`_.
+
+    :param path: the path of the file to write
+    :type path: string
+
+    :param row_group_size: the number of rows to buffer and write as each row
+        group
+    :type row_group_size: int
+
+    :param fieldnames: the columns, if they're known in advance (default:
+        the first row's keys). If no rows are written the file still gets
+        written, with a string column for each of these.
+    :type fieldnames: list of strings
+
+    :raises ImportError: if pyarrow isn't installed
+
+    """
+
+    def __init__(self, path, row_group_size=64 * 1024, fieldnames=None):
+        import pyarrow
+        import pyarrow.parquet
+        self._pyarrow = pyarrow
+        self._parquet = pyarrow.parquet
+        self._path = path
+        self._row_group_size = row_group_size
+        self._fieldnames = None
+        self._schema = None
+        self._writer = None
+        self._columns = None
+        self._closed = False
+        if fieldnames:
+            self._start(fieldnames)
+
+    def _array(self, name, values, type_=None):
+        """Return the given column values as a pyarrow array.
+
+        :param type_: the column's type in the schema, or None to infer it
+            from the values
+
+        :raises ParquetSchemaError: if the values don't fit ``type_``, or
+            don't go together if it's None
+
+        """
+        pyarrow = self._pyarrow
+        # pyarrow would write byte strings as binary, not as text.
+        values = [_decode(value) for value in values]
+        if type_ is None:
+            is_list = any(type(value) in (list, tuple) for value in values)
+        else:
+            is_list = pyarrow.types.is_list(type_)
+        if is_list:
+            values = [value if value is None or
+                      type(value) in (list, tuple) else [value]
+                      for value in values]
+        if type_ is not None:
+            for value in values:
+                if not _fits(value, type_):
+                    raise ParquetSchemaError(
+                        "Can't write {0!r} to the {1!r} column, which the "
+                        "first row group made a {2} column (try a bigger "
+                        "row group size)".format(value, name, type_))
+        try:
+            array_ = pyarrow.array(values, type=type_)
+        except (pyarrow.ArrowException, TypeError, ValueError) as err:
+            raise ParquetSchemaError(
+                "Can't write the values of the {0!r} column to Parquet, they "
+                "have mixed types: {1}".format(name, err))
+        if array_.type == pyarrow.null():
+            array_ = pyarrow.array(values, type=pyarrow.string())
+        return array_
+
+    def _flush(self):
+        if not self._columns or not self._columns[0]:
+            return
+        pyarrow = self._pyarrow
+        if self._schema is None:
+            arrays = [self._array(name, values) for name, values
+                      in zip(self._fieldnames, self._columns)]
+            self._schema = pyarrow.schema(
+                [pyarrow.field(name, array_.type)
+                 for name, array_ in zip(self._fieldnames, arrays)])
+            self._writer = self._parquet.ParquetWriter(
+                self._path, self._schema)
+        else:
+            arrays = [self._array(field.name, values, field.type)
+                      for values, field in zip(self._columns, self._schema)]
+        table_ = pyarrow.Table.from_arrays(arrays, schema=self._schema)
+        self._writer.write_table(table_)
+        self._columns = [[] for _ in self._fieldnames]
+
+    def _start(self, fieldnames):
+        self._fieldnames = list(fieldnames)
+        self._columns = [[] for _ in self._fieldnames]
+
+    def writerow(self, row):
+        if self._fieldnames is None:
+            self._start(row.keys())
+        elif set(row.keys()) - set(self._fieldnames):
+            raise ValueError(
+                "Row has columns that the file doesn't: {0}".format(
+                    ", ".join(set(row.keys()) - set(self._fieldnames))))
+        for values, fieldname in zip(self._columns, self._fieldnames):
+            values.append(row.get(fieldname))
+        if len(self._columns[0]) >= self._row_group_size:
+            self._flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._flush()
+        if self._writer is None:
+            # No rows, write a file with no row groups rather than no file.
+            pyarrow = self._pyarrow
+            self._schema = pyarrow.schema(
+                [pyarrow.field(name, pyarrow.string())
+                 for name in self._fieldnames or []])
+            self._writer = self._parquet.ParquetWriter(
+                self._path, self._schema)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None